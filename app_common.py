@@ -0,0 +1,3500 @@
+"""Rendering infrastructure shared by app_main.py and app_videos.py
+
+Each app keeps what differs between them (presets, layouts, compose graphs,
+per-job rendering) and reaches everything here as common.X, so the settings
+its command line assigns are the ones these functions read. Functions that
+drive a whole run take the app module itself for its per-app steps.
+"""
+import os
+import subprocess
+import sys
+import re
+import json
+import random
+import hashlib
+import shutil
+import platform
+import argparse
+import csv
+import atexit
+import signal
+import tempfile
+import time
+import socket
+import socketserver
+import threading
+import http.server
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from tqdm import tqdm
+
+random.seed()  # Initialize with system time
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+INPUT_DIR = os.path.join(BASE_DIR, "input")
+OUTPUT_DIR = os.path.join(BASE_DIR, "output")
+os.makedirs(OUTPUT_DIR, exist_ok=True)
+SCRATCH_DIR = OUTPUT_DIR  # temp WAV/PNG files and in-progress renders (see --scratch-dir)
+CACHE_DIR = os.path.join(BASE_DIR, "cache")
+AUDIO_CACHE_DIR = os.path.join(CACHE_DIR, "audio")
+ANALYSIS_INDEX_PATH = os.path.join(CACHE_DIR, "analysis_index.json")
+ANALYSIS_CACHE_DIR = os.path.join(CACHE_DIR, "analysis")
+PRECOMPOSITE_DIR = os.path.join(CACHE_DIR, "precomposite")
+THREAD_PROFILE_PATH = os.path.join(CACHE_DIR, "thread_profiles.json")
+INPUT_INDEX_PATH = os.path.join(CACHE_DIR, "input_index.json")
+DECK_DIR = os.path.join(CACHE_DIR, "decks")
+RADIAL_LUT_DIR = os.path.join(CACHE_DIR, "radial")
+
+IS_WINDOWS = sys.platform.startswith('win')
+APP_NAME = None  # set by the importing app; thread profiles and the input index are kept per app
+
+# Track temp files for cleanup
+TEMP_FILES = []
+CURRENT_PROCESS = None
+
+# Input discovery: the input tree is walked with os.scandir into a cached
+# index and rescans only re-list folders whose mtime changed; a CSV/JSON
+# manifest (--manifest) can list jobs explicitly instead
+AUDIO_EXTENSIONS = ('.wav', '.mp3', '.m4a', '.flac', '.ogg', '.aac')
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi', '.mkv', '.webm')
+
+# Background selection: each clip library is dealt from a shuffled deck kept
+# under DECK_DIR, so clips don't repeat until the deck runs out, across runs
+# and between parallel workers (draws are serialized by a file lock). Off by
+# default (--deck): a dealt background depends on the deck's persisted
+# position, so a seedless layout would no longer be reproducible from the song
+DECK_ENABLED = False
+DECK_WEIGHTING = None  # None, "duration" or (app_videos) "brightness": extra copies per deck cycle
+DECK_DURATION_UNIT = 30  # seconds of clip per deck copy when weighting by duration
+DECK_MAX_COPIES = 4
+DECKS = {}  # in-process copy of each deck's order, reloaded when another process reshuffles
+
+# Preview mode settings
+PREVIEW_SECONDS = 20
+PREVIEW_SCALE = 0.5
+CONTACT_SHEET_COLS = 4
+CONTACT_SHEET_ROWS = 3
+
+# Teaser mode settings: a full-quality render of only the song's highlight,
+# seeked to directly instead of cut from a finished render
+TEASER_SECONDS = 30
+TEASER_ONSET_WEIGHT = 1.0  # weight of rising energy against plain loudness when picking the window
+TEASER_SNAP_BEATS = False
+TEASER_FADE_SECONDS = 0.5
+
+# Final audio track: sources already in AAC are stream-copied, anything else
+# is encoded once per song and settings and cached under AUDIO_CACHE_DIR
+AAC_PASSTHROUGH_EXTENSIONS = ('.m4a', '.aac', '.mp4')
+AAC_ENCODE_ARGS = ["-ac", "2", "-ar", "44100", "-c:a", "aac", "-b:a", "192k"]
+AUDIO_HASHES = {}
+
+# Optional EBU R128 loudness normalization (two-pass loudnorm; the first-pass
+# measurement is cached per audio hash in the analysis index)
+LOUDNORM_ENABLED = False
+LOUDNORM_TARGET = {"I": -14.0, "TP": -1.5, "LRA": 11.0}
+
+# Scratch space budget: new jobs wait while in-progress temp files would
+# exceed the budget or the scratch filesystem is out of room
+SCRATCH_BUDGET_BYTES = None
+SCRATCH_VIDEO_BYTES_PER_SECOND = 1000000  # rough in-progress MP4 size estimate
+SCRATCH_POLL_SECONDS = 5
+SCRATCH_WAIT_TIMEOUT = 3600
+
+# Output container: "faststart" moves the moov atom to the front after the
+# encode (a second pass over the whole file), "fragmented" writes moof/mdat
+# fragments as it encodes so the file is complete the moment ffmpeg exits
+OUTPUT_MODE = "faststart"
+FRAGMENT_SECONDS = 2  # keyframe interval; each keyframe starts a new fragment
+RENDER_STATS = []
+
+# Resource accounting: on POSIX every ffmpeg/ImageMagick child a job starts is
+# reaped with os.wait4 and its CPU time, peak RSS and block I/O are charged to
+# that job; finished job records are appended to USAGE_LOG_PATH (JSON lines)
+USAGE_LOG_PATH = os.path.join(CACHE_DIR, "usage.jsonl")
+JOB_USAGE = []
+CURRENT_USAGE = None  # totals for the job in progress, None outside a job
+
+# Distributed rendering: a coordinator hands work units to workers over TCP
+# (one JSON line per message); media and outputs live on a shared filesystem
+# mounted at the same path on every node
+SEGMENT_THRESHOLD = 900  # seconds; longer tracks are split into segment units
+SEGMENT_SECONDS = 300
+SEGMENTS_DIR = os.path.join(OUTPUT_DIR, "_segments")
+HEARTBEAT_SECONDS = 5
+HEARTBEAT_TIMEOUT = 30  # a worker silent this long loses its unit
+UNIT_MAX_ATTEMPTS = 3
+DISTRIBUTED_SETTINGS = ("LOUDNORM_ENABLED", "BEAT_PULSE_ENABLED", "PRECOMPOSITE_ENABLED", "OUTPUT_MODE",
+                        "DECK_ENABLED", "DECK_WEIGHTING", "SIDECARS_ENABLED", "VISUAL_FPS", "STALL_TIMEOUT",
+                        "FORMAT_PLAN_ENABLED")
+PROGRESS_LISTENERS = []  # callables receiving (desc, percent) from run_with_progress
+
+# Thread allocation: the host CPU budget (affinity + cgroup quota) is split
+# between concurrent jobs, then into decoder/filter-graph/encoder threads.
+# Every rendering process holds a slot file under RENDER_SLOTS_DIR, so the
+# share follows however many renders (e.g. local workers) run on this host
+JOB_CONCURRENCY = None  # fixed number of renders sharing the host (--concurrency); None counts the slots
+RENDER_SLOTS_DIR = os.path.join(CACHE_DIR, "render_slots")
+TUNE_SECONDS = 10  # length of the benchmark slice used by --tune-threads
+
+# Filter-graph profiling (--profile-graph): each node of a job's compose
+# graph is removed or stood in for in turn and a short slice re-run, so the
+# time saved is attributed to that node
+PROFILE_SECONDS = 5
+# Routing and format nodes do no work of their own; removing a geometry node
+# changes every frame size downstream, so neither kind is ablated
+PROFILE_STRUCTURAL_FILTERS = {"split", "asplit", "null", "anull", "format", "aformat", "setsar", "setpts",
+                              "asetpts", "trim", "atrim", "fps", "settb", "loop", "sendcmd",
+                              "nullsink", "anullsink", "scale", "crop", "pad"}
+AUDIO_VISUALIZER_FILTERS = {"showfreqs", "showwaves", "showspectrum", "showcqt", "avectorscope",
+                            "showvolume", "ahistogram"}
+VIDEO_SOURCE_FILTERS = {"movie", "color", "nullsrc", "testsrc"}
+AUDIO_SOURCE_FILTERS = {"amovie", "anullsrc", "sine", "aevalsrc"}
+
+# Loop-period precomposite (--precomposite): the non-audio layers are rendered
+# once for one loop of the background clip, cached, and looped under the
+# waveform. Off by default: the intermediate is a lossy encode, so the
+# background goes through one more generation than a live composite
+PRECOMPOSITE_ENABLED = False
+PRECOMPOSITE_MIN_LOOPS = 2  # only worth it when the song spans several loop periods
+PRECOMPOSITE_ENCODE_ARGS = ["-c:v", "libx264", "-preset", "veryfast", "-crf", "10", "-pix_fmt", "yuv420p"]
+
+# Snippet batching (--batch-short): full renders of songs up to
+# BATCH_MAX_SECONDS that share a background are composed by one ffmpeg
+# with a waveform branch and an output per song, so process start-up, graph
+# set-up and the background decode are paid once per batch, not once per song
+BATCH_SHORT_ENABLED = False
+BATCH_MAX_SECONDS = 30
+BATCH_MAX_JOBS = 8
+
+# Live mode: the playlist plays through one long-running ffmpeg paced at real
+# time. Every track is prepared as a FLAC in one common format plus a cached
+# background loop, so both streams are read as concat lists and a track change
+# is only the next list entry: no new process and no encoder re-initialisation
+LIVE_FPS = 30
+LIVE_GOP_SECONDS = 2
+LIVE_VIDEO_ARGS = ["-c:v", "libx264", "-preset", "veryfast", "-b:v", "4500k", "-maxrate", "4500k",
+                   "-bufsize", "9000k", "-pix_fmt", "yuv420p", "-sc_threshold", "0"]
+LIVE_AUDIO_ARGS = ["-c:a", "aac", "-b:a", "192k"]
+LIVE_FLAC_ARGS = ["-ac", "2", "-ar", "44100", "-sample_fmt", "s16", "-c:a", "flac"]
+# B-frames shift the start of every concatenated loop by a couple of frames,
+# which adds up and drags the background changes behind the track changes
+LIVE_BACKGROUND_ENCODE_ARGS = PRECOMPOSITE_ENCODE_ARGS + ["-bf", "0"]
+LIVE_MIN_SPEED = 0.95  # warn when the encoder can't keep up with real time
+LIVE_HLS_SEGMENT_SECONDS = 4
+LIVE_HLS_LIST_SIZE = 6
+LIVE_STREAM_FORMATS = {"rtmp": "flv", "rtmps": "flv", "udp": "mpegts", "srt": "mpegts", "tcp": "mpegts"}
+
+# Compilations: finished per-track renders are joined by stream copy; only the
+# keyframe-bounded stretches around crossfades and title cards are re-encoded, with the
+# renders' own x264 settings so every piece shares one H.264 setup. The audio is
+# decoded from the renders and encoded once as a single continuous track: each
+# render's AAC stream starts with its own encoder priming, which stream copy
+# would leave as a short gap at every join
+FINAL_ENCODE_ARGS = ["-preset", "medium", "-crf", "23"]
+COMPILE_CROSSFADE_SECONDS = 0.0
+# The concat demuxer keeps only the first file's SPS/PPS, so level and the
+# extradata hash must match as well as the visible stream parameters
+COMPILE_VIDEO_FIELDS = ("codec_name", "profile", "level", "width", "height", "pix_fmt", "r_frame_rate",
+                        "sample_aspect_ratio", "extradata_hash")
+# Boundary clips are encoded with the x264 settings read back from the encoder
+# SEI of the render they splice into: those fix the SPS/PPS (refs, B-frames,
+# CABAC, weighted prediction, 8x8 transform), the GOP and the rate control
+COMPILE_X264_OPTIONS = ("cabac", "ref", "bframes", "b_pyramid", "weightb", "weightp", "8x8dct", "interlaced",
+                        "keyint", "keyint_min", "scenecut", "me", "subme", "trellis", "psy_rd",
+                        "rc_lookahead", "crf")
+COMPILE_SEI_SEARCH_BYTES = 32 * 1024 * 1024  # the SEI is in the first frame, after a faststart moov
+
+# Beat-reactive background: onset/beat map computed once per audio hash and
+# turned into a sendcmd script that pulses an eq filter on every beat
+BEAT_PULSE_ENABLED = False
+BEAT_ANALYSIS_VERSION = 1
+BEAT_SAMPLE_RATE = 11025
+BEAT_FFT_SIZE = 1024
+BEAT_HOP = 256
+BEAT_BANDS = ((20, 150), (150, 2000), (2000, 5500))  # Hz: low, mid, high
+BEAT_TEMPO_RANGE = (60, 180)  # BPM
+BEAT_PULSE_LENGTH = 0.12  # seconds
+BEAT_PULSE_BRIGHTNESS = 0.08
+BEAT_PULSE_SATURATION = 0.3
+
+# Radial spectrum: a linear showfreqs plot is warped into a ring by ffmpeg's
+# remap filter using polar index maps computed once per geometry
+RADIAL_INNER_RADIUS = 0.35  # fractions of half the layer size
+RADIAL_OUTER_RADIUS = 0.95
+
+# Visual update rate: spectrum and vectorscope layers are computed and
+# post-processed at a preset's "visual_fps" (default VISUAL_FPS) and the
+# compose overlay repeats each frame up to the output rate ("visual_blend"
+# crossfades instead). Other types keep their own rate, which sets the look
+VISUAL_FPS = 15
+VISUAL_RATE_TYPES = ("radial", "circular", "bars", "vector")
+
+# Silent stretches: showfreqs draws nothing in silence, so the glow and the
+# waveform blend are switched off there with timeline expressions
+SILENCE_SKIP_TYPES = ("radial", "circular", "bars")
+# A stretch only counts as silent when no bar would reach one pixel: bar height
+# is amplitude (lin), its square root (sqrt) or cube root (cbrt) times the layer
+# height, so the RMS threshold is derived per ascale from the tallest layer
+SILENCE_BAR_PIXELS = 1080  # tallest a spectrum layer is drawn
+SILENCE_SCALE_EXPONENTS = {"lin": 1, "sqrt": 2, "cbrt": 3}
+SILENCE_THRESHOLD_LOG = 1e-6  # log scales show anything above showfreqs' minamp
+SILENCE_THRESHOLD_DIGITAL = 1e-9  # all-zero samples; the only silence loudness normalisation can't lift
+SILENCE_MIN_SECONDS = 1.0
+
+# Pixel formats: each layer works in one format and is converted once where it
+# enters the graph, so no filter forces a hidden per-frame swscale pass. The
+# still or title converts before its loop filter (once per render); the radial warp needs
+# unsubsampled chroma, so it works in 4:4:4. --format-report lists what remains
+FORMAT_PLAN_ENABLED = True
+LAYER_PIXEL_FORMATS = {"background": "yuv420p", "overlay": "yuva420p", "title": "yuva420p", "wave": "yuva420p",
+                       "radial": "yuva444p"}
+
+# Sidecars (--sidecars): thumbnail, poster and animated WebP taken from the
+# loudest part of the song as extra outputs of the compose pass
+SIDECARS_ENABLED = False
+THUMBNAIL_WIDTH = 480
+ANIMATION_SECONDS = 3
+ANIMATION_FPS = 12
+ANIMATION_WIDTH = 360
+
+# Metrics: Prometheus-style counters, gauges and histograms, served on an
+# optional localhost endpoint (--metrics-port) and/or written as a
+# node_exporter textfile (--metrics-textfile)
+METRICS_PORT = None
+METRICS_TEXTFILE = None
+METRICS_FLUSH_SECONDS = 5  # minimum gap between textfile rewrites during a stage
+METRIC_DEFINITIONS = {
+    "visualizer_jobs_started_total": ("counter", "Render jobs started", None),
+    "visualizer_jobs_succeeded_total": ("counter", "Render jobs that published their output", None),
+    "visualizer_jobs_failed_total": ("counter", "Render jobs that failed or were interrupted", None),
+    "visualizer_bytes_written_total": ("counter", "Bytes of published video output", None),
+    "visualizer_queue_depth": ("gauge", "Jobs or work units waiting to be rendered", None),
+    "visualizer_stage_progress_percent": ("gauge", "Progress of the running ffmpeg stage", None),
+    "visualizer_stage_fps": ("gauge", "Latest encode fps reported by the running ffmpeg stage", None),
+    "visualizer_stage_speed": ("gauge", "Latest realtime factor reported by the running ffmpeg stage", None),
+    "visualizer_stage_seconds": ("histogram", "Wall time of each ffmpeg stage",
+                                 (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)),
+    "visualizer_render_fps": ("histogram", "Final encode fps of each ffmpeg stage",
+                              (5, 10, 15, 20, 30, 45, 60, 90, 120, 240)),
+    "visualizer_realtime_factor": ("histogram", "Media seconds processed per wall second by each ffmpeg stage",
+                                   (0.25, 0.5, 1, 2, 4, 8, 16, 32, 64)),
+    "visualizer_live_tracks_total": ("counter", "Tracks started by the live stream", None),
+    "visualizer_stalls_total": ("counter", "ffmpeg stages killed by the stall watchdog", None),
+    "visualizer_child_cpu_seconds_total": ("counter", "CPU seconds used by ffmpeg/ImageMagick children", None),
+    "visualizer_child_block_operations_total": ("counter", "Block I/O operations by ffmpeg/ImageMagick children",
+                                                None),
+    "visualizer_job_peak_rss_bytes": ("histogram", "Largest child resident set size of each job",
+                                      (2 ** 26, 2 ** 27, 2 ** 28, 2 ** 29, 2 ** 30, 2 ** 31, 2 ** 32, 2 ** 33)),
+}
+METRICS = {}  # metric name -> {label tuple: value, or histogram counts}
+METRICS_LOCK = threading.Lock()
+METRICS_FLUSHED = [0.0]
+
+# Stall watchdog: an ffmpeg stage whose media time stops advancing for
+# STALL_TIMEOUT seconds before its last second, or that runs below
+# STALL_MIN_SPEED for STALL_SLOW_SECONDS, is killed with its whole process
+# group. Contact sheets, which emit their only frame at the end, opt out;
+# analysis passes (loudness, beats, envelopes) run through run_child and are
+# never watched. The job is retried one step of the app's STALL_FALLBACKS
+# lighter each time (the steps accumulate) and every stall is appended to
+# STALL_LOG_PATH
+STALL_TIMEOUT = 120  # 0 disables the watchdog
+STALL_MIN_SPEED = 0.05
+STALL_SLOW_SECONDS = 300
+STALL_FAST_ENCODE_ARGS = ["-preset", "veryfast", "-crf", "23"]
+STALL_LOG_PATH = os.path.join(CACHE_DIR, "stalls.jsonl")
+STALL_EVENTS = []
+
+# Command line: at most one mode runs per invocation. The render options only
+# shape the default batch render (and --check, for --preview), and the
+# dependent options only mean something next to the option they refine
+# (--title-cards only exists in app_videos)
+CLI_MODES = ("tune_threads", "profile_graph", "format_report", "live", "compile", "usage_report", "check",
+             "worker", "coordinator")
+CLI_RENDER_OPTIONS = ("preview", "teaser", "batch_short")
+CLI_MODE_RENDER_OPTIONS = {"check": ("preview",)}
+CLI_EXCLUSIVE_OPTIONS = (("preview", "teaser"), ("preview", "batch_short"), ("teaser", "batch_short"))
+CLI_DEPENDENT_OPTIONS = {"teaser_beats": "teaser", "live_loop": "live", "crossfade": "compile",
+                         "deck_weighting": "deck", "title_cards": "compile"}
+
+# Pre-flight: every input is probed and every distinct waveform graph is
+# dry-run on a thread pool before the first encode starts
+PREFLIGHT_ENABLED = True
+PREFLIGHT_WORKERS = 16
+PREFLIGHT_TIMEOUT = 30  # seconds per probe or dry run
+
+# Loudness envelope settings (low-rate mono decode, cached per audio hash)
+ENVELOPE_SAMPLE_RATE = 8000
+ENVELOPE_HOP = 0.1  # seconds per RMS value
+
+
+def cleanup_all_temp_files():
+    """Clean up all tracked temp files and kill running process"""
+    global CURRENT_PROCESS
+
+    # Kill running FFmpeg process
+    if CURRENT_PROCESS:
+        try:
+            # run_with_progress children lead their own process group, out of reach of the terminal's Ctrl+C
+            if not IS_WINDOWS and os.getpgid(CURRENT_PROCESS.pid) == CURRENT_PROCESS.pid:
+                os.killpg(CURRENT_PROCESS.pid, signal.SIGTERM)
+        except:
+            pass
+        try:
+            CURRENT_PROCESS.terminate()
+            CURRENT_PROCESS.wait(timeout=3)
+        except:
+            try:
+                CURRENT_PROCESS.kill()
+            except:
+                pass
+        CURRENT_PROCESS = None
+
+    # Clean up temp files
+    for f in TEMP_FILES:
+        try:
+            if os.path.exists(f):
+                os.remove(f)
+        except Exception as e:
+            pass  # File might be locked, will be overwritten next run
+
+
+def cleanup_startup_temp_files():
+    """Remove any leftover temp files from previous runs"""
+    temp_patterns = ['_tmp_audio.wav', '_tmp_*.wav', '_tmp_*.mp4', '_tmp_*.txt', '_tmp_*.png',
+                     '_tmp_*.jpg', '_tmp_*.webp']
+
+    cleaned = 0
+    for folder, pattern in [(d, p) for d in {OUTPUT_DIR, SCRATCH_DIR} for p in temp_patterns]:
+        if '*' in pattern:
+            # Handle wildcards
+            import glob
+            for temp_file in glob.glob(os.path.join(folder, pattern)):
+                try:
+                    os.remove(temp_file)
+                    cleaned += 1
+                except:
+                    pass  # File might be locked, FFmpeg will overwrite
+        else:
+            temp_file = os.path.join(folder, pattern)
+            if os.path.exists(temp_file):
+                try:
+                    os.remove(temp_file)
+                    cleaned += 1
+                except:
+                    pass
+
+    if cleaned > 0:
+        print(f"[*] Cleaned up {cleaned} leftover temp file(s)")
+
+
+def signal_handler(signum, frame):
+    """Handle Ctrl+C gracefully"""
+    print("\n\n[!] Interrupted! Cleaning up...")
+    cleanup_all_temp_files()
+    sys.exit(0)
+
+
+atexit.register(cleanup_all_temp_files)
+signal.signal(signal.SIGINT, signal_handler)
+if hasattr(signal, 'SIGTERM'):
+    signal.signal(signal.SIGTERM, signal_handler)
+
+
+def metric_labels(labels):
+    """Return a hashable, ordered label key"""
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def metric_inc(name, amount=1, **labels):
+    """Add to a counter"""
+    with METRICS_LOCK:
+        series = METRICS.setdefault(name, {})
+        key = metric_labels(labels)
+        series[key] = series.get(key, 0) + amount
+
+
+def metric_set(name, value, **labels):
+    """Set a gauge"""
+    with METRICS_LOCK:
+        METRICS.setdefault(name, {})[metric_labels(labels)] = value
+
+
+def metric_observe(name, value, **labels):
+    """Record one observation in a histogram"""
+    buckets = METRIC_DEFINITIONS[name][2]
+    with METRICS_LOCK:
+        series = METRICS.setdefault(name, {})
+        state = series.setdefault(metric_labels(labels), {"buckets": [0] * len(buckets), "sum": 0.0, "count": 0})
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                state["buckets"][i] += 1
+        state["sum"] += value
+        state["count"] += 1
+
+
+def format_metric_labels(key, extra=()):
+    """Render a label key in exposition format"""
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    rendered = []
+    for name, value in pairs:
+        value = value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        rendered.append(f'{name}="{value}"')
+    return "{" + ",".join(rendered) + "}"
+
+
+def format_metric_value(value):
+    """Render a sample value; integers stay exact"""
+    return str(value) if isinstance(value, int) else f"{value:.6f}".rstrip("0").rstrip(".")
+
+
+def render_metrics():
+    """Return all metrics in the Prometheus text exposition format"""
+    lines = []
+    with METRICS_LOCK:
+        for name, (kind, help_text, buckets) in METRIC_DEFINITIONS.items():
+            series = METRICS.get(name)
+            if not series:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key, value in sorted(series.items()):
+                if kind != "histogram":
+                    lines.append(f"{name}{format_metric_labels(key)} {format_metric_value(value)}")
+                    continue
+                for bound, count in zip(buckets, value["buckets"]):
+                    lines.append(f"{name}_bucket{format_metric_labels(key, [('le', f'{bound:g}')])} {count}")
+                lines.append(f"{name}_bucket{format_metric_labels(key, [('le', '+Inf')])} {value['count']}")
+                lines.append(f"{name}_sum{format_metric_labels(key)} {format_metric_value(value['sum'])}")
+                lines.append(f"{name}_count{format_metric_labels(key)} {value['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def flush_metrics(force=False):
+    """Rewrite the node_exporter textfile, at most every METRICS_FLUSH_SECONDS unless forced"""
+    if not METRICS_TEXTFILE:
+        return
+    now = time.time()
+    if not force and now - METRICS_FLUSHED[0] < METRICS_FLUSH_SECONDS:
+        return
+    METRICS_FLUSHED[0] = now
+
+    # node_exporter may read at any moment, so the file is replaced atomically
+    tmp_path = f"{METRICS_TEXTFILE}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(render_metrics())
+        os.replace(tmp_path, METRICS_TEXTFILE)
+    except OSError as e:
+        print(f"[!] Could not write metrics textfile: {e}")
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    """Serve /metrics"""
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port):
+    """Serve metrics on localhost in a background thread"""
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"[*] Metrics on http://127.0.0.1:{port}/metrics")
+    return server
+
+
+def get_stage_name(desc):
+    """Turn a progress description like '  ├─ Converting audio' into a metric label"""
+    words = re.sub(r"[^A-Za-z ]", " ", desc or "ffmpeg").split()
+    return "_".join(words).lower() or "ffmpeg"
+
+
+def new_usage():
+    """Return empty resource totals for a job"""
+    return {"children": 0, "user_seconds": 0.0, "system_seconds": 0.0, "max_rss_bytes": 0,
+            "block_input": 0, "block_output": 0}
+
+
+def record_child_usage(rusage):
+    """Charge a reaped child's rusage to the job in progress"""
+    if CURRENT_USAGE is None:
+        return
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss_bytes = rusage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    CURRENT_USAGE["children"] += 1
+    CURRENT_USAGE["user_seconds"] += rusage.ru_utime
+    CURRENT_USAGE["system_seconds"] += rusage.ru_stime
+    CURRENT_USAGE["max_rss_bytes"] = max(CURRENT_USAGE["max_rss_bytes"], rss_bytes)
+    CURRENT_USAGE["block_input"] += rusage.ru_inblock
+    CURRENT_USAGE["block_output"] += rusage.ru_oublock
+
+
+def wait_child(process):
+    """Wait for a child process; on POSIX reap it with os.wait4 to record its resource usage"""
+    if IS_WINDOWS:
+        return process.wait()
+    try:
+        _, status, rusage = os.wait4(process.pid, 0)
+    except ChildProcessError:
+        return process.wait()  # Already reaped, e.g. by the cleanup handler
+    process.returncode = os.waitstatus_to_exitcode(status)
+    record_child_usage(rusage)
+    return process.returncode
+
+
+def run_child(cmd, check=False, timeout=None, text=True, **kwargs):
+    """subprocess.run with captured output, reaping the child through wait_child"""
+    if IS_WINDOWS:
+        return subprocess.run(cmd, capture_output=True, text=text, check=check, timeout=timeout,
+                              creationflags=subprocess.CREATE_NO_WINDOW, **kwargs)
+
+    # Output goes to temp files rather than pipes so the child can be reaped
+    # directly without communicate() getting to it first
+    expired = []
+    with tempfile.TemporaryFile() as stdout_file, tempfile.TemporaryFile() as stderr_file:
+        process = subprocess.Popen(cmd, stdout=stdout_file, stderr=stderr_file, **kwargs)
+        timer = None
+        if timeout:
+            timer = threading.Timer(timeout, lambda: (expired.append(True), process.kill()))
+            timer.start()
+        try:
+            returncode = wait_child(process)
+        except BaseException:
+            process.kill()
+            process.wait()
+            raise
+        finally:
+            if timer:
+                timer.cancel()
+
+        outputs = []
+        for output_file in (stdout_file, stderr_file):
+            output_file.seek(0)
+            data = output_file.read()
+            outputs.append(data.decode("utf-8", errors="replace") if text else data)
+
+    if expired:
+        raise subprocess.TimeoutExpired(cmd, timeout, outputs[0], outputs[1])
+    if check and returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd, outputs[0], outputs[1])
+    return subprocess.CompletedProcess(cmd, returncode, outputs[0], outputs[1])
+
+
+def finish_job_usage(usage, preset_type, ok, wall_seconds, output_path):
+    """Attach a finished job's resource totals to its record, the metrics and the usage log"""
+    record = {"output": os.path.basename(output_path), "preset_type": preset_type, "ok": ok,
+              "wall_seconds": round(wall_seconds, 3), "finished": time.time(), **usage,
+              "user_seconds": round(usage["user_seconds"], 3),
+              "system_seconds": round(usage["system_seconds"], 3)}
+    JOB_USAGE.append(record)
+
+    metric_inc("visualizer_child_cpu_seconds_total", usage["user_seconds"], preset_type=preset_type, mode="user")
+    metric_inc("visualizer_child_cpu_seconds_total", usage["system_seconds"], preset_type=preset_type,
+               mode="system")
+    metric_inc("visualizer_child_block_operations_total", usage["block_input"], preset_type=preset_type,
+               direction="input")
+    metric_inc("visualizer_child_block_operations_total", usage["block_output"], preset_type=preset_type,
+               direction="output")
+    if usage["children"]:
+        metric_observe("visualizer_job_peak_rss_bytes", usage["max_rss_bytes"], preset_type=preset_type)
+
+    if USAGE_LOG_PATH:
+        try:
+            os.makedirs(os.path.dirname(USAGE_LOG_PATH), exist_ok=True)
+            with open(USAGE_LOG_PATH, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+        except OSError as e:
+            print(f"[!] Could not append to usage log: {e}")
+    return record
+
+
+def summarize_usage(records):
+    """Aggregate job usage records per preset type"""
+    summary = {}
+    for record in records:
+        entry = summary.setdefault(record["preset_type"], {**new_usage(), "jobs": 0, "wall_seconds": 0.0})
+        entry["jobs"] += 1
+        entry["wall_seconds"] += record["wall_seconds"]
+        for key in ("children", "user_seconds", "system_seconds", "block_input", "block_output"):
+            entry[key] += record[key]
+        entry["max_rss_bytes"] = max(entry["max_rss_bytes"], record["max_rss_bytes"])
+    return summary
+
+
+def print_usage_summary(records):
+    """Print per-preset CPU, memory and block I/O figures for sizing worker pools"""
+    summary = summarize_usage(records)
+    if not summary:
+        return
+    print("[*] Resource usage per preset type:")
+    for idx, (preset_type, entry) in enumerate(sorted(summary.items()), 1):
+        branch = "└─" if idx == len(summary) else "├─"
+        cpu_seconds = entry["user_seconds"] + entry["system_seconds"]
+        cores = cpu_seconds / entry["wall_seconds"] if entry["wall_seconds"] else 0.0
+        print(f"  {branch} {preset_type}: {entry['jobs']} job(s), {cpu_seconds / entry['jobs']:.1f}s CPU/job "
+              f"({entry['system_seconds'] / entry['jobs']:.1f}s sys), {cores:.2f} cores busy, "
+              f"peak RSS {format_size(entry['max_rss_bytes'])}, "
+              f"{entry['block_input']} blocks in / {entry['block_output']} out")
+
+
+def load_usage_log(path):
+    """Read the job records from a usage log, skipping malformed lines"""
+    records = []
+    try:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+    except OSError as e:
+        print(f"[!] Could not read usage log: {e}")
+    return records
+
+
+def kill_process_group(process):
+    """Kill a child started in its own session, together with anything it spawned"""
+    try:
+        if IS_WINDOWS:
+            process.kill()
+        else:
+            os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+def watch_for_stall(process, watch, stop):
+    """Kill the process once its progress stalls or its speed stays too low, noting why in watch"""
+    while not stop.wait(1.0):
+        now = time.time()
+        if watch["duration"] and watch["media_seconds"] >= watch["duration"] - 1.0:
+            # Only the muxer is left: writing the trailer, and moving the index
+            # to the front for +faststart, reports nothing however long it takes
+            continue
+        if now - watch["progress_at"] > watch["timeout"]:
+            watch["stalled"] = f"no progress for {watch['timeout']}s"
+        elif watch["slow_since"] and now - watch["slow_since"] > STALL_SLOW_SECONDS:
+            watch["stalled"] = f"below {STALL_MIN_SPEED}x for {STALL_SLOW_SECONDS}s"
+        else:
+            continue
+        kill_process_group(process)
+        return
+
+
+def run_with_progress(cmd, desc=None, duration=None, stall_timeout=None):
+    """Execute FFmpeg command with progress tracking (stall_timeout overrides STALL_TIMEOUT, 0 disables)"""
+    global CURRENT_PROCESS
+
+    if IS_WINDOWS:
+        CURRENT_PROCESS = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            creationflags=subprocess.CREATE_NO_WINDOW if IS_WINDOWS else 0
+        )
+    else:
+        import shlex
+        cmd_str = " ".join(shlex.quote(str(c)) for c in cmd)
+        CURRENT_PROCESS = subprocess.Popen(
+            cmd_str,
+            shell=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            start_new_session=True  # own process group, so the stall watchdog can kill the whole tree
+        )
+
+    # Create progress bar if we have duration info
+    pbar = None
+    if duration and desc:
+        pbar = tqdm(total=100, desc=desc, unit="%", leave=False,
+                    bar_format='{l_bar}{bar}| {n:.0f}% [{elapsed}<{remaining}]')
+
+    stderr_output = []
+    time_pattern = re.compile(r'time=(\d+):(\d+):(\d+\.\d+)')
+    fps_pattern = re.compile(r'fps=\s*(\d+(?:\.\d+)?)')
+    frame_pattern = re.compile(r'frame=\s*(\d+)')
+    speed_pattern = re.compile(r'speed=\s*(\d+(?:\.\d+)?)x')
+    stage = get_stage_name(desc)
+    stage_started = time.time()
+    last_fps = None
+
+    # A stuck filter or a corrupt looped input leaves readline() waiting
+    # forever, so a watchdog thread kills the process when progress stops
+    if stall_timeout is None:
+        stall_timeout = STALL_TIMEOUT
+    watch = {"progress_at": stage_started, "media_seconds": 0.0, "frames": 0, "slow_since": None,
+             "stalled": None, "timeout": stall_timeout, "duration": duration}
+    stop_watch = threading.Event()
+    if stall_timeout:
+        threading.Thread(target=watch_for_stall, args=(CURRENT_PROCESS, watch, stop_watch), daemon=True).start()
+
+    # Read stderr line by line
+    try:
+        while True:
+            line = CURRENT_PROCESS.stderr.readline()
+            if not line:
+                break
+            stderr_output.append(line)
+
+            # Output frames count as progress too: a stage can emit frames
+            # before its timestamps move (or without any, e.g. time=N/A)
+            frame_match = frame_pattern.search(line)
+            if frame_match and int(frame_match.group(1)) > watch["frames"]:
+                watch.update(frames=int(frame_match.group(1)), progress_at=time.time())
+
+            fps_match = fps_pattern.search(line)
+            if fps_match:
+                last_fps = float(fps_match.group(1))
+                metric_set("visualizer_stage_fps", last_fps, stage=stage)
+            speed_match = speed_pattern.search(line)
+            if speed_match:
+                speed = float(speed_match.group(1))
+                metric_set("visualizer_stage_speed", speed, stage=stage)
+                if speed >= STALL_MIN_SPEED:
+                    watch["slow_since"] = None
+                elif not watch["slow_since"]:
+                    watch["slow_since"] = time.time()
+
+            # Parse progress from FFmpeg output
+            match = time_pattern.search(line)
+            if match:
+                hours = int(match.group(1))
+                minutes = int(match.group(2))
+                seconds = float(match.group(3))
+                current_time = hours * 3600 + minutes * 60 + seconds
+                if current_time > watch["media_seconds"]:
+                    watch.update(media_seconds=current_time, progress_at=time.time())
+                if pbar and duration:
+                    progress = min((current_time / duration) * 100, 100)
+                    pbar.n = progress
+                    pbar.refresh()
+                    metric_set("visualizer_stage_progress_percent", progress, stage=stage)
+                    flush_metrics()
+                    for listener in PROGRESS_LISTENERS:
+                        listener(desc, progress)
+    except KeyboardInterrupt:
+        if pbar:
+            pbar.close()
+        raise
+    finally:
+        stop_watch.set()
+
+    returncode = wait_child(CURRENT_PROCESS)
+    CURRENT_PROCESS = None
+
+    if returncode == 0:
+        stage_seconds = time.time() - stage_started
+        metric_observe("visualizer_stage_seconds", stage_seconds, stage=stage)
+        if last_fps:
+            metric_observe("visualizer_render_fps", last_fps, stage=stage)
+        if duration and stage_seconds > 0:
+            metric_observe("visualizer_realtime_factor", duration / stage_seconds, stage=stage)
+    for name in ("visualizer_stage_progress_percent", "visualizer_stage_fps", "visualizer_stage_speed"):
+        metric_set(name, 0, stage=stage)
+    if watch["stalled"]:
+        STALL_EVENTS.append({"stage": stage, "reason": watch["stalled"],
+                             "media_seconds": round(watch["media_seconds"], 2),
+                             "wall_seconds": round(time.time() - stage_started, 1)})
+        metric_inc("visualizer_stalls_total", stage=stage)
+
+    if pbar:
+        if returncode == 0:
+            pbar.n = 100
+            pbar.refresh()
+        pbar.close()
+
+    if watch["stalled"]:
+        print(f"\n[!] {(desc or 'ffmpeg').strip(' ├└─')} stalled ({watch['stalled']}), killed")
+        return False
+
+    if returncode != 0:
+        print(f"\n[!] {(desc or 'ffmpeg').strip(' ├└─')} failed (exit code {returncode}):")
+        print("".join(stderr_output[-20:]))
+        return False
+
+    return True
+
+
+def get_cpu_budget():
+    """Return usable CPU count, honouring affinity and cgroup CPU quotas"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+
+    quota = None
+    try:
+        # cgroup v2: "max 100000" or "<quota> <period>"
+        with open("/sys/fs/cgroup/cpu.max", "r") as f:
+            limit, period = f.read().split()[:2]
+        if limit != "max":
+            quota = int(limit) / int(period)
+    except (OSError, ValueError):
+        try:
+            # cgroup v1
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us", "r") as f:
+                limit = int(f.read())
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us", "r") as f:
+                period = int(f.read())
+            if limit > 0:
+                quota = limit / period
+        except (OSError, ValueError):
+            pass
+
+    if quota:
+        cpus = min(cpus, max(1, int(quota)))
+    return max(1, cpus)
+
+
+def load_thread_profile():
+    """Return the tuned thread profile for this host and app, if any"""
+    try:
+        with open(THREAD_PROFILE_PATH, "r", encoding="utf-8") as f:
+            profiles = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return profiles.get(platform.node(), {}).get(APP_NAME)
+
+
+def claim_render_slot():
+    """Register this process as a render on this host until it exits"""
+    slot_path = os.path.join(RENDER_SLOTS_DIR, f"{platform.node()}_{os.getpid()}")
+    try:
+        os.makedirs(RENDER_SLOTS_DIR, exist_ok=True)
+        open(slot_path, "w").close()
+    except OSError as e:
+        print(f"[!] Could not register render slot: {e}")
+        return
+    atexit.register(lambda: os.path.exists(slot_path) and os.remove(slot_path))
+
+
+def get_job_concurrency():
+    """Return how many renders share this host: --concurrency, else the live render slots"""
+    if JOB_CONCURRENCY:
+        return JOB_CONCURRENCY
+
+    # The cache may sit on a shared filesystem, so only this host's slots count
+    prefix = f"{platform.node()}_"
+    running = 0
+    try:
+        names = os.listdir(RENDER_SLOTS_DIR)
+    except OSError:
+        return 1
+    for name in names:
+        if not name.startswith(prefix):
+            continue
+        try:
+            os.kill(int(name[len(prefix):]), 0)
+        except ValueError:
+            continue
+        except PermissionError:
+            pass  # Alive, owned by another user
+        except OSError:
+            try:
+                os.remove(os.path.join(RENDER_SLOTS_DIR, name))  # Left behind by a killed process
+            except OSError:
+                pass
+            continue
+        running += 1
+    return max(1, running)
+
+
+def allocate_threads(concurrency=None):
+    """Split this job's share of the CPU budget into decoder, filter-graph and encoder threads"""
+    concurrency = max(1, concurrency or get_job_concurrency())
+    budget = get_cpu_budget()
+    cores = max(1, budget // concurrency)
+
+    profile = load_thread_profile()
+    if profile and profile.get("cpus"):
+        factor = cores / profile["cpus"]
+        return {role: max(1, int(round(profile[role] * factor)))
+                for role in ("decoder", "filter", "encoder")}
+
+    # Untuned default: the serial showfreqs/boxblur/overlay chains get a
+    # quarter of the cores, x264 the rest
+    filter_threads = max(1, cores // 4)
+    return {
+        "decoder": 1 if cores < 8 else 2,
+        "filter": filter_threads,
+        "encoder": max(1, cores - filter_threads),
+    }
+
+
+def with_decoder_threads(input_args, threads):
+    """Insert a per-input -threads option before every -i in an input argument list"""
+    result = []
+    for i, arg in enumerate(input_args):
+        if arg == "-i" and (i == 0 or input_args[i - 1] != "-threads"):
+            result.extend(["-threads", str(threads["decoder"])])
+        result.append(arg)
+    return result
+
+
+def get_scratch_usage():
+    """Return bytes currently held by in-progress temp files in the scratch folder"""
+    used = 0
+    try:
+        with os.scandir(SCRATCH_DIR) as entries:
+            for entry in entries:
+                if entry.name.startswith("_tmp_") and entry.is_file():
+                    used += entry.stat().st_size
+    except OSError:
+        pass
+    return used
+
+
+def wait_for_scratch_space(required_bytes):
+    """Hold back a new job until the scratch folder has room for its intermediates"""
+    waited = 0
+    while True:
+        free = shutil.disk_usage(SCRATCH_DIR).free
+        used = get_scratch_usage()
+        fits_budget = not SCRATCH_BUDGET_BYTES or used + required_bytes <= SCRATCH_BUDGET_BYTES
+        if fits_budget and free >= required_bytes:
+            return True
+
+        if waited >= SCRATCH_WAIT_TIMEOUT:
+            print(f"[!] Scratch space still full after {waited}s "
+                  f"({used / 1e9:.1f} GB in use, {free / 1e9:.1f} GB free), skipping job")
+            return False
+
+        if waited == 0:
+            print(f"  ├─ Waiting for scratch space ({required_bytes / 1e9:.1f} GB needed)")
+        time.sleep(SCRATCH_POLL_SECONDS)
+        waited += SCRATCH_POLL_SECONDS
+
+
+def estimate_scratch_bytes(duration):
+    """Estimate scratch bytes for one job: PCM WAV plus the in-progress MP4"""
+    wav_bytes = duration * 44100 * 2 * 2
+    video_bytes = duration * SCRATCH_VIDEO_BYTES_PER_SECOND
+    return int(wav_bytes + video_bytes)
+
+
+def validate_output(path, expected_duration, streams=("video", "audio")):
+    """Check a finished render has the expected stream types and length"""
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-show_entries", "stream=codec_type:format=duration",
+        "-of", "default=noprint_wrappers=1",
+        path
+    ]
+    try:
+        if os.path.getsize(path) == 0:
+            return False
+        result = run_child(cmd, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return False
+
+    fields = [line.split("=", 1) for line in result.stdout.splitlines() if "=" in line]
+    stream_types = {value for key, value in fields if key == "codec_type"}
+    durations = [value for key, value in fields if key == "duration"]
+    if not set(streams) <= stream_types or not durations:
+        return False
+
+    try:
+        duration = float(durations[0])
+    except ValueError:
+        return False
+    return abs(duration - expected_duration) <= max(1.0, expected_duration * 0.02)
+
+
+def publish_output(scratch_path, final_path, expected_duration=None, streams=("video", "audio")):
+    """Validate a finished file and move it to its final name atomically"""
+    if expected_duration is not None and not validate_output(scratch_path, expected_duration, streams):
+        print(f"[!] Output failed validation, not publishing: {os.path.basename(final_path)}")
+        return False
+
+    final_dir = os.path.dirname(os.path.abspath(final_path))
+    os.makedirs(final_dir, exist_ok=True)
+
+    try:
+        os.replace(scratch_path, final_path)
+    except OSError:
+        # Different filesystem: copy next to the destination, then rename there
+        partial_path = os.path.join(final_dir, f".{os.path.basename(final_path)}.{os.getpid()}.partial")
+        TEMP_FILES.append(partial_path)
+        try:
+            with open(scratch_path, "rb") as src, open(partial_path, "wb") as dst:
+                shutil.copyfileobj(src, dst, 16 * 1024 * 1024)
+                dst.flush()
+                os.fsync(dst.fileno())
+            os.replace(partial_path, final_path)
+            os.remove(scratch_path)
+        except OSError as e:
+            print(f"[!] Could not publish {os.path.basename(final_path)}: {e}")
+            return False
+        TEMP_FILES.remove(partial_path)
+
+    if scratch_path in TEMP_FILES:
+        TEMP_FILES.remove(scratch_path)
+    return True
+
+
+def get_container_args(fps=None):
+    """Return MP4 muxer arguments for the configured OUTPUT_MODE (fps sets the fragment GOP)"""
+    if OUTPUT_MODE == "fragmented":
+        # empty_moov puts the track headers up front; the mfra index written
+        # at the end keeps the file seekable in desktop and web players
+        args = ["-movflags", "+frag_keyframe+empty_moov+default_base_moof"]
+        if fps:
+            args = ["-g", str(fps * FRAGMENT_SECONDS)] + args
+        return args
+    return ["-movflags", "+faststart"]
+
+
+def format_size(num_bytes):
+    """Format a byte count for log output"""
+    for unit in ["B", "KB", "MB", "GB"]:
+        if num_bytes < 1024 or unit == "GB":
+            return f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+
+
+def get_duration(path):
+    """Return media length in seconds"""
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-show_entries", "format=duration",
+        "-of", "default=noprint_wrappers=1:nokey=1",
+        path
+    ]
+    try:
+        result = run_child(cmd, check=True, timeout=10)
+        duration = float(result.stdout.strip())
+        return duration if duration > 0 else 30.0
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired, ValueError):
+        print(f"[!] Could not get duration for {os.path.basename(path)}, using 30s default")
+        return 30.0
+
+
+def get_audio_hash(path):
+    """Return a content hash of an audio file (memoized per path, size and mtime)"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+    if key in AUDIO_HASHES:
+        return AUDIO_HASHES[key]
+
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+
+    AUDIO_HASHES[key] = digest.hexdigest()
+    return AUDIO_HASHES[key]
+
+
+def get_audio_codec(path):
+    """Return the codec name of the first audio stream, or None"""
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-select_streams", "a:0",
+        "-show_entries", "stream=codec_name",
+        "-of", "default=noprint_wrappers=1:nokey=1",
+        path
+    ]
+    try:
+        result = run_child(cmd, check=True)
+        codec = result.stdout.strip().splitlines()
+        return codec[0] if codec else None
+    except (subprocess.CalledProcessError, OSError):
+        return None
+
+
+def can_pass_through_audio(audio_path, audio_filter=None):
+    """Return True when the source's own AAC stream can be muxed without re-encoding"""
+    return (not audio_filter
+            and audio_path.lower().endswith(AAC_PASSTHROUGH_EXTENSIONS)
+            and get_audio_codec(audio_path) == "aac")
+
+
+def prepare_audio_track(audio_path, duration, audio_filter=None):
+    """Return a stream-copyable AAC track for the song: the source itself or a cached encode"""
+    if can_pass_through_audio(audio_path, audio_filter):
+        print("  ├─ Audio: passing through source AAC")
+        return audio_path
+
+    audio_hash = get_audio_hash(audio_path)
+    if not audio_hash:
+        return None
+
+    filter_args = ["-af", audio_filter] if audio_filter else []
+    settings = " ".join(filter_args + AAC_ENCODE_ARGS)
+    settings = hashlib.sha1(settings.encode("utf-8")).hexdigest()[:8]
+    cached_track = os.path.join(AUDIO_CACHE_DIR, f"{audio_hash}_{settings}.m4a")
+    if os.path.exists(cached_track):
+        print("  ├─ Audio: reusing cached AAC track")
+        return cached_track
+
+    os.makedirs(AUDIO_CACHE_DIR, exist_ok=True)
+    tmp_track = cached_track + f".{os.getpid()}.tmp.m4a"
+    TEMP_FILES.append(tmp_track)
+
+    if not run_with_progress([
+        "ffmpeg", "-y", "-i", audio_path,
+        "-vn", *filter_args, *AAC_ENCODE_ARGS,
+        tmp_track
+    ], "  ├─ Encoding AAC track", duration):
+        return None
+
+    os.replace(tmp_track, cached_track)
+    TEMP_FILES.remove(tmp_track)
+    return cached_track
+
+
+def load_analysis_index():
+    """Load the per-audio-hash analysis index from the cache folder"""
+    try:
+        with open(ANALYSIS_INDEX_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def update_analysis_index(audio_hash, key, value):
+    """Store one analysis result for an audio hash, replacing the index atomically"""
+    index = load_analysis_index()
+    index.setdefault(audio_hash, {})[key] = value
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_path = f"{ANALYSIS_INDEX_PATH}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, ANALYSIS_INDEX_PATH)
+    except OSError as e:
+        print(f"[!] Could not update analysis index: {e}")
+
+
+def measure_loudness(audio_path, target):
+    """Run the loudnorm measurement pass and return its JSON statistics"""
+    cmd = [
+        "ffmpeg", "-hide_banner", "-i", audio_path,
+        "-vn", "-af", f"loudnorm={target}:print_format=json",
+        "-f", "null", "-"
+    ]
+    try:
+        result = run_child(cmd)
+        output = result.stderr
+        stats = json.loads(output[output.rindex("{"):output.rindex("}") + 1])
+        float(stats["input_i"])  # "-inf" for silent tracks is still a valid float
+        return stats
+    except (OSError, ValueError, KeyError):
+        print(f"[!] Could not measure loudness for {os.path.basename(audio_path)}")
+        return None
+
+
+def get_loudnorm_filter(audio_path):
+    """Return the second-pass loudnorm filter for a song, measuring once per audio hash"""
+    target = f"I={LOUDNORM_TARGET['I']}:TP={LOUDNORM_TARGET['TP']}:LRA={LOUDNORM_TARGET['LRA']}"
+    audio_hash = get_audio_hash(audio_path)
+    if not audio_hash:
+        return None
+
+    measured = load_analysis_index().get(audio_hash, {}).get("loudnorm")
+    if measured and measured.get("target") == target:
+        print("  ├─ Loudness: reusing cached measurement")
+    else:
+        print("  ├─ Loudness: measuring (first pass)")
+        measured = measure_loudness(audio_path, target)
+        if not measured:
+            return None
+        measured["target"] = target
+        update_analysis_index(audio_hash, "loudnorm", measured)
+
+    if not np.isfinite(float(measured["input_i"])):
+        return None  # Silence: nothing to normalize
+
+    return (
+        f"loudnorm={target}:"
+        f"measured_I={measured['input_i']}:measured_TP={measured['input_tp']}:"
+        f"measured_LRA={measured['input_lra']}:measured_thresh={measured['input_thresh']}:"
+        f"offset={measured['target_offset']}:linear=true"
+    )
+
+
+def get_clip_weight(path):
+    """Return how many copies of a clip go into each deck cycle under DECK_WEIGHTING"""
+    if DECK_WEIGHTING == "duration":
+        # Longer clips loop less visibly under a song, so deal them more often
+        return int(min(DECK_MAX_COPIES, max(1, get_duration(path) // DECK_DURATION_UNIT)))
+    return 1
+
+
+def lock_deck(lock_path):
+    """Open and exclusively lock a deck's lock file; closing the handle releases it"""
+    handle = open(lock_path, "a+")
+    if IS_WINDOWS:
+        import msvcrt
+        handle.seek(0)
+        msvcrt.locking(handle.fileno(), msvcrt.LK_LOCK, 1)
+    else:
+        import fcntl
+        fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+    return handle
+
+
+def write_deck_file(path, data):
+    """Replace a deck state or order file atomically"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def shuffle_deck(library_dir, extensions, deck, state, mtime, weigh):
+    """Shuffle a new deck cycle, rescanning the library only when its folder changed"""
+    consistent = deck.get("generation") == state["generation"]
+    changed = not consistent or deck.get("mtime") != mtime
+    if changed:
+        with os.scandir(library_dir) as entries:
+            names = sorted(e.name for e in entries
+                           if e.is_file() and e.name.lower().endswith(extensions))
+    else:
+        names = deck["names"]
+
+    # Weights are cached per clip and only measured for new or modified clips
+    old_weights = deck.get("weights", {})
+    weights = {}
+    for name in names:
+        stat = os.stat(os.path.join(library_dir, name))
+        signature = [stat.st_size, int(stat.st_mtime), DECK_WEIGHTING]
+        cached = old_weights.get(name)
+        if cached and cached[:3] == signature:
+            weights[name] = cached
+        else:
+            weights[name] = signature + [weigh(os.path.join(library_dir, name))]
+
+    cards = []
+    if consistent and changed and state["position"] < len(deck.get("order", [])):
+        # Library changed mid-cycle: keep the undealt cards and deal new clips in
+        known = set(deck.get("names", []))
+        cards = [name for name in deck["order"][state["position"]:] if name in weights]
+        cards += [name for name in names if name not in known for _ in range(weights[name][3])]
+    if not cards:
+        cards = [name for name in names for _ in range(weights[name][3])]
+
+    rng = random.Random()
+    rng.shuffle(cards)
+    if len(cards) > 1 and cards[0] == state.get("last"):
+        # Don't open a new cycle with the clip that closed the previous one
+        swap = rng.randrange(1, len(cards))
+        cards[0], cards[swap] = cards[swap], cards[0]
+
+    return {"generation": state["generation"] + 1, "mtime": mtime,
+            "names": names, "weights": weights, "order": cards}
+
+
+def draw_from_deck(library_dir, extensions, weigh=None):
+    """Deal the next clip from a library's persisted shuffled deck, reshuffled with weigh() when it runs out"""
+    key = hashlib.sha1(os.path.abspath(library_dir).encode("utf-8")).hexdigest()[:16]
+    state_path = os.path.join(DECK_DIR, f"{key}.json")
+    order_path = os.path.join(DECK_DIR, f"{key}.order.json")
+    os.makedirs(DECK_DIR, exist_ok=True)
+
+    lock = lock_deck(os.path.join(DECK_DIR, f"{key}.lock"))
+    try:
+        try:
+            with open(state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {"generation": 0, "position": 0}
+
+        # The large order file is only re-read after another process reshuffled
+        deck = DECKS.get(key)
+        if not deck or deck["generation"] != state["generation"]:
+            try:
+                with open(order_path, "r", encoding="utf-8") as f:
+                    deck = json.load(f)
+            except (OSError, ValueError):
+                deck = {}
+            DECKS[key] = deck
+
+        mtime = os.stat(library_dir).st_mtime_ns
+        if (deck.get("generation") != state["generation"] or deck.get("mtime") != mtime
+                or state["position"] >= len(deck.get("order", []))):
+            deck = shuffle_deck(library_dir, extensions, deck, state, mtime, weigh or get_clip_weight)
+            if not deck["order"]:
+                return None
+            write_deck_file(order_path, deck)
+            DECKS[key] = deck
+            state = {"generation": deck["generation"], "position": 0, "last": state.get("last")}
+
+        name = deck["order"][state["position"]]
+        state["position"] += 1
+        state["last"] = name
+        write_deck_file(state_path, state)
+        return os.path.join(library_dir, name)
+    finally:
+        lock.close()
+
+
+def get_song_seed(audio_path):
+    """Derive a stable seed from the song name so previews match final renders"""
+    name = os.path.splitext(os.path.basename(audio_path))[0]
+    return int(hashlib.sha1(name.encode("utf-8")).hexdigest()[:8], 16)
+
+
+def get_layout_path(output_path):
+    """Return the sidecar path storing the chosen layout for an output"""
+    return os.path.splitext(output_path)[0] + ".layout.json"
+
+
+def decode_mono(audio_path, sample_rate):
+    """Decode audio to a mono float32 NumPy array at the given sample rate"""
+    cmd = [
+        "ffmpeg", "-v", "error", "-i", audio_path,
+        "-vn", "-ac", "1", "-ar", str(sample_rate),
+        "-f", "s16le", "-"
+    ]
+    try:
+        result = run_child(cmd, text=False, check=True)
+    except (subprocess.CalledProcessError, OSError):
+        return np.zeros(0, dtype=np.float32)
+
+    return np.frombuffer(result.stdout, dtype=np.int16).astype(np.float32) / 32768.0
+
+
+def compute_loudness_envelope(samples, sample_rate):
+    """Return RMS per ENVELOPE_HOP of mono samples"""
+    hop = int(sample_rate * ENVELOPE_HOP)
+    frames = len(samples) // hop
+    if frames == 0:
+        return np.zeros(0, dtype=np.float32)
+
+    samples = samples[:frames * hop].reshape(frames, hop)
+    return np.sqrt(np.mean(samples ** 2, axis=1))
+
+
+def get_loudness_envelope(audio_path):
+    """Return the loudness envelope for a song, decoding it once per audio hash"""
+    audio_hash = get_audio_hash(audio_path)
+    cache_path = os.path.join(ANALYSIS_CACHE_DIR, f"{audio_hash}_envelope.npz") if audio_hash else None
+    if cache_path and os.path.exists(cache_path):
+        try:
+            with np.load(cache_path) as data:
+                if int(data["sample_rate"]) == ENVELOPE_SAMPLE_RATE and float(data["hop"]) == ENVELOPE_HOP:
+                    return data["envelope"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    envelope = compute_loudness_envelope(decode_mono(audio_path, ENVELOPE_SAMPLE_RATE), ENVELOPE_SAMPLE_RATE)
+    if not cache_path or len(envelope) == 0:
+        return envelope
+
+    os.makedirs(ANALYSIS_CACHE_DIR, exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            np.savez(f, envelope=envelope.astype(np.float32),
+                     sample_rate=ENVELOPE_SAMPLE_RATE, hop=ENVELOPE_HOP)
+        os.replace(tmp_path, cache_path)
+        update_analysis_index(audio_hash, "envelope", {
+            "sample_rate": ENVELOPE_SAMPLE_RATE,
+            "hop": ENVELOPE_HOP,
+            "frames": int(len(envelope)),
+        })
+    except OSError as e:
+        print(f"[!] Could not cache loudness envelope: {e}")
+
+    return envelope
+
+
+def find_loudest_window(envelope, window, duration):
+    """Return start time (seconds) of the loudest window of the given length"""
+    if window >= duration or len(envelope) == 0:
+        return 0.0
+
+    size = max(1, int(window / ENVELOPE_HOP))
+    if size >= len(envelope):
+        return 0.0
+
+    energy = np.concatenate(([0.0], np.cumsum(envelope ** 2)))
+    window_energy = energy[size:] - energy[:-size]
+    start = int(np.argmax(window_energy)) * ENVELOPE_HOP
+    return float(min(start, duration - window))
+
+
+def find_teaser_window(audio_path, window, duration):
+    """Return start time (seconds) of the window with the most loudness and onset energy"""
+    envelope = get_loudness_envelope(audio_path)
+    size = int(window / ENVELOPE_HOP)
+    if window >= duration or size == 0 or size >= len(envelope):
+        return 0.0
+
+    # Rising energy marks drops and entries, which loudness alone ranks below
+    # a long, evenly loud stretch
+    onsets = np.maximum(np.diff(envelope, prepend=envelope[0]), 0.0)
+    score = (envelope / max(float(envelope.max()), 1e-9)
+             + TEASER_ONSET_WEIGHT * onsets / max(float(onsets.max()), 1e-9))
+    totals = np.concatenate(([0.0], np.cumsum(score)))
+    start = min(int(np.argmax(totals[size:] - totals[:-size])) * ENVELOPE_HOP, duration - window)
+
+    if TEASER_SNAP_BEATS:
+        beat_map = get_beat_map(audio_path)
+        if beat_map:
+            beat_times = beat_map["beat_times"].astype(np.float64)
+            beat_times = beat_times[beat_times <= duration - window]
+            if len(beat_times):
+                start = beat_times[np.argmin(np.abs(beat_times - start))]
+    return float(start)
+
+
+def get_teaser_fades(duration, audio=False):
+    """Return fade-in and fade-out filters for a teaser of the given length"""
+    fade = "afade" if audio else "fade"
+    length = min(TEASER_FADE_SECONDS, duration / 4)
+    return f"{fade}=t=in:d={length:.2f},{fade}=t=out:st={duration - length:.2f}:d={length:.2f}"
+
+
+def scaled_size(value, scale):
+    """Scale a frame dimension, keeping it even for yuv420p"""
+    return max(2, int(value * scale) // 2 * 2)
+
+
+def escape_filter_path(path):
+    """Quote a file path for use as a filter option value inside a filter graph"""
+    path = path.replace("\\", "/").replace(":", "\\:")
+    return f"'{path}'"
+
+
+def compute_beat_map(samples, sample_rate):
+    """Compute onset strength, band energies, onset times and beat times from mono samples"""
+    if len(samples) < BEAT_FFT_SIZE:
+        return None
+
+    window = np.hanning(BEAT_FFT_SIZE).astype(np.float32)
+    framed = np.lib.stride_tricks.sliding_window_view(samples, BEAT_FFT_SIZE)[::BEAT_HOP]
+    frame_count = len(framed)
+    frame_rate = sample_rate / BEAT_HOP
+
+    freqs = np.fft.rfftfreq(BEAT_FFT_SIZE, 1.0 / sample_rate)
+    band_masks = [(freqs >= low) & (freqs < high) for low, high in BEAT_BANDS]
+
+    flux = np.zeros(frame_count, dtype=np.float32)
+    bands = np.zeros((frame_count, len(BEAT_BANDS)), dtype=np.float32)
+    previous = None
+
+    # Chunked STFT keeps memory flat for hour-long tracks
+    for start in range(0, frame_count, 4096):
+        stop = min(start + 4096, frame_count)
+        spectrum = np.abs(np.fft.rfft(framed[start:stop] * window, axis=1)).astype(np.float32)
+        for b, mask in enumerate(band_masks):
+            bands[start:stop, b] = np.sqrt(np.mean(spectrum[:, mask] ** 2, axis=1))
+
+        log_spectrum = np.log1p(100.0 * spectrum)
+        if previous is None:
+            previous = log_spectrum[:1]
+        diff = np.diff(np.vstack([previous, log_spectrum]), axis=0)
+        flux[start:stop] = np.maximum(diff, 0.0).sum(axis=1)
+        previous = log_spectrum[-1:]
+
+    # Onsets: local maxima above an adaptive (1 s moving average) threshold
+    avg_width = max(1, int(frame_rate))
+    local_mean = np.convolve(flux, np.ones(avg_width) / avg_width, mode="same")
+    local_max = np.max(np.lib.stride_tricks.sliding_window_view(np.pad(flux, 3, mode="edge"), 7), axis=1)
+    onsets = np.flatnonzero((flux == local_max) & (flux > local_mean + flux.std() * 0.5))
+
+    # Tempo: onset autocorrelation peak inside BEAT_TEMPO_RANGE, weighted towards 120 BPM
+    centered = flux - flux.mean()
+    size = 1 << int(np.ceil(np.log2(2 * frame_count)))
+    spectrum = np.fft.rfft(centered, size)
+    autocorr = np.fft.irfft(spectrum * np.conj(spectrum), size)[:frame_count]
+    min_lag = max(1, int(frame_rate * 60.0 / BEAT_TEMPO_RANGE[1]))
+    max_lag = min(frame_count - 1, int(frame_rate * 60.0 / BEAT_TEMPO_RANGE[0]))
+
+    beats = np.zeros(0, dtype=np.int64)
+    tempo = 0.0
+    if max_lag > min_lag:
+        lags = np.arange(min_lag, max_lag + 1)
+        bpm = 60.0 * frame_rate / lags
+        weights = np.exp(-0.5 * (np.log2(bpm / 120.0) / 0.9) ** 2)
+        period = float(lags[np.argmax(autocorr[lags] * weights)])
+        tempo = 60.0 * frame_rate / period
+
+        # Phase: offset whose first few grid beats collect the most onset strength
+        grid = np.arange(8) * period
+        phases = np.arange(int(period))
+        scores = [flux[np.minimum((grid + p).astype(np.int64), frame_count - 1)].sum() for p in phases]
+        position = int(phases[int(np.argmax(scores))])
+
+        # Greedy tracking: next beat is the strongest onset near one period ahead,
+        # so slow tempo drift is followed instead of accumulating
+        tracked = []
+        spread = np.arange(int(0.8 * period), int(1.2 * period) + 1)
+        weights = np.exp(-0.5 * ((spread - period) / (0.1 * period)) ** 2)
+        while position < frame_count:
+            tracked.append(position)
+            window = position + spread
+            window = window[window < frame_count]
+            if len(window) == 0:
+                break
+            scores = flux[window] * weights[:len(window)]
+            if scores.max() > 0:
+                position = int(window[np.argmax(scores)])
+            else:
+                position += int(round(period))
+        beats = np.array(tracked, dtype=np.int64)
+
+    center = BEAT_FFT_SIZE / 2 / BEAT_HOP  # report times at the analysis window centre
+    low_band = bands[:, 0]
+    reference = np.percentile(low_band, 95) if frame_count else 0.0
+    strength = np.clip(low_band[beats] / reference, 0.0, 1.0) if reference > 0 else np.zeros(len(beats))
+
+    return {
+        "version": BEAT_ANALYSIS_VERSION,
+        "frame_rate": frame_rate,
+        "tempo": tempo,
+        "onset_times": ((onsets + center) / frame_rate).astype(np.float32),
+        "beat_times": ((beats + center) / frame_rate).astype(np.float32),
+        "beat_strength": strength.astype(np.float32),
+        "band_energies": bands.astype(np.float16),
+    }
+
+
+def get_beat_map(audio_path):
+    """Return the beat/onset map for a song, computing it once per audio hash"""
+    audio_hash = get_audio_hash(audio_path)
+    if not audio_hash:
+        return None
+
+    cache_path = os.path.join(ANALYSIS_CACHE_DIR, f"{audio_hash}_beats.npz")
+    if os.path.exists(cache_path):
+        try:
+            with np.load(cache_path) as data:
+                beat_map = {key: data[key] for key in data.files}
+            if int(beat_map["version"]) == BEAT_ANALYSIS_VERSION:
+                print("  ├─ Beats: reusing cached analysis")
+                return beat_map
+        except (OSError, ValueError, KeyError):
+            pass
+
+    print("  ├─ Beats: analyzing onsets and tempo")
+    beat_map = compute_beat_map(decode_mono(audio_path, BEAT_SAMPLE_RATE), BEAT_SAMPLE_RATE)
+    if not beat_map:
+        return None
+
+    os.makedirs(ANALYSIS_CACHE_DIR, exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **beat_map)
+        os.replace(tmp_path, cache_path)
+        update_analysis_index(audio_hash, "beats", {
+            "version": BEAT_ANALYSIS_VERSION,
+            "tempo": round(float(beat_map["tempo"]), 2),
+            "beats": int(len(beat_map["beat_times"])),
+            "onsets": int(len(beat_map["onset_times"])),
+        })
+    except OSError as e:
+        print(f"[!] Could not cache beat analysis: {e}")
+
+    return beat_map
+
+
+def write_beat_commands(beat_map, cmd_path, start=0.0, duration=None):
+    """Write a sendcmd script pulsing the eq@beat filter on every beat of the window"""
+    beat_times = beat_map["beat_times"].astype(np.float64) - start
+    strength = beat_map["beat_strength"]
+    ends = np.minimum(beat_times + BEAT_PULSE_LENGTH, np.append(beat_times[1:], np.inf))
+
+    lines = []
+    for t, end, level in zip(beat_times, ends, strength):
+        if t < 0 or (duration and t >= duration):
+            continue
+        brightness = BEAT_PULSE_BRIGHTNESS * (0.5 + 0.5 * level)
+        saturation = 1.0 + BEAT_PULSE_SATURATION * level
+        lines.append(
+            f"{t:.3f}-{end:.3f} "
+            f"[enter] eq@beat brightness {brightness:.3f}, [enter] eq@beat saturation {saturation:.3f}, "
+            f"[leave] eq@beat brightness 0, [leave] eq@beat saturation 1;"
+        )
+
+    with open(cmd_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    return len(lines)
+
+
+def get_radial_maps(size, inner, outer):
+    """Return (xmap, ymap, source width, source height) for a radial layer, building the LUT once"""
+    inner_radius = size / 2 * inner
+    outer_radius = size / 2 * outer
+    # Each mirrored half spans half the outer circumference: ~1 source column per pixel
+    src_width = int(np.pi * outer_radius) // 2 * 2
+    src_height = max(2, int(outer_radius - inner_radius))
+
+    base_path = os.path.join(RADIAL_LUT_DIR, f"radial_{size}_{inner:g}_{outer:g}")
+    xmap_path = f"{base_path}_x.pgm"
+    ymap_path = f"{base_path}_y.pgm"
+    if os.path.exists(xmap_path) and os.path.exists(ymap_path):
+        return xmap_path, ymap_path, src_width, src_height
+
+    y, x = np.mgrid[0:size, 0:size].astype(np.float32)
+    center = (size - 1) / 2
+    dx = x - center
+    dy = y - center
+    radius = np.hypot(dx, dy)
+    # Angle from 12 o'clock, mirrored so both halves run from low to high frequency
+    angle = np.abs(np.arctan2(dx, -dy)) / np.pi
+
+    xmap = np.rint(angle * (src_width - 1))
+    ymap = np.rint((1 - (radius - inner_radius) / (outer_radius - inner_radius)) * (src_height - 1))
+    outside = (radius < inner_radius) | (radius > outer_radius)
+    xmap[outside] = src_width  # out of range: remap fills these pixels
+    ymap[outside] = src_height
+
+    os.makedirs(RADIAL_LUT_DIR, exist_ok=True)
+    for path, table in ((xmap_path, xmap), (ymap_path, ymap)):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(f"P5\n{size} {size}\n65535\n".encode("ascii"))
+            f.write(table.astype(">u2").tobytes())
+        os.replace(tmp_path, path)
+
+    return xmap_path, ymap_path, src_width, src_height
+
+
+def get_visual_fps(preset):
+    """Return the update rate for a preset's visualizer, or None if its type keeps its own rate"""
+    if preset["type"] not in VISUAL_RATE_TYPES:
+        return None
+    return preset.get("visual_fps", VISUAL_FPS)
+
+
+def find_silent_ranges(envelope, threshold, start=0.0, length=None):
+    """Return (start, end) times relative to start where RMS stays below threshold for SILENCE_MIN_SECONDS"""
+    first = int(start / ENVELOPE_HOP)
+    last = len(envelope) if length is None else int((start + length) / ENVELOPE_HOP)
+    quiet = (envelope[first:last] < threshold).astype(np.int8)
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], quiet, [0]))))
+
+    ranges = []
+    for run_start, run_end in zip(edges[::2], edges[1::2]):
+        if (run_end - run_start) * ENVELOPE_HOP < SILENCE_MIN_SECONDS:
+            continue
+        # Keep one hop of waveform at each edge for the spectrum window's lag
+        ranges.append((float((run_start + 1) * ENVELOPE_HOP), float((run_end - 1) * ENVELOPE_HOP)))
+    return ranges
+
+
+def get_silence_threshold(ascale):
+    """Return the RMS below which no bar drawn with the given showfreqs ascale reaches one pixel"""
+    if ascale in SILENCE_SCALE_EXPONENTS:
+        # A sine's strongest bin is about sqrt(2) times its RMS, so halve the pixel amplitude
+        threshold = (1.0 / SILENCE_BAR_PIXELS) ** SILENCE_SCALE_EXPONENTS[ascale] / 2
+    else:
+        threshold = SILENCE_THRESHOLD_LOG
+    # Loudness normalisation can lift quiet passages, so only true silence counts then
+    if LOUDNORM_ENABLED:
+        threshold = min(threshold, SILENCE_THRESHOLD_DIGITAL)
+    return threshold
+
+
+def get_silent_ranges(preset, audio_path, start=0.0, length=None):
+    """Return render-time stretches where a preset's waveform layer would be empty"""
+    if preset["type"] not in SILENCE_SKIP_TYPES:
+        return []
+    ascale = "sqrt" if preset["type"] == "circular" else preset["scale"]
+    return find_silent_ranges(get_loudness_envelope(audio_path), get_silence_threshold(ascale), start, length)
+
+
+def get_enable_option(silent_ranges, separator=":"):
+    """Return a timeline option that switches a filter off inside the given ranges"""
+    if not silent_ranges:
+        return ""
+    terms = "+".join(f"between(t,{start:.2f},{end:.2f})" for start, end in silent_ranges)
+    return f"{separator}enable='not({terms})'"
+
+
+def build_waveform_filter(preset, wave_width, wave_height, fps=30, silent_ranges=None):
+    """Build FFmpeg filter string based on preset style"""
+    color = preset["color"]
+    mode = preset["mode"]
+    scale = preset["scale"]
+    split = preset["split_channels"]
+    wave_type = preset["type"]
+    visual_fps = get_visual_fps(preset)
+    rate = f":r={visual_fps}" if visual_fps else ""
+    gate = get_enable_option(silent_ranges)
+    overlay_gate = get_enable_option(silent_ranges, "=")
+    wave_format = f",format={LAYER_PIXEL_FORMATS['wave']}" if FORMAT_PLAN_ENABLED else ""
+
+    if wave_type == "radial":
+        size = min(wave_width, wave_height)
+        xmap_path, ymap_path, src_width, src_height = get_radial_maps(
+            size,
+            preset.get("inner_radius", RADIAL_INNER_RADIUS),
+            preset.get("outer_radius", RADIAL_OUTER_RADIUS)
+        )
+        # One mono plot: per-channel plots would draw the second channel in white
+        wave_filter = (
+            f"aformat=channel_layouts=mono,showfreqs=s={src_width}x{src_height}:mode={mode}:"
+            f"colors={color}:fscale=log:ascale={scale}{rate}"
+        )
+        radial_format = f",format={LAYER_PIXEL_FORMATS['radial']}" if FORMAT_PLAN_ENABLED else ""
+        glow_format = f"{':' if overlay_gate else '='}format=yuv444" if FORMAT_PLAN_ENABLED else ""
+        filter_chain = f"[AUDIO_INPUT]{wave_filter}{radial_format}[radial_src];"
+        if preset.get("glow"):
+            # Blur the small linear plot before warping: about half the pixels
+            # of a full-frame glow, and the halo follows the ring
+            filter_chain += (
+                f"[radial_src]split[radial1][radial2];[radial2]boxblur=3:1{gate}[radial_glow];"
+                f"[radial1][radial_glow]overlay{overlay_gate}{glow_format}[radial_src];"
+            )
+        filter_chain += (
+            f"movie={escape_filter_path(xmap_path)}[radial_x];"
+            f"movie={escape_filter_path(ymap_path)}[radial_y];"
+            f"[radial_src][radial_x][radial_y]remap=fill=black@0[wave]"
+        )
+    elif wave_type == "circular":
+        wave_filter = (
+            f"showfreqs=s={wave_width}x{wave_height}:mode=line:colors={color}:"
+            f"fscale=log:ascale=sqrt{rate}"
+        )
+        filter_chain = f"[AUDIO_INPUT]{wave_filter}{wave_format}[wave]"
+    elif wave_type == "bars":
+        # Drawn inline on purpose: showfreqs is ~2% of this layer's cost, and
+        # tinting cached greyscale masks (one per channel, since the second
+        # channel draws in white) is no faster per render and adds a mask pass
+        # per song; benchmarks/wave_mask_cache.py reproduces the comparison
+        win_size = preset.get("win_size", 2048)
+        wave_filter = (
+            f"showfreqs=s={wave_width}x{wave_height}:mode=bar:colors={color}:"
+            f"fscale=log:ascale={scale}:win_size={win_size}{rate}"
+        )
+        filter_chain = f"[AUDIO_INPUT]{wave_filter}{wave_format}[wave]"
+    elif wave_type == "vector":
+        wave_filter = (
+            f"avectorscope=s={wave_width}x{wave_height}:mode={mode}:draw=line:"
+            f"scale={scale}{rate}"
+        )
+        filter_chain = f"[AUDIO_INPUT]{wave_filter}{wave_format}[wave]"
+    elif wave_type == "spectrum":
+        wave_filter = (
+            f"showspectrum=s={wave_width}x{wave_height}:mode={mode}:color={color}:"
+            f"scale={scale}:slide=scroll"
+        )
+        filter_chain = f"[AUDIO_INPUT]{wave_filter}{wave_format}[wave]"
+    else:
+        wave_filter = (
+            f"showwaves=s={wave_width}x{wave_height}:mode={mode}:colors={color}:"
+            f"scale={scale}:draw=scale"
+        )
+        if split:
+            wave_filter += ":split_channels=1"
+        filter_chain = f"[AUDIO_INPUT]{wave_filter}{wave_format}[wave]"
+
+    if preset.get("glow") and wave_type != "radial":
+        filter_chain += (
+            f";[wave]split[wave1][wave2];[wave2]boxblur=3:1{gate}[glow];"
+            f"[wave1][glow]overlay{overlay_gate}[wave]"
+        )
+
+    if preset.get("mirror"):
+        filter_chain += ";[wave]split[w1][w2];[w2]vflip[w2flip];[w1][w2flip]vstack[wave]"
+
+    if preset.get("shadow"):
+        # lut scales the alpha plane in place; colorchannelmixer only takes RGB
+        fade = "lut=a=val*0.3" if FORMAT_PLAN_ENABLED else "colorchannelmixer=aa=0.3"
+        filter_chain += f";[wave]split[wave1][wave2];[wave2]boxblur=5:1,{fade}[shadow];[shadow][wave1]overlay[wave]"
+
+    if visual_fps and preset.get("visual_blend") and visual_fps < fps:
+        filter_chain += f";[wave]framerate=fps={fps}[wave]"
+
+    return filter_chain
+
+
+def build_wave_layer(preset, wave_width, wave_height, audio_label, base_label, out_label="[v]", fps=30,
+                     silent_ranges=None, label_suffix=""):
+    """Build the waveform for audio_label and overlay it on base_label, ending in out_label"""
+    if preset["type"] in ["radial", "circular", "bars", "vector"]:
+        waveform_height = wave_height
+    else:
+        waveform_height = wave_height // 2
+
+    waveform_filter = build_waveform_filter(preset, wave_width, waveform_height, fps, silent_ranges)
+    if label_suffix:
+        # A batch draws several waveforms in one graph, so each gets its own link labels
+        waveform_filter = re.sub(r"\[([a-z][a-z0-9_]*)\]", rf"[\1{label_suffix}]", waveform_filter)
+    waveform_filter = waveform_filter.replace("[AUDIO_INPUT]", audio_label)
+
+    if preset["position"] == "center":
+        overlay_pos = f"(W-w)/2:(H-h)/2"
+    else:
+        overlay_pos = "0:H-h"
+
+    return [
+        waveform_filter,
+        f"{base_label}[wave{label_suffix}]overlay={overlay_pos}{get_enable_option(silent_ranges)},"
+        f"format=yuv420p{out_label}"
+    ]
+
+
+def build_sidecar_graph(still_time, anim_start):
+    """Split the composed [v] into [v_main] plus thumbnail, poster and animation branches"""
+    # The background inputs loop forever: each branch must end on its own
+    # (trim, or -frames:v 1 on the still outputs) for ffmpeg to exit
+    anim_end = anim_start + ANIMATION_SECONDS
+    return (
+        ";[v]split=3[v_main][still_src][anim_src]"
+        f";[still_src]select='gte(t,{still_time:.3f})',split[poster][thumb_src]"
+        f";[thumb_src]scale={THUMBNAIL_WIDTH}:-2[thumb]"
+        f";[anim_src]trim=start={anim_start:.3f}:end={anim_end:.3f},setpts=PTS-STARTPTS,"
+        f"fps={ANIMATION_FPS},scale={ANIMATION_WIDTH}:-2[anim]"
+    )
+
+
+def get_sidecar_outputs(output_path):
+    """Return (scratch path, final path, output args) for each sidecar of an output"""
+    base_path = os.path.splitext(output_path)[0]
+    pid = os.getpid()
+    still_args = ["-frames:v", "1", "-update", "1"]
+    return [
+        (os.path.join(SCRATCH_DIR, f"_tmp_thumb_{pid}.jpg"), f"{base_path}.thumb.jpg",
+         ["-map", "[thumb]", *still_args, "-q:v", "4"]),
+        (os.path.join(SCRATCH_DIR, f"_tmp_poster_{pid}.jpg"), f"{base_path}.poster.jpg",
+         ["-map", "[poster]", *still_args, "-q:v", "2"]),
+        (os.path.join(SCRATCH_DIR, f"_tmp_anim_{pid}.webp"), f"{base_path}.anim.webp",
+         ["-map", "[anim]", "-c:v", "libwebp_anim", "-loop", "0", "-q:v", "70"]),
+    ]
+
+
+def get_file_key(path):
+    """Return a cache key component identifying a file's path, size and mtime"""
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_size, int(stat.st_mtime)]
+
+
+def log_stall_events(events, output_path, fallbacks):
+    """Append the stalls of one render attempt to the stall log"""
+    for event in events:
+        event.update(output=os.path.basename(output_path), fallbacks=list(fallbacks), time=time.time())
+        if not STALL_LOG_PATH:
+            continue
+        try:
+            os.makedirs(os.path.dirname(STALL_LOG_PATH), exist_ok=True)
+            with open(STALL_LOG_PATH, "a", encoding="utf-8") as f:
+                f.write(json.dumps(event) + "\n")
+        except OSError as e:
+            print(f"[!] Could not append to stall log: {e}")
+
+
+def render_with_stall_retry(render, layout, output_path, steps, apply_fallback):
+    """Call render(layout), retrying with apply_fallback(layout, next step) whenever an ffmpeg stage stalls"""
+    pending = list(steps)
+    applied = []
+    while True:
+        stalls = len(STALL_EVENTS)
+        ok = render(layout)
+        events = STALL_EVENTS[stalls:]
+        log_stall_events(events, output_path, applied)
+        if ok or not events:
+            if applied:
+                log_stall_events([{"result": "recovered" if ok else "failed"}], output_path, applied)
+            return ok
+
+        lighter = None
+        while pending and not lighter:
+            step = pending.pop(0)
+            lighter = apply_fallback(layout, step)
+        if not lighter:
+            print("[!] Still stalling with every fallback applied, giving up")
+            log_stall_events([{"result": "gave_up"}], output_path, applied)
+            return False
+        layout = lighter
+        applied.append(step)
+        print(f"  ├─ Retrying with fallback: {', '.join(applied)}")
+
+
+def save_thread_profile(profile):
+    """Store the tuned thread profile for this host and app"""
+    try:
+        with open(THREAD_PROFILE_PATH, "r", encoding="utf-8") as f:
+            profiles = json.load(f)
+    except (OSError, ValueError):
+        profiles = {}
+
+    profiles.setdefault(platform.node(), {})[APP_NAME] = profile
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_path = f"{THREAD_PROFILE_PATH}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(profiles, f, indent=2)
+    os.replace(tmp_path, THREAD_PROFILE_PATH)
+
+
+def run_thread_search(input_args, filter_graph, fps):
+    """Time every candidate thread split on the benchmark graph and save the fastest"""
+    budget = get_cpu_budget()
+    candidates = sorted({
+        (decoder, filter_threads, encoder)
+        for decoder in (1, 2)
+        for filter_threads in (1, 2, max(1, budget // 4), max(1, budget // 2))
+        for encoder in (max(1, budget - filter_threads), budget)
+    })
+    print(f"[*] Tuning threads on {budget} CPU(s): {len(candidates)} configuration(s), "
+          f"{TUNE_SECONDS}s slice each\n")
+
+    results = []
+    for decoder, filter_threads, encoder in candidates:
+        threads = {"decoder": decoder, "filter": filter_threads, "encoder": encoder}
+        label = f"decode {decoder} / filter {filter_threads} / encode {encoder}"
+
+        cmd = ["ffmpeg", "-y", "-filter_complex_threads", str(filter_threads)]
+        cmd.extend(with_decoder_threads(input_args, threads))
+        cmd.extend([
+            "-filter_complex", filter_graph,
+            "-map", "[v]",
+            "-t", str(TUNE_SECONDS),
+            "-c:v", "libx264",
+            "-preset", "medium",
+            "-crf", "23",
+            "-threads", str(encoder),
+            "-pix_fmt", "yuv420p",
+            "-r", str(fps),
+            "-f", "null", "-"
+        ])
+
+        started = time.perf_counter()
+        if run_with_progress(cmd, f"  ├─ {label}", TUNE_SECONDS):
+            render_fps = TUNE_SECONDS * fps / (time.perf_counter() - started)
+            results.append((render_fps, threads))
+            print(f"  │  {render_fps:6.1f} fps  {label}")
+
+    if not results:
+        print("[!] No thread configuration completed")
+        return False
+
+    render_fps, best = max(results, key=lambda r: r[0])
+    save_thread_profile(dict(best, cpus=budget, fps=round(render_fps, 2),
+                             tuned_at=time.strftime("%Y-%m-%d %H:%M:%S")))
+    print(f"  └─ Saved: decode {best['decoder']} / filter {best['filter']} / "
+          f"encode {best['encoder']} ({render_fps:.1f} fps) for {platform.node()}")
+    return True
+
+
+def split_filter_text(text, separator):
+    """Split filter graph text on a separator that is not quoted or escaped"""
+    parts = []
+    current = []
+    quoted = False
+    escaped = False
+    for char in text:
+        if escaped:
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif char == "'":
+            quoted = not quoted
+        elif char == separator and not quoted:
+            parts.append("".join(current))
+            current = []
+            continue
+        current.append(char)
+    parts.append("".join(current))
+    return parts
+
+
+def parse_filter_graph(filter_graph):
+    """Flatten a filter graph into single-filter nodes with every link labelled"""
+    nodes = []
+    link = 0
+    for chain in split_filter_text(filter_graph, ";"):
+        filters = [text.strip() for text in split_filter_text(chain, ",") if text.strip()]
+        implicit = []
+        for i, text in enumerate(filters):
+            match = re.match(r"^((?:\[[^\]]*\])*)(.*?)((?:\[[^\]]*\])*)$", text, re.DOTALL)
+            inputs = re.findall(r"\[([^\]]*)\]", match.group(1)) + implicit
+            outputs = re.findall(r"\[([^\]]*)\]", match.group(3))
+            implicit = []
+            if not outputs and i < len(filters) - 1:
+                link += 1
+                outputs = [f"pf{link}"]
+                implicit = outputs
+            nodes.append({"inputs": inputs, "filter": match.group(2),
+                          "name": match.group(2).split("=", 1)[0], "outputs": outputs})
+    return nodes
+
+
+def join_filter_graph(nodes):
+    """Serialise nodes from parse_filter_graph back into a filter graph"""
+    return ";".join(
+        "".join(f"[{label}]" for label in node["inputs"]) + node["filter"]
+        + "".join(f"[{label}]" for label in node["outputs"])
+        for node in nodes
+    )
+
+
+def get_link_types(nodes):
+    """Return {label: 'audio' or 'video'} for every link in a parsed graph"""
+    types = {}
+    for node in nodes:
+        for label in node["inputs"]:
+            if re.match(r"^\d+:[av]", label):
+                types[label] = "audio" if label.split(":")[1].startswith("a") else "video"
+
+    # Links can be used before they are defined, so propagate until stable
+    for _ in range(len(nodes)):
+        changed = False
+        for node in nodes:
+            if node["name"] in AUDIO_VISUALIZER_FILTERS or node["name"] in VIDEO_SOURCE_FILTERS:
+                kind = "video"
+            elif node["name"] in AUDIO_SOURCE_FILTERS:
+                kind = "audio"
+            else:
+                kind = next((types[label] for label in node["inputs"] if label in types), None)
+            for label in node["outputs"]:
+                if kind and types.get(label) != kind:
+                    types[label] = kind
+                    changed = True
+        if not changed:
+            break
+    return types
+
+
+def get_ablation(node, types, fps, seconds):
+    """Return the nodes that stand in for one node with its work removed, or None if it can't be ablated"""
+    if not node["inputs"] or len(node["outputs"]) != 1 or node["name"] in PROFILE_STRUCTURAL_FILTERS:
+        return None
+
+    # Dropped inputs are still drained for the slice so their upstream work is
+    # kept, then cut; draining a looped input forever would never finish
+    first, *rest = node["inputs"]
+    sinks = [{"inputs": [label], "name": "nullsink", "outputs": [],
+              "filter": f"atrim=duration={seconds:.2f},anullsink" if types.get(label) == "audio"
+              else f"trim=duration={seconds:.2f},nullsink"} for label in rest]
+
+    if node["name"] in AUDIO_VISUALIZER_FILTERS:
+        # Audio in, video out: drain the audio and stand in a blank layer of the same size
+        args = node["filter"].partition("=")[2]
+        size = re.search(r"(?:^|:)(?:s|size)=(\d+x\d+)", args)
+        rate = re.search(r"(?:^|:)(?:r|rate)=([\d./]+)", args)
+        if not size:
+            return None
+        return sinks + [
+            {"inputs": [first], "filter": f"atrim=duration={seconds:.2f},anullsink", "name": "anullsink",
+             "outputs": []},
+            {"inputs": [], "filter": f"color=c=black@0:s={size.group(1)}:r={rate.group(1) if rate else fps},"
+                                     f"format=rgba", "name": "color", "outputs": node["outputs"]},
+        ]
+
+    passthrough = "anull" if types.get(first) == "audio" else "null"
+    return sinks + [{"inputs": [first], "filter": passthrough, "name": passthrough, "outputs": node["outputs"]}]
+
+
+def get_child_cpu_seconds():
+    """Return CPU seconds used by finished child processes, or None where that isn't available"""
+    if IS_WINDOWS:
+        return None
+    import resource
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def time_graph_slice(input_args, filter_graph, seconds):
+    """Run a compose graph over a slice into the null muxer; return (wall, cpu) seconds or None"""
+    threads = allocate_threads(get_job_concurrency())
+    cmd = ["ffmpeg", "-y", "-filter_complex_threads", str(threads["filter"])]
+    cmd.extend(with_decoder_threads(input_args, threads))
+    cmd.extend(["-filter_complex", filter_graph, "-map", "[v]", "-t", f"{seconds:.2f}", "-f", "null", "-"])
+
+    cpu_before = get_child_cpu_seconds()
+    started = time.perf_counter()
+    result = run_child(cmd)
+    wall = time.perf_counter() - started
+    if result.returncode != 0:
+        return None
+    cpu = None if cpu_before is None else get_child_cpu_seconds() - cpu_before
+    return wall, cpu
+
+
+def format_cost(wall, cpu):
+    """Render a wall/CPU pair for the profile table"""
+    cpu_text = "     -" if cpu is None else f"{cpu:5.1f}s"
+    return f"{wall:5.1f}s {cpu_text}"
+
+
+def run_ablations(input_args, filter_graph, seconds, fps):
+    """Attribute slice render time to each filter node by removing one node at a time"""
+    nodes = parse_filter_graph(filter_graph)
+    types = get_link_types(nodes)
+    ablations = [(i, get_ablation(node, types, fps, seconds)) for i, node in enumerate(nodes)]
+    ablations = [(i, replacement) for i, replacement in ablations if replacement is not None]
+    print(f"[*] {len(nodes)} filter node(s), {len(ablations)} ablation(s) of {seconds:.0f}s each\n")
+
+    first = time_graph_slice(input_args, filter_graph, seconds)
+    if not first:
+        print("[!] The full graph failed on the profiling slice")
+        return False
+    print(f"  ├─ Baseline: {format_cost(*first)}")
+
+    results = []
+    skipped = []
+    for i, replacement in ablations:
+        node = nodes[i]
+        timing = time_graph_slice(input_args, join_filter_graph(nodes[:i] + replacement + nodes[i + 1:]),
+                                  seconds)
+        if timing:
+            results.append((i, timing))
+        else:
+            skipped.append(node["name"])
+        print(f"  │  {'ablated' if timing else 'failed '} #{i} {node['name']}")
+
+    # Measure the baseline again so drift over the run shows up as noise, not cost
+    second = time_graph_slice(input_args, filter_graph, seconds) or first
+    wall = (first[0] + second[0]) / 2
+    cpu = None if first[1] is None else (first[1] + second[1]) / 2
+    print(f"  ├─ Baseline again: {format_cost(*second)} (difference is measurement noise)\n")
+
+    print(f"   {'wall':>6} {'CPU':>6}  share  node")
+    # Most expensive first: the node whose removal saved the most time
+    for i, (node_wall, node_cpu) in sorted(results, key=lambda r: r[1][0] if r[1][1] is None else r[1][1]):
+        saved_wall = wall - node_wall
+        saved_cpu = None if cpu is None else cpu - node_cpu
+        share = (saved_cpu / cpu) if cpu else saved_wall / wall
+        label = nodes[i]["filter"] if len(nodes[i]["filter"]) <= 60 else nodes[i]["filter"][:57] + "..."
+        print(f"   {format_cost(saved_wall, saved_cpu)}  {share:5.0%}  #{i} {label}")
+
+    if any(node_wall > wall for _, (node_wall, _) in results):
+        print("   (negative: the graph got slower without the node, e.g. an extra pixel-format conversion)")
+
+    ablated = {i for i, _ in ablations}
+    not_ablated = sorted({node["name"] for i, node in enumerate(nodes) if i not in ablated} | set(skipped))
+    if not_ablated:
+        print(f"\n  └─ Not attributed: {', '.join(not_ablated)}")
+    return True
+
+
+def profile_graph(app, job, seed=None):
+    """Attribute wall and CPU time to each node of the compose graph a job would render"""
+    profile = app.prepare_profile_slice(job, seed)
+    if not profile:
+        return False
+
+    preset = profile["preset"]
+    print(f"\n[*] Profiling {job['name']}: {preset['name']} ({preset['type']}), "
+          f"{profile['seconds']:.0f}s from {profile['start']:.1f}s")
+    return run_ablations(profile["input_args"], app.build_compose_graph(**profile["graph_args"]),
+                         profile["seconds"], profile["fps"])
+
+
+def get_format_conversions(input_args, filter_graph):
+    """Return the pixel-format conversions ffmpeg sets up for a graph as (scaler, size, from, to) tuples"""
+    cmd = ["ffmpeg", "-v", "verbose", "-y", *input_args, "-filter_complex", filter_graph,
+           "-map", "[v]", "-frames:v", "1", "-f", "null", "-"]
+    result = run_child(cmd)
+    if result.returncode != 0:
+        return None
+
+    # Scalers log their configuration (again on every reconfiguration), and
+    # ffmpeg logs where it auto-inserted one to satisfy a filter's formats
+    placements = {}
+    for match in re.finditer(r"auto-inserting filter '(\w+)' between the filter '(\w+)' and the filter '(\w+)'",
+                             result.stderr):
+        names = [re.sub(r"^Parsed_(\w+?)_\d+$", r"\1", name) for name in match.group(2, 3)]
+        placements[match.group(1)] = " → ".join(names)
+
+    conversions = {}
+    for match in re.finditer(r"\[(\w+) @ \w+\] w:\d+ h:\d+ fmt:(\w+)\b.*?-> w:(\d+) h:(\d+) fmt:(\w+)",
+                             result.stderr):
+        scaler, source, width, height, target = match.groups()
+        if source != target:
+            where = placements.get(scaler, "with its scale")
+            conversions[scaler] = (where, f"{width}x{height}", source, target)
+    return list(conversions.values())
+
+
+def report_pixel_formats(app, job, seed=None):
+    """List the pixel-format conversions left in a job's compose graph and benchmark it against the unplanned graph"""
+    global FORMAT_PLAN_ENABLED
+
+    profile = app.prepare_profile_slice(job, seed)
+    if not profile:
+        return False
+
+    preset = profile["preset"]
+    frames = profile["seconds"] * profile["fps"]
+    print(f"\n[*] Pixel formats for {job['name']}: {preset['name']} ({preset['type']}), "
+          f"{profile['seconds']:.0f}s from {profile['start']:.1f}s")
+
+    planned = FORMAT_PLAN_ENABLED
+    graphs = {}
+    try:
+        for enabled in (False, True):
+            FORMAT_PLAN_ENABLED = enabled
+            graphs[enabled] = app.build_compose_graph(**profile["graph_args"])
+    finally:
+        FORMAT_PLAN_ENABLED = planned
+
+    for enabled in (False, True):
+        conversions = get_format_conversions(profile["input_args"], graphs[enabled])
+        if conversions is None:
+            print(f"[!] The {'planned' if enabled else 'unplanned'} graph failed to configure")
+            return False
+        # Conversions into a format node or inside a scale were asked for; the
+        # rest were forced by a filter that can't take its input's format
+        forced = sum(1 for where, *_ in conversions if where != "with its scale" and not where.endswith("format"))
+        print(f"\n  {'Planned' if enabled else 'Unplanned'} graph: {len(conversions)} conversion(s), "
+              f"{forced} forced by filter formats")
+        for i, (where, size, source, target) in enumerate(conversions):
+            branch = "└─" if i == len(conversions) - 1 else "├─"
+            print(f"  {branch} {size:>9} {source} → {target} ({where})")
+
+    # Alternate the two graphs so drift over the run hits both alike
+    timings = {False: [], True: []}
+    print(f"\n[*] Benchmarking both graphs over {profile['seconds']:.0f}s slices")
+    for _ in range(2):
+        for enabled in (False, True):
+            timing = time_graph_slice(profile["input_args"], graphs[enabled], profile["seconds"])
+            if not timing:
+                print(f"[!] The {'planned' if enabled else 'unplanned'} graph failed on the benchmark slice")
+                return False
+            timings[enabled].append(timing[0])
+
+    unplanned_fps = frames / (sum(timings[False]) / len(timings[False]))
+    planned_fps = frames / (sum(timings[True]) / len(timings[True]))
+    print(f"  ├─ Unplanned: {unplanned_fps:.1f} fps")
+    print(f"  └─ Planned: {planned_fps:.1f} fps ({planned_fps / unplanned_fps - 1:+.0%})")
+    return True
+
+
+def scan_input_tree(root, skip_dirs=()):
+    """Return {folder: file names} for the input tree, re-listing only folders whose mtime changed"""
+    try:
+        with open(INPUT_INDEX_PATH, "r", encoding="utf-8") as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        index = {}
+    # Each app skips its own media folder, so listings are kept per app
+    cached = index.get(APP_NAME, {})
+    if cached.get("root") != root:
+        cached = {}
+    cached_dirs = cached.get("dirs", {})
+
+    skip = {os.path.abspath(d) for d in skip_dirs}
+    dirs = {}
+    rescanned = 0
+    stack = [root]
+    while stack:
+        path = stack.pop()
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            continue
+
+        # A folder's mtime only changes when entries are added, removed or
+        # renamed, so an unchanged folder keeps its cached listing
+        entry = cached_dirs.get(path)
+        if not entry or entry["mtime"] != mtime:
+            files = []
+            subdirs = []
+            try:
+                with os.scandir(path) as entries:
+                    for item in entries:
+                        if item.name.startswith("."):
+                            continue
+                        if item.is_dir():
+                            if os.path.abspath(item.path) not in skip:
+                                subdirs.append(item.name)
+                        elif item.is_file():
+                            files.append(item.name)
+            except OSError:
+                continue
+            entry = {"mtime": mtime, "files": sorted(files), "dirs": sorted(subdirs)}
+            rescanned += 1
+
+        dirs[path] = entry
+        stack.extend(os.path.join(path, name) for name in entry["dirs"])
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_path = f"{INPUT_INDEX_PATH}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(dict(index, **{APP_NAME: {"root": root, "dirs": dirs}}), f)
+        os.replace(tmp_path, INPUT_INDEX_PATH)
+    except OSError as e:
+        print(f"[!] Could not save input index: {e}")
+
+    print(f"[*] Indexed {len(dirs)} folder(s), {rescanned} rescanned")
+    return {path: entry["files"] for path, entry in dirs.items()}
+
+
+def get_output_for(audio_path, output=None):
+    """Return (job name, output path) for an audio file, mirroring its folder under OUTPUT_DIR"""
+    if output:
+        output_path = os.path.join(OUTPUT_DIR, output)
+    else:
+        rel_path = os.path.relpath(audio_path, INPUT_DIR)
+        if rel_path.startswith(os.pardir):
+            rel_path = os.path.basename(audio_path)
+        output_path = os.path.join(OUTPUT_DIR, os.path.splitext(rel_path)[0] + ".mp4")
+    name = os.path.relpath(output_path, OUTPUT_DIR)
+    if name.startswith(os.pardir):
+        name = os.path.basename(output_path)
+    return os.path.splitext(name)[0], output_path
+
+
+def read_manifest(manifest_path):
+    """Read manifest rows from a CSV file (header row) or a JSON list of objects"""
+    try:
+        with open(manifest_path, "r", encoding="utf-8", newline="") as f:
+            if manifest_path.lower().endswith(".json"):
+                rows = json.load(f)
+            else:
+                rows = list(csv.DictReader(f))
+    except (OSError, ValueError, csv.Error) as e:
+        print(f"[!] Could not read manifest {manifest_path}: {e}")
+        return None
+
+    if not isinstance(rows, list):
+        print(f"[!] Manifest {manifest_path} must be a list of jobs")
+        return None
+
+    return [{str(k).strip().lower(): str(v).strip() for k, v in row.items() if k and v not in (None, "")}
+            for row in rows if isinstance(row, dict)]
+
+
+def probe_media(path, stream_type):
+    """Return a problem description if a media file is missing, unreadable or lacks the stream type"""
+    if not os.path.isfile(path):
+        return "missing"
+
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-show_entries", "stream=codec_type:format=duration",
+        "-of", "default=noprint_wrappers=1",
+        path
+    ]
+    try:
+        result = run_child(cmd, timeout=PREFLIGHT_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        return "ffprobe timed out"
+    except OSError as e:
+        return f"ffprobe failed: {e}"
+
+    errors = result.stderr.strip().splitlines()
+    if result.returncode != 0 or errors:
+        return f"unreadable ({errors[-1] if errors else 'ffprobe error'})"
+
+    fields = [line.split("=", 1) for line in result.stdout.splitlines() if "=" in line]
+    if stream_type not in {value for key, value in fields if key == "codec_type"}:
+        return f"no {stream_type} stream"
+
+    if stream_type == "audio":
+        # get_duration would silently fall back to 30s for these
+        try:
+            duration = float(next(value for key, value in fields if key == "duration"))
+        except (StopIteration, ValueError):
+            duration = 0
+        if duration <= 0:
+            return "no usable duration"
+        return None
+
+    # Probing only reads headers; decode one frame to catch corrupt pictures and clips
+    cmd = ["ffmpeg", "-v", "error", "-i", path, "-map", "0:v:0", "-frames:v", "1", "-f", "null", "-"]
+    try:
+        result = run_child(cmd, timeout=PREFLIGHT_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        return "decode timed out"
+    except OSError as e:
+        return f"decode failed: {e}"
+    errors = result.stderr.strip().splitlines()
+    if result.returncode != 0 or errors:
+        return f"does not decode ({errors[0] if errors else 'ffmpeg error'})"
+    return None
+
+
+def dry_run_filter(graph):
+    """Run a waveform filter graph over one frame of synthetic silence; return an error or None"""
+    cmd = [
+        "ffmpeg", "-v", "error",
+        "-f", "lavfi", "-i", "anullsrc=r=44100:cl=stereo",
+        "-filter_complex", graph.replace("[AUDIO_INPUT]", "[0:a]"),
+        "-map", "[wave]",
+        "-frames:v", "1",
+        "-f", "null", "-"
+    ]
+    try:
+        result = run_child(cmd, timeout=PREFLIGHT_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        return "timed out"
+    except OSError as e:
+        return str(e)
+    if result.returncode != 0:
+        errors = result.stderr.strip().splitlines()
+        if not errors:
+            return f"ffmpeg exited with {result.returncode}"
+        # The first "Error ..." line names the filter and option; the last is generic
+        return next((line for line in errors if line.startswith("Error")), errors[-1])
+    return None
+
+
+def preflight(app, jobs, preview=False):
+    """Probe every input and dry-run every distinct waveform graph in parallel; return the jobs that pass"""
+    started = time.time()
+    scale = PREVIEW_SCALE if preview else 1.0
+
+    # Same geometry build_compose_graph asks build_waveform_filter for
+    graphs = {}
+    for preset in app.WAVEFORM_PRESETS:
+        wave_height = scaled_size(app.get_wave_height(preset), scale)
+        if preset["type"] not in ["radial", "circular", "bars", "vector"]:
+            wave_height //= 2
+        graph = build_waveform_filter(preset, scaled_size(app.FRAME_WIDTH, scale), wave_height)
+        graphs.setdefault(graph, []).append(preset["name"])
+
+    media = {}
+    for job in jobs:
+        for _, path, stream_type in app.get_job_media(job):
+            media[path] = stream_type
+
+    with ThreadPoolExecutor(max_workers=PREFLIGHT_WORKERS) as pool:
+        media_futures = {path: pool.submit(probe_media, path, stream_type)
+                         for path, stream_type in media.items()}
+        graph_futures = {graph: pool.submit(dry_run_filter, graph) for graph in graphs}
+        environment_future = pool.submit(app.check_environment)
+        media_problems = {path: future.result() for path, future in media_futures.items()}
+        graph_problems = {graph: future.result() for graph, future in graph_futures.items()}
+        environment_problems = environment_future.result()
+
+    problems = [problem for problem in environment_problems if problem]
+    for graph, error in graph_problems.items():
+        if error:
+            problems.append(f"Filter graph for {', '.join(graphs[graph])} failed: {error}")
+
+    passed = []
+    outputs = {}
+    for job in jobs:
+        job_problems = [f"{label} {media_problems[path]}" for label, path, _ in app.get_job_media(job)
+                        if media_problems[path]]
+        if job["output"] in outputs:
+            job_problems.append(f"output collides with {outputs[job['output']]}")
+        outputs.setdefault(job["output"], job["audio"])
+
+        if job_problems:
+            print(f"[!] {job['name']}: {'; '.join(job_problems)}")
+        else:
+            passed.append(job)
+
+    for problem in problems:
+        print(f"[!] {problem}")
+
+    print(f"[*] Pre-flight: {len(passed)}/{len(jobs)} job(s) passed, {len(media)} file(s) probed, "
+          f"{len(graphs)} filter graph(s) dry-run in {time.time() - started:.1f}s")
+    if problems:
+        print("[!] Fix the problems above or rerun with --no-preflight")
+        return None
+    return passed
+
+
+def run_batch(app, batch):
+    """Render a batch, accounting each song as its own job; fall back to single renders if the run fails"""
+    global CURRENT_USAGE
+    CURRENT_USAGE = usage = new_usage()
+    batch_started = time.time()
+    stalls = len(STALL_EVENTS)
+    results = None
+    try:
+        results = app.render_batch(batch)
+    finally:
+        CURRENT_USAGE = None
+    log_stall_events(STALL_EVENTS[stalls:], "+".join(os.path.basename(job["output"]) for job in batch), [])
+
+    if results is None:
+        print("[!] Batch render failed, rendering its songs one at a time")
+        return [app.run_job(job) for job in batch]
+
+    # One process served every song, so each is charged an equal share of it
+    share = dict(usage, user_seconds=usage["user_seconds"] / len(batch),
+                 system_seconds=usage["system_seconds"] / len(batch),
+                 block_input=usage["block_input"] // len(batch),
+                 block_output=usage["block_output"] // len(batch))
+    wall_seconds = (time.time() - batch_started) / len(batch)
+    for job, ok in zip(batch, results):
+        preset_type = job["layout"]["preset"]["type"]
+        metric_inc("visualizer_jobs_started_total", preset_type=preset_type)
+        metric_inc("visualizer_jobs_succeeded_total" if ok else "visualizer_jobs_failed_total",
+                   preset_type=preset_type)
+        finish_job_usage(share, preset_type, ok, wall_seconds, job["output"])
+    flush_metrics(force=True)
+    return results
+
+
+def batch_generate(app, preview=False, seed=None, manifest_path=None, teaser=False):
+    """Process all audio files in input directory (or the jobs listed in a manifest)"""
+    claim_render_slot()
+    jobs = app.collect_jobs(manifest_path)
+    if jobs and PREFLIGHT_ENABLED:
+        jobs = preflight(app, jobs, preview)
+    if not jobs:
+        return
+
+    print(f"[*] Found {len(jobs)} audio file(s) to process\n")
+
+    units = [[job] for job in jobs]
+    if BATCH_SHORT_ENABLED and (preview or teaser or SIDECARS_ENABLED or BEAT_PULSE_ENABLED):
+        print("[!] Snippet batching is off for previews, teasers, sidecars and beat pulse\n")
+    elif BATCH_SHORT_ENABLED:
+        units = app.plan_batches(jobs, seed)
+
+    success_count = 0
+    done = 0
+    for unit in units:
+        done += len(unit)
+        metric_set("visualizer_queue_depth", len(jobs) - done)
+        print(f"{'=' * 60}")
+        if len(unit) == 1:
+            print(f"File {done}/{len(jobs)}")
+        else:
+            print(f"Files {done - len(unit) + 1}-{done}/{len(jobs)} (batched)")
+
+        try:
+            results = run_batch(app, unit) if len(unit) > 1 else [app.run_job(unit[0], preview, seed, teaser=teaser)]
+            success_count += sum(1 for ok in results if ok)
+        except KeyboardInterrupt:
+            print("\n[!] Interrupted by user")
+            raise
+
+    print(f"\n{'=' * 60}")
+    print(f"[*] Successfully processed {success_count}/{len(jobs)} file(s)")
+    if RENDER_STATS:
+        total_seconds = sum(stat["seconds"] for stat in RENDER_STATS)
+        total_bytes = sum(stat["bytes"] for stat in RENDER_STATS)
+        print(f"[*] Output mode {OUTPUT_MODE}: {total_seconds:.1f}s rendering, "
+              f"{format_size(total_bytes)} written")
+    if STALL_EVENTS:
+        print(f"[!] {len(STALL_EVENTS)} stalled ffmpeg stage(s) killed, see {STALL_LOG_PATH}")
+    print_usage_summary(JOB_USAGE)
+
+
+def prepare_live_audio(audio_path, duration):
+    """Return a cached FLAC of the song in the live stream's common audio format"""
+    audio_hash = get_audio_hash(audio_path)
+    if not audio_hash:
+        return None
+
+    audio_filter = get_loudnorm_filter(audio_path) if LOUDNORM_ENABLED else None
+    filter_args = ["-af", audio_filter] if audio_filter else []
+    settings = " ".join(filter_args + LIVE_FLAC_ARGS)
+    settings = hashlib.sha1(settings.encode("utf-8")).hexdigest()[:8]
+    cached_track = os.path.join(AUDIO_CACHE_DIR, f"{audio_hash}_{settings}.flac")
+    if os.path.exists(cached_track):
+        print("  ├─ Audio: reusing cached FLAC track")
+        return cached_track
+
+    os.makedirs(AUDIO_CACHE_DIR, exist_ok=True)
+    tmp_track = cached_track + f".{os.getpid()}.tmp.flac"
+    TEMP_FILES.append(tmp_track)
+
+    if not run_with_progress([
+        "ffmpeg", "-y", "-i", audio_path,
+        "-vn", *filter_args, *LIVE_FLAC_ARGS,
+        tmp_track
+    ], "  ├─ Encoding FLAC track", duration):
+        return None
+
+    os.replace(tmp_track, cached_track)
+    TEMP_FILES.remove(tmp_track)
+    return cached_track
+
+
+def write_live_lists(tracks, video_list, audio_list):
+    """Write the concat lists that play every track's audio and background back to back"""
+    with open(audio_list, "w", encoding="utf-8") as f:
+        f.write("ffconcat version 1.0\n")
+        for track in tracks:
+            escaped = track["audio"].replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+
+    # Each background loop is repeated to cover its track and the last pass is
+    # cut at the track's end, so video and audio change track together
+    with open(video_list, "w", encoding="utf-8") as f:
+        f.write("ffconcat version 1.0\n")
+        for track in tracks:
+            escaped = track["background"].replace("'", "'\\''")
+            remaining = track["duration"]
+            while remaining > 0.001:
+                length = min(track["loop_period"], remaining)
+                f.write(f"file '{escaped}'\n")
+                if length < track["loop_period"]:
+                    f.write(f"outpoint {length:.6f}\n")
+                f.write(f"duration {length:.6f}\n")
+                remaining -= length
+
+
+def get_live_output_args(target):
+    """Return muxer arguments for a stream URL or a local HLS directory, or None if unsupported"""
+    if "://" in target:
+        stream_format = LIVE_STREAM_FORMATS.get(target.split("://", 1)[0].lower())
+        return ["-f", stream_format, target] if stream_format else None
+
+    os.makedirs(target, exist_ok=True)
+    return [
+        "-f", "hls",
+        "-hls_time", str(LIVE_HLS_SEGMENT_SECONDS),
+        "-hls_list_size", str(LIVE_HLS_LIST_SIZE),
+        "-hls_flags", "delete_segments+independent_segments",
+        "-hls_segment_filename", os.path.join(target, "segment_%06d.ts"),
+        os.path.join(target, "stream.m3u8")
+    ]
+
+
+def stream_playlist(cmd, tracks):
+    """Run the live encoder, announcing each track as the stream reaches it"""
+    global CURRENT_PROCESS
+
+    starts = []
+    total = 0.0
+    for track in tracks:
+        starts.append(total)
+        total += track["duration"]
+
+    CURRENT_PROCESS = subprocess.Popen(
+        cmd,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        creationflags=subprocess.CREATE_NO_WINDOW if IS_WINDOWS else 0
+    )
+
+    stderr_output = []
+    time_pattern = re.compile(r'time=(\d+):(\d+):(\d+\.\d+)')
+    speed_pattern = re.compile(r'speed=\s*(\d+(?:\.\d+)?)x')
+    playing = None
+    warned = False
+    while True:
+        line = CURRENT_PROCESS.stderr.readline()
+        if not line:
+            break
+        stderr_output = stderr_output[-19:] + [line]
+
+        match = time_pattern.search(line)
+        if not match:
+            continue
+
+        elapsed = int(match.group(1)) * 3600 + int(match.group(2)) * 60 + float(match.group(3))
+        speed_match = speed_pattern.search(line)
+        if speed_match:
+            speed = float(speed_match.group(1))
+            metric_set("visualizer_stage_speed", speed, stage="live")
+            if speed < LIVE_MIN_SPEED and elapsed > LIVE_GOP_SECONDS * 5 and not warned:
+                warned = True
+                print(f"[!] Encoder is running at {speed:.2f}x and falling behind real time")
+        rounds, position = divmod(elapsed, total)
+        index = max(i for i, start in enumerate(starts) if start <= position)
+        if (rounds, index) != playing:
+            playing = (rounds, index)
+            metric_inc("visualizer_live_tracks_total")
+            print(f"   🎵 Now playing [{index + 1}/{len(tracks)}]: {tracks[index]['title']}")
+        flush_metrics()
+
+    returncode = wait_child(CURRENT_PROCESS)
+    CURRENT_PROCESS = None
+    metric_set("visualizer_stage_speed", 0, stage="live")
+
+    if returncode != 0:
+        print("\n[!] Live stream stopped")
+        print(f"Error output:\n{''.join(stderr_output)}")
+        return False
+    return True
+
+
+def run_live(app, target, manifest_path=None, seed=None, loop=False):
+    """Stream the playlist through one long-running encoder at real-time pace"""
+    claim_render_slot()
+    jobs = app.collect_jobs(manifest_path)
+    if jobs and PREFLIGHT_ENABLED:
+        jobs = preflight(app, jobs)
+    if not jobs:
+        return False
+
+    output_args = get_live_output_args(target)
+    if not output_args:
+        print(f"[!] Unsupported live target {target} (use a directory for HLS or "
+              f"{', '.join(f'{scheme}://' for scheme in LIVE_STREAM_FORMATS)})")
+        return False
+
+    print(f"[*] Preparing {len(jobs)} track(s) for live streaming")
+    tracks = []
+    for job in jobs:
+        track = app.prepare_live_track(job, seed)
+        if track:
+            tracks.append(track)
+        else:
+            print(f"[!] Skipping {os.path.basename(job['audio'])}")
+    if not tracks:
+        return False
+
+    # One filter graph serves the whole stream, so the first track's waveform
+    # preset is the station style; backgrounds and titles change per track
+    preset = tracks[0]["layout"]["preset"]
+    filter_graph = app.build_live_graph(preset)
+
+    video_list = os.path.join(SCRATCH_DIR, f"_tmp_live_video_{os.getpid()}.txt")
+    audio_list = os.path.join(SCRATCH_DIR, f"_tmp_live_audio_{os.getpid()}.txt")
+    TEMP_FILES.extend([video_list, audio_list])
+    write_live_lists(tracks, video_list, audio_list)
+
+    loop_args = ["-stream_loop", "-1"] if loop else []
+    gop = str(LIVE_FPS * LIVE_GOP_SECONDS)
+    threads = allocate_threads(get_job_concurrency())
+    cmd = ["ffmpeg", "-y", "-filter_complex_threads", str(threads["filter"])]
+    cmd.extend(with_decoder_threads([
+        "-re", *loop_args, "-f", "concat", "-safe", "0", "-i", video_list,
+        "-re", *loop_args, "-f", "concat", "-safe", "0", "-i", audio_list,
+    ], threads))
+    cmd.extend([
+        "-filter_complex", filter_graph,
+        "-map", "[v]", "-map", "1:a",
+        *LIVE_VIDEO_ARGS,
+        "-threads", str(threads["encoder"]),
+        "-r", str(LIVE_FPS), "-g", gop, "-keyint_min", gop,
+        *LIVE_AUDIO_ARGS,
+        *output_args
+    ])
+
+    total = sum(track["duration"] for track in tracks)
+    print(f"\n{'=' * 60}")
+    print(f"[*] Live: {len(tracks)} track(s), {total / 60:.1f} min{' on repeat' if loop else ''} "
+          f"→ {target}")
+    print(f"   🎨 Style: {preset['name']} ({preset['type']})")
+    return stream_playlist(cmd, tracks)
+
+
+def probe_render(path):
+    """Return a finished render's video parameters, length and keyframe times (pts, dts), or None"""
+    try:
+        result = run_child([
+            "ffprobe", "-v", "error", "-select_streams", "v:0", "-show_data_hash", "sha256",
+            "-show_entries", "stream=" + ",".join(COMPILE_VIDEO_FIELDS),
+            "-of", "json", path
+        ], check=True, timeout=30)
+        streams = json.loads(result.stdout).get("streams") or []
+        result = run_child([
+            "ffprobe", "-v", "error", "-select_streams", "v:0",
+            "-show_entries", "packet=pts_time,dts_time,duration_time,flags",
+            "-of", "csv=p=0", path
+        ], check=True, timeout=120)
+    except (OSError, ValueError, subprocess.CalledProcessError, subprocess.TimeoutExpired):
+        return None
+    if not streams:
+        return None
+
+    duration = 0.0
+    keyframes = []
+    for line in result.stdout.splitlines():
+        fields = line.strip().split(",")
+        if len(fields) < 4:
+            continue
+        try:
+            pts = float(fields[0])
+            dts = float(fields[1]) if fields[1] != "N/A" else pts
+            length = float(fields[2]) if fields[2] != "N/A" else 0.0
+        except ValueError:
+            continue
+        duration = max(duration, pts + length)
+        if fields[3].startswith("K"):
+            keyframes.append((pts, dts))
+    if not keyframes or duration <= 0:
+        return None
+
+    params = {field: streams[0].get(field) for field in COMPILE_VIDEO_FIELDS}
+    num, _, den = str(params["r_frame_rate"]).partition("/")
+    try:
+        fps = float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError):
+        return None
+    return {"params": params, "fps": fps, "duration": duration, "keyframes": sorted(keyframes),
+            "x264": read_x264_options(path)}
+
+
+def read_x264_options(path):
+    """Return the x264 settings a render was encoded with, from its encoder SEI, or {}"""
+    pattern = re.compile(rb"x264 - core \d+.*? - options: ([ -~]+)")
+    data = b""
+    scanned = 0
+    try:
+        with open(path, "rb") as f:
+            while scanned < COMPILE_SEI_SEARCH_BYTES:
+                chunk = f.read(1024 * 1024)
+                if not chunk:
+                    break
+                scanned += len(chunk)
+                data = data[-4096:] + chunk
+                match = pattern.search(data)
+                # A match running to the end of the buffer may continue in the next chunk
+                if match and match.end() < len(data):
+                    return dict(item.split("=", 1) for item in match.group(1).decode("ascii").split()
+                                if "=" in item)
+    except OSError:
+        pass
+    return {}
+
+
+def get_clip_encode_args(render):
+    """Return x264 arguments that reproduce a render's stream headers in a re-encoded clip"""
+    options = render.get("x264") or {}
+    # x264-params separates options with ':', so pairs like psy_rd=1.00:0.00 use the ',' form
+    params = [f"{name}={options[name].replace(':', ',')}" for name in COMPILE_X264_OPTIONS if name in options]
+    if not params:
+        return list(FINAL_ENCODE_ARGS)
+    return [*FINAL_ENCODE_ARGS, "-x264-params", ":".join(params)]
+
+
+def get_param_differences(render, reference):
+    """Return the COMPILE_VIDEO_FIELDS that differ between two probed renders, formatted for the log"""
+    return [f"{field} {render['params'][field]} vs {reference['params'][field]}"
+            for field in COMPILE_VIDEO_FIELDS if render["params"][field] != reference["params"][field]]
+
+
+def plan_compile_cuts(renders, crossfade, title_seconds=0.0):
+    """Pick each render's stream-copy range between keyframes; return the renders too short for one"""
+    too_short = []
+    for i, render in enumerate(renders):
+        head = max(crossfade if i > 0 else 0.0, title_seconds)
+        tail = render["duration"] - crossfade if i < len(renders) - 1 else render["duration"]
+        render["head"] = next((k for k in render["keyframes"] if k[0] >= head - 0.001), None) if head else None
+        render["tail"] = next((k for k in reversed(render["keyframes"]) if k[0] <= tail + 0.001),
+                              None) if tail < render["duration"] else None
+        head_time = render["head"][0] if render["head"] else 0.0
+        if (head and not render["head"]) or (render["tail"] and render["tail"][0] < head_time):
+            too_short.append(render["path"])
+    return too_short
+
+
+def check_boundary_clip(clip_path, render):
+    """Return whether a re-encoded clip can be stream-copied next to the render it leads into"""
+    clip = probe_render(clip_path)
+    if not clip:
+        print(f"[!] Could not read the boundary clip for {os.path.basename(render['path'])}")
+        return False
+    differences = get_param_differences(clip, render)
+    if differences:
+        print(f"[!] Boundary clip for {os.path.basename(render['path'])} would not splice cleanly: "
+              f"{', '.join(differences)}")
+        print("[!] Re-render the tracks with the same settings before compiling")
+        return False
+    return True
+
+
+def write_compile_list(renders, clips, list_path):
+    """Write the concat list that alternates copied render ranges with re-encoded boundary clips"""
+    with open(list_path, "w", encoding="utf-8") as f:
+        f.write("ffconcat version 1.0\n")
+        for render, clip in zip(renders, clips):
+            if clip:
+                escaped = clip["path"].replace("'", "'\\''")
+                f.write(f"file '{escaped}'\ninpoint 0\nduration {clip['length']:.6f}\n")
+
+            # The demuxer compares outpoint against DTS, so the cut sits half a
+            # frame before the tail keyframe's DTS to stop ahead of it even when
+            # B-frames delay it and the printed time rounds up
+            start = render["head"][0] if render["head"] else 0.0
+            end = render["tail"] if render["tail"] else None
+            escaped = render["path"].replace("'", "'\\''")
+            f.write(f"file '{escaped}'\ninpoint {start:.6f}\n")
+            if end:
+                f.write(f"outpoint {end[1] - 0.5 / render['fps']:.6f}\n")
+            f.write(f"duration {(end[0] if end else render['duration']) - start:.6f}\n")
+
+
+def build_compile_audio_graph(renders, crossfade, first_input=1):
+    """Return a graph joining every render's audio, padded to its video length, into [a]"""
+    parts = []
+    for i, render in enumerate(renders):
+        parts.append(f"[{first_input + i}:a]apad=whole_dur={render['duration']:.6f},"
+                     f"atrim=end={render['duration']:.6f},asetpts=PTS-STARTPTS[a{i}]")
+
+    if len(renders) == 1:
+        parts.append("[a0]anull[a]")
+    elif crossfade > 0:
+        previous = "a0"
+        for i in range(1, len(renders)):
+            label = "a" if i == len(renders) - 1 else f"x{i}"
+            parts.append(f"[{previous}][a{i}]acrossfade=d={crossfade:.6f}[{label}]")
+            previous = label
+    else:
+        labels = "".join(f"[a{i}]" for i in range(len(renders)))
+        parts.append(f"{labels}concat=n={len(renders)}:v=0:a=1[a]")
+    return ";".join(parts)
+
+
+def parse_address(value):
+    """Parse a HOST:PORT string into a socket address"""
+    host, _, port = value.rpartition(":")
+    return (host or "0.0.0.0", int(port))
+
+
+def send_message(address, message, timeout=10):
+    """Send one JSON line to the coordinator and return its JSON reply"""
+    with socket.create_connection(address, timeout=timeout) as sock:
+        sock.sendall((json.dumps(message) + "\n").encode("utf-8"))
+        with sock.makefile("r", encoding="utf-8") as reader:
+            return json.loads(reader.readline())
+
+
+def send_with_retry(address, message):
+    """Send a message, retrying until the coordinator has been unreachable for HEARTBEAT_TIMEOUT"""
+    waited = 0
+    while True:
+        try:
+            return send_message(address, message)
+        except (OSError, ValueError):
+            if waited >= HEARTBEAT_TIMEOUT:
+                return None
+            time.sleep(HEARTBEAT_SECONDS)
+            waited += HEARTBEAT_SECONDS
+
+
+def build_work_units(app, jobs):
+    """Turn jobs into work units, cutting long tracks into fixed-length segments"""
+    units = []
+    tracks = {}
+    for job in jobs:
+        duration = get_duration(job["audio"])
+        if duration <= SEGMENT_THRESHOLD:
+            units.append({"id": job["name"], "job": job})
+            continue
+
+        # Every segment must render the same layout: pin it in the sidecar
+        # that make_visualizer loads for this output
+        layout = app.choose_layout(job["audio"], job["output"], overrides=job.get("overrides"))
+        if not layout:
+            print(f"[!] No layout available for '{job['name']}', skipping")
+            continue
+        os.makedirs(os.path.dirname(job["output"]), exist_ok=True)
+        app.save_layout(layout, job["output"])
+
+        segment_dir = os.path.join(SEGMENTS_DIR, job["name"])
+        os.makedirs(segment_dir, exist_ok=True)
+        # The last segment absorbs the remainder instead of leaving a sliver
+        count = max(1, int(round(duration / SEGMENT_SECONDS)))
+        paths = []
+        for idx in range(count):
+            start = idx * SEGMENT_SECONDS
+            length = duration - start if idx == count - 1 else SEGMENT_SECONDS
+            path = os.path.join(segment_dir, f"{idx:04d}.mp4")
+            paths.append(path)
+            units.append({
+                "id": f"{job['name']}#{idx:04d}",
+                "job": job,
+                "track": job["name"],
+                "segment": {"start": start, "length": length, "path": path},
+            })
+        tracks[job["name"]] = {"job": job, "duration": duration, "segments": paths, "remaining": count}
+
+    return units, tracks
+
+
+def join_segments(track):
+    """Concatenate a track's segments and its full audio track into the final output by stream copy"""
+    job = track["job"]
+    duration = track["duration"]
+
+    audio_filter = get_loudnorm_filter(job["audio"]) if LOUDNORM_ENABLED else None
+    audio_track = prepare_audio_track(job["audio"], duration, audio_filter)
+    if not audio_track:
+        return False
+
+    list_path = os.path.join(SCRATCH_DIR, f"_tmp_concat_{os.getpid()}.txt")
+    scratch_render = os.path.join(SCRATCH_DIR, f"_tmp_concat_{os.getpid()}.mp4")
+    TEMP_FILES.extend([list_path, scratch_render])
+    with open(list_path, "w", encoding="utf-8") as f:
+        for path in track["segments"]:
+            escaped = path.replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+
+    # Segments are video-only, so the audio is the song's one AAC stream (the
+    # source or a cached encode) with a single priming delay at its start;
+    # copying it leaves nothing to bridge at the segment boundaries
+    cmd = [
+        "ffmpeg", "-y",
+        "-f", "concat", "-safe", "0", "-i", list_path,
+        "-i", audio_track,
+        "-map", "0:v", "-map", "1:a",
+        "-c", "copy",
+        "-t", f"{duration:.2f}",
+        *get_container_args(),
+        scratch_render
+    ]
+    if not run_with_progress(cmd, f"  └─ Joining {len(track['segments'])} segments", duration):
+        return False
+    if not publish_output(scratch_render, job["output"], duration):
+        return False
+
+    os.remove(list_path)
+    TEMP_FILES.remove(list_path)
+    shutil.rmtree(os.path.dirname(track["segments"][0]), ignore_errors=True)
+    print(f"  ✅ Complete: {os.path.basename(job['output'])}")
+    return True
+
+
+class RenderCoordinator:
+    """Work-unit queue shared by the coordinator's connection handlers"""
+
+    def __init__(self, units, tracks, settings):
+        self.lock = threading.Lock()
+        self.units = {unit["id"]: unit for unit in units}
+        self.pending = [unit["id"] for unit in units]
+        self.active = {}  # unit id -> worker id
+        self.workers = {}  # worker id -> last heartbeat, current unit, progress
+        self.attempts = {}
+        self.done = set()
+        self.failed = set()
+        self.tracks = tracks
+        self.ready = []  # tracks whose segments are all rendered
+        self.settings = settings
+        self.usage = []  # resource records reported with worker results
+
+    def handle(self, message):
+        """Answer a request, heartbeat or result message from a worker"""
+        with self.lock:
+            worker = message["worker"]
+            state = self.workers.setdefault(worker, {"unit": None, "progress": 0.0})
+            state["seen"] = time.time()
+
+            if message["type"] == "heartbeat":
+                state["progress"] = message.get("progress", 0.0)
+                return {"type": "ok"}
+
+            if message["type"] == "result":
+                self.finish_unit(worker, message["unit"], message.get("ok", False))
+                if message.get("usage"):
+                    self.usage.append(message["usage"])
+                state.update(unit=None, progress=0.0)
+                return {"type": "ok"}
+
+            if message["type"] == "request":
+                if self.pending:
+                    unit_id = self.pending.pop(0)
+                    self.active[unit_id] = worker
+                    self.attempts[unit_id] = self.attempts.get(unit_id, 0) + 1
+                    state.update(unit=unit_id, progress=0.0)
+                    print(f"[*] {unit_id} → {worker}")
+                    return {"type": "unit", "unit": self.units[unit_id], "settings": self.settings}
+                if self.active:
+                    return {"type": "wait", "seconds": HEARTBEAT_SECONDS}
+                return {"type": "done"}
+
+        return {"type": "error", "message": f"unknown message type {message['type']}"}
+
+    def finish_unit(self, worker, unit_id, ok):
+        """Record a unit result, retrying failures up to UNIT_MAX_ATTEMPTS"""
+        if unit_id in self.done or unit_id not in self.units:
+            return
+
+        if ok:
+            # Accept a late success even if the unit was reassigned meanwhile;
+            # outputs are published atomically so the duplicate is harmless
+            self.active.pop(unit_id, None)
+            if unit_id in self.pending:
+                self.pending.remove(unit_id)
+            self.done.add(unit_id)
+            track = self.units[unit_id].get("track")
+            if track:
+                self.tracks[track]["remaining"] -= 1
+                if self.tracks[track]["remaining"] == 0:
+                    self.ready.append(track)
+            print(f"[*] {unit_id} done by {worker} ({len(self.done)}/{len(self.units)})")
+            return
+
+        if self.active.get(unit_id) != worker:
+            return  # Already requeued after this worker went silent
+        del self.active[unit_id]
+        if self.attempts[unit_id] < UNIT_MAX_ATTEMPTS:
+            self.pending.append(unit_id)
+            print(f"[!] {unit_id} failed on {worker}, requeued")
+        else:
+            self.failed.add(unit_id)
+            print(f"[!] {unit_id} failed {UNIT_MAX_ATTEMPTS} times, giving up")
+
+    def reap(self):
+        """Requeue units held by workers that stopped sending heartbeats"""
+        with self.lock:
+            now = time.time()
+            for worker, state in list(self.workers.items()):
+                if now - state["seen"] < HEARTBEAT_TIMEOUT:
+                    continue
+                del self.workers[worker]
+                unit_id = state["unit"]
+                if unit_id and self.active.get(unit_id) == worker:
+                    del self.active[unit_id]
+                    self.pending.insert(0, unit_id)
+                    print(f"[!] Worker {worker} went silent, reassigning {unit_id}")
+
+    def take_ready(self):
+        """Return tracks whose segments are all rendered and ready to join"""
+        with self.lock:
+            ready, self.ready = self.ready, []
+            return [self.tracks[name] for name in ready]
+
+    def finished(self):
+        """Return True once every unit has completed or failed for good"""
+        with self.lock:
+            return not self.pending and not self.active and not self.ready
+
+
+class CoordinatorHandler(socketserver.StreamRequestHandler):
+    """Read one JSON-line message from a worker and write the reply"""
+
+    def handle(self):
+        try:
+            reply = self.server.coordinator.handle(json.loads(self.rfile.readline()))
+        except (ValueError, KeyError) as e:
+            reply = {"type": "error", "message": str(e)}
+        self.wfile.write((json.dumps(reply) + "\n").encode("utf-8"))
+
+
+def run_coordinator(app, address, manifest_path=None):
+    """Serve this batch as work units to workers until every unit is done"""
+    jobs = app.collect_jobs(manifest_path)
+    if jobs and PREFLIGHT_ENABLED:
+        jobs = preflight(app, jobs)
+    if not jobs:
+        return
+
+    units, tracks = build_work_units(app, jobs)
+    settings = {name: globals()[name] for name in DISTRIBUTED_SETTINGS}
+    coordinator = RenderCoordinator(units, tracks, settings)
+
+    server = socketserver.ThreadingTCPServer(address, CoordinatorHandler, bind_and_activate=False)
+    server.allow_reuse_address = True
+    server.daemon_threads = True
+    server.server_bind()
+    server.server_activate()
+    server.coordinator = coordinator
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    print(f"[*] Coordinator on {address[0]}:{address[1]}: {len(jobs)} job(s), "
+          f"{len(units)} work unit(s), {len(tracks)} segmented track(s)\n")
+
+    joined = 0
+    try:
+        while True:
+            time.sleep(1)
+            coordinator.reap()
+            metric_set("visualizer_queue_depth", len(coordinator.pending))
+            flush_metrics()
+            for track in coordinator.take_ready():
+                print(f"{'=' * 60}")
+                print(f"[*] Joining segments for '{track['job']['name']}'")
+                if join_segments(track):
+                    joined += 1
+            if coordinator.finished():
+                break
+        # Let polling workers pick up the "done" reply before the socket closes
+        time.sleep(HEARTBEAT_SECONDS * 2)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    complete = len([u for u in coordinator.done if "track" not in coordinator.units[u]]) + joined
+    print(f"\n{'=' * 60}")
+    print(f"[*] Successfully processed {complete}/{len(jobs)} file(s)")
+    if coordinator.failed:
+        print(f"[!] Failed work units: {', '.join(sorted(coordinator.failed))}")
+    print_usage_summary(coordinator.usage)
+
+
+def run_worker(app, address):
+    """Pull work units from a coordinator until it reports the batch is done"""
+    worker_id = f"{platform.node()}:{os.getpid()}"
+    claim_render_slot()
+    state = {"unit": None, "progress": 0.0}
+    PROGRESS_LISTENERS.append(lambda desc, progress: state.update(progress=progress))
+
+    stop = threading.Event()
+
+    def heartbeat():
+        while not stop.wait(HEARTBEAT_SECONDS):
+            try:
+                send_message(address, {"type": "heartbeat", "worker": worker_id, **state})
+            except (OSError, ValueError):
+                pass
+
+    threading.Thread(target=heartbeat, daemon=True).start()
+    print(f"[*] Worker {worker_id} connecting to {address[0]}:{address[1]}")
+
+    completed = 0
+    try:
+        while True:
+            reply = send_with_retry(address, {"type": "request", "worker": worker_id})
+            if reply is None:
+                print("[!] Coordinator unreachable, stopping worker")
+                break
+            if reply["type"] == "done":
+                break
+            if reply["type"] != "unit":
+                time.sleep(reply.get("seconds", HEARTBEAT_SECONDS))
+                continue
+
+            unit = reply["unit"]
+            for name in DISTRIBUTED_SETTINGS:
+                if name in reply["settings"]:
+                    globals()[name] = reply["settings"][name]
+
+            state.update(unit=unit["id"], progress=0.0)
+            print(f"{'=' * 60}")
+            print(f"[*] Work unit {unit['id']}")
+            usage_count = len(JOB_USAGE)
+            try:
+                ok = app.run_job(unit["job"], segment=unit.get("segment"))
+            except Exception as e:
+                print(f"[!] Work unit {unit['id']} failed: {e}")
+                ok = False
+            state.update(unit=None, progress=0.0)
+            completed += 1 if ok else 0
+            usage = JOB_USAGE[-1] if len(JOB_USAGE) > usage_count else None
+
+            if send_with_retry(address, {"type": "result", "worker": worker_id,
+                                         "unit": unit["id"], "ok": ok, "usage": usage}) is None:
+                print("[!] Coordinator unreachable, stopping worker")
+                break
+    finally:
+        stop.set()
+
+    print(f"\n{'=' * 60}")
+    print(f"[*] Worker finished {completed} work unit(s)")
+
+
+def find_option_conflicts(options):
+    """Return a message for each combination of the given command-line options that can't run together"""
+    def flag(option):
+        return "--" + option.replace("_", "-")
+
+    problems = []
+    modes = [option for option in CLI_MODES if option in options]
+    if len(modes) > 1:
+        problems.append(f"{', '.join(flag(mode) for mode in modes)} are separate modes; pick one")
+    allowed = CLI_MODE_RENDER_OPTIONS.get(modes[0], ()) if modes else CLI_RENDER_OPTIONS
+    for option in CLI_RENDER_OPTIONS:
+        if option in options and option not in allowed:
+            problems.append(f"{flag(option)} has no effect with {flag(modes[0])}")
+    for first, second in CLI_EXCLUSIVE_OPTIONS:
+        if first in options and second in options:
+            problems.append(f"{flag(first)} and {flag(second)} cannot be combined")
+    for option, needed in CLI_DEPENDENT_OPTIONS.items():
+        if option in options and needed not in options:
+            problems.append(f"{flag(option)} needs {flag(needed)}")
+    return problems
+
+
+def build_parser(description, manifest_columns, deck_weightings):
+    """Return the command line both apps share; each adds its own options"""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--preview", action="store_true",
+                        help=f"render a {PREVIEW_SECONDS}s low-res preview of the loudest section plus a contact sheet")
+    parser.add_argument("--teaser", nargs="?", type=float, const=TEASER_SECONDS, default=None, metavar="SECONDS",
+                        help=f"render only the most energetic SECONDS (default {TEASER_SECONDS}) of each song "
+                             f"at full quality, with short fades")
+    parser.add_argument("--teaser-beats", action="store_true",
+                        help="start each teaser on the beat nearest the chosen window")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="override the per-song seed used to pick the layout")
+    parser.add_argument("--normalize", action="store_true",
+                        help="apply EBU R128 loudness normalization (measurement cached per song)")
+    parser.add_argument("--beat-pulse", action="store_true",
+                        help="pulse the background on detected beats (analysis cached per song)")
+    parser.add_argument("--precomposite", action="store_true",
+                        help="loop a cached render of the background layers instead of composing them live "
+                             "(faster on long songs; the loop is encoded twice)")
+    parser.add_argument("--tune-threads", action="store_true",
+                        help="benchmark decoder/filter/encoder thread splits and save the best for this host")
+    parser.add_argument("--scratch-dir", default=None,
+                        help="fast local folder (tmpfs/NVMe) for intermediates and in-progress renders")
+    parser.add_argument("--scratch-budget-gb", type=float, default=None,
+                        help="hold back new jobs while scratch temp files would exceed this size")
+    parser.add_argument("--fragmented", action="store_true",
+                        help="write fragmented MP4 in a single pass instead of relocating the moov atom")
+    parser.add_argument("--deck", action="store_true",
+                        help="deal backgrounds from a shared shuffled deck instead of the per-song seed "
+                             "(no repeats until every clip is used; layouts depend on the deck's state)")
+    parser.add_argument("--deck-weighting", choices=deck_weightings, default=None,
+                        help="deal some clips more often in each deck cycle")
+    parser.add_argument("--sidecars", action="store_true",
+                        help="also write thumbnail, poster and animated WebP from the same render pass")
+    parser.add_argument("--manifest", default=None,
+                        help=f"CSV or JSON job list ({manifest_columns}) instead of scanning input/")
+    parser.add_argument("--coordinator", metavar="HOST:PORT", default=None,
+                        help="serve this batch as work units to --worker processes")
+    parser.add_argument("--worker", metavar="HOST:PORT", default=None,
+                        help="render work units from a coordinator (media and output on a shared filesystem)")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="serve Prometheus metrics on http://127.0.0.1:PORT/metrics")
+    parser.add_argument("--metrics-textfile", default=None,
+                        help="write Prometheus metrics to this node_exporter textfile (*.prom)")
+    parser.add_argument("--profile-graph", nargs="?", const="", default=None, metavar="AUDIO",
+                        help="attribute filter-graph cost per node for the first job (or the job for AUDIO)")
+    parser.add_argument("--format-report", nargs="?", const="", default=None, metavar="AUDIO",
+                        help="list pixel-format conversions in the first job's graph (or the job for AUDIO) "
+                             "and benchmark it against the unplanned graph")
+    parser.add_argument("--no-format-plan", action="store_true",
+                        help="build graphs without per-layer pixel-format planning")
+    parser.add_argument("--visual-fps", type=int, default=None,
+                        help=f"update rate for spectrum and vectorscope layers (default {VISUAL_FPS})")
+    parser.add_argument("--no-preflight", action="store_true",
+                        help="skip probing inputs and dry-running filter graphs before encoding")
+    parser.add_argument("--check", action="store_true",
+                        help="run the pre-flight checks only, without encoding")
+    parser.add_argument("--live", default=None, metavar="TARGET",
+                        help="stream the playlist through one encoder to an HLS directory or an "
+                             "rtmp://, udp://, srt:// or tcp:// URL")
+    parser.add_argument("--live-loop", action="store_true",
+                        help="repeat the playlist forever in --live mode")
+    parser.add_argument("--compile", default=None, metavar="OUTPUT",
+                        help="join the finished renders into one video by stream copy instead of encoding")
+    parser.add_argument("--crossfade", type=float, default=COMPILE_CROSSFADE_SECONDS, metavar="SECONDS",
+                        help="crossfade between tracks in --compile mode (re-encodes only the boundaries)")
+    parser.add_argument("--batch-short", nargs="?", type=float, const=BATCH_MAX_SECONDS, default=None,
+                        metavar="SECONDS",
+                        help=f"render songs up to SECONDS long (default {BATCH_MAX_SECONDS}) that share a "
+                             f"background in one FFmpeg run per batch")
+    parser.add_argument("--stall-timeout", type=float, default=None, metavar="SECONDS",
+                        help=f"kill and retry an ffmpeg stage lighter after this long without progress "
+                             f"(default {STALL_TIMEOUT}, 0 disables)")
+    parser.add_argument("--concurrency", type=int, default=None, metavar="N",
+                        help="renders sharing this host's CPUs when splitting threads "
+                             "(default: count the render processes running on this host)")
+    parser.add_argument("--usage-log", default=None,
+                        help=f"append per-job CPU, memory and I/O records here (default {USAGE_LOG_PATH})")
+    parser.add_argument("--usage-report", action="store_true",
+                        help="summarize the usage log per preset type, without encoding")
+    return parser
+
+
+def run_cli(app, parser, args):
+    """Apply the parsed command line to the shared settings and run the chosen mode"""
+    global LOUDNORM_ENABLED, BEAT_PULSE_ENABLED, PRECOMPOSITE_ENABLED, FORMAT_PLAN_ENABLED, SCRATCH_DIR
+    global SCRATCH_BUDGET_BYTES, OUTPUT_MODE, DECK_ENABLED, SIDECARS_ENABLED, DECK_WEIGHTING, PREFLIGHT_ENABLED
+    global TEASER_SECONDS, STALL_TIMEOUT, JOB_CONCURRENCY, TEASER_SNAP_BEATS, BATCH_SHORT_ENABLED
+    global BATCH_MAX_SECONDS, VISUAL_FPS, METRICS_PORT, METRICS_TEXTFILE, USAGE_LOG_PATH
+
+    conflicts = find_option_conflicts({option for option, value in vars(args).items()
+                                       if value != parser.get_default(option)})
+    if conflicts:
+        parser.error("; ".join(conflicts))
+    LOUDNORM_ENABLED = args.normalize
+    BEAT_PULSE_ENABLED = args.beat_pulse
+    PRECOMPOSITE_ENABLED = args.precomposite
+    FORMAT_PLAN_ENABLED = not args.no_format_plan
+    if args.scratch_dir:
+        SCRATCH_DIR = os.path.abspath(args.scratch_dir)
+        os.makedirs(SCRATCH_DIR, exist_ok=True)
+    if args.scratch_budget_gb:
+        SCRATCH_BUDGET_BYTES = int(args.scratch_budget_gb * 1e9)
+    if args.fragmented:
+        OUTPUT_MODE = "fragmented"
+    DECK_ENABLED = args.deck
+    SIDECARS_ENABLED = args.sidecars
+    DECK_WEIGHTING = args.deck_weighting
+    PREFLIGHT_ENABLED = not args.no_preflight
+    if args.teaser is not None:
+        TEASER_SECONDS = args.teaser
+    if args.stall_timeout is not None:
+        STALL_TIMEOUT = args.stall_timeout
+    if args.concurrency:
+        JOB_CONCURRENCY = args.concurrency
+    TEASER_SNAP_BEATS = args.teaser_beats
+    if args.batch_short is not None:
+        BATCH_SHORT_ENABLED = True
+        BATCH_MAX_SECONDS = args.batch_short
+    if args.visual_fps:
+        VISUAL_FPS = args.visual_fps
+    METRICS_PORT = args.metrics_port
+    METRICS_TEXTFILE = os.path.abspath(args.metrics_textfile) if args.metrics_textfile else None
+    if args.usage_log:
+        USAGE_LOG_PATH = os.path.abspath(args.usage_log)
+
+    print(f"🎵 {parser.description}")
+    print("=" * 60)
+
+    # Clean up any leftover temp files from previous runs (workers on one
+    # host share the scratch folder with live siblings, so they skip this)
+    if not args.worker:
+        cleanup_startup_temp_files()
+
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)
+
+    try:
+        if args.tune_threads:
+            app.tune_threads()
+        elif args.profile_graph is not None or args.format_report is not None:
+            audio = args.profile_graph if args.profile_graph is not None else args.format_report
+            jobs = app.collect_jobs(args.manifest) or []
+            target = os.path.abspath(audio) if audio else None
+            job = next((j for j in jobs if not target or os.path.abspath(j["audio"]) == target), None)
+            if job and args.profile_graph is not None:
+                profile_graph(app, job, args.seed)
+            elif job:
+                report_pixel_formats(app, job, args.seed)
+            elif jobs:
+                print(f"[!] No job reads {audio}")
+        elif args.live:
+            run_live(app, args.live, args.manifest, args.seed, args.live_loop)
+        elif args.compile:
+            app.compile_renders(os.path.abspath(args.compile), args.manifest, args.crossfade)
+        elif args.usage_report:
+            records = load_usage_log(USAGE_LOG_PATH)
+            print(f"[*] {len(records)} job record(s) in {USAGE_LOG_PATH}")
+            print_usage_summary(records)
+        elif args.check:
+            jobs = app.collect_jobs(args.manifest)
+            if jobs:
+                preflight(app, jobs, args.preview)
+        elif args.worker:
+            run_worker(app, parse_address(args.worker))
+        elif args.coordinator:
+            run_coordinator(app, parse_address(args.coordinator), args.manifest)
+        else:
+            batch_generate(app, args.preview, args.seed, args.manifest, args.teaser is not None)
+    except KeyboardInterrupt:
+        print("\n[!] Process interrupted")
+    finally:
+        cleanup_all_temp_files()
+        flush_metrics(force=True)
+
+    print("=" * 60)
+    print("✅ Done — check your output/ folder")
+
+
+def run(cmd, desc=None):
+    """Execute command without progress (for quick operations)"""
+    global CURRENT_PROCESS
+
+    if IS_WINDOWS:
+        CURRENT_PROCESS = run_child(cmd)
+    else:
+        import shlex
+        cmd_str = " ".join(shlex.quote(str(c)) for c in cmd)
+        CURRENT_PROCESS = run_child(cmd_str, shell=True)
+
+    returncode = CURRENT_PROCESS.returncode
+    stderr = CURRENT_PROCESS.stderr
+    CURRENT_PROCESS = None
+
+    if returncode != 0:
+        print(f"\n[!] {desc or 'Error'}")
+        print(f"Error output: {stderr[-800:]}")
+    return returncode == 0
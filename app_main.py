@@ -1,28 +1,28 @@
 import os
-import subprocess
 import sys
-import re
+import json
 import random
-import atexit
-import signal
-from tqdm import tqdm
+import hashlib
+import time
 
-random.seed()  # Initialize with system time
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-INPUT_DIR = os.path.join(BASE_DIR, "input")
-OVERLAY_DIR = os.path.join(INPUT_DIR, "overlay")
-OUTPUT_DIR = os.path.join(BASE_DIR, "output")
-os.makedirs(OUTPUT_DIR, exist_ok=True)
+import app_common as common
 
-IS_WINDOWS = sys.platform.startswith('win')
+common.APP_NAME = os.path.splitext(os.path.basename(__file__))[0]
+OVERLAY_DIR = os.path.join(common.INPUT_DIR, "overlay")
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tiff', '.webp')
 
-# Track temp files for cleanup
-TEMP_FILES = []
-CURRENT_PROCESS = None
+# Live mode: a background with no overlay clip loops a still for this long
+LIVE_STILL_SECONDS = 2
+
+# Output frame size
+FRAME_WIDTH, FRAME_HEIGHT = 1080, 1080
+
+# Stall fallbacks (see common.STALL_TIMEOUT), applied one more per retry
+STALL_FALLBACKS = ("no_glow", "no_overlay", "fast_preset")
 
 # Modern waveform style presets
 WAVEFORM_PRESETS = [
-    # Circular presets
+    # Radial presets
     {
         "name": "Cyan Radial Pulse",
         "color": "0x00FFFF",
@@ -31,8 +31,8 @@ WAVEFORM_PRESETS = [
         "split_channels": False,
         "thickness": 8,
         "glow": True,
-        "position": "bottom",
-        "type": "circular"
+        "position": "center",
+        "type": "radial"
     },
     {
         "name": "Magenta Circle Wave",
@@ -42,8 +42,8 @@ WAVEFORM_PRESETS = [
         "split_channels": False,
         "thickness": 10,
         "glow": True,
-        "position": "bottom",
-        "type": "circular"
+        "position": "center",
+        "type": "radial"
     },
     {
         "name": "Green Frequency Ring",
@@ -53,8 +53,8 @@ WAVEFORM_PRESETS = [
         "split_channels": False,
         "thickness": 6,
         "glow": True,
-        "position": "bottom",
-        "type": "circular"
+        "position": "center",
+        "type": "radial"
     },
     {
         "name": "Orange Spectrum Blast",
@@ -64,8 +64,8 @@ WAVEFORM_PRESETS = [
         "split_channels": False,
         "thickness": 8,
         "glow": True,
-        "position": "bottom",
-        "type": "circular"
+        "position": "center",
+        "type": "radial"
     },
     {
         "name": "Purple Frequency Circle",
@@ -75,8 +75,8 @@ WAVEFORM_PRESETS = [
         "split_channels": False,
         "thickness": 12,
         "glow": True,
-        "position": "bottom",
-        "type": "circular"
+        "position": "center",
+        "type": "radial"
     },
     # Bar presets
     {
@@ -141,446 +141,979 @@ WAVEFORM_PRESETS = [
 ]
 
 
-def cleanup_all_temp_files():
-    """Clean up all tracked temp files and kill running process"""
-    global CURRENT_PROCESS
+def get_random_overlay(rng=None):
+    """Get an overlay video: dealt from the overlay deck, or a seeded pick when rng is given"""
+    try:
+        if not os.path.exists(OVERLAY_DIR):
+            return None
 
-    # Kill running FFmpeg process
-    if CURRENT_PROCESS:
-        try:
-            CURRENT_PROCESS.terminate()
-            CURRENT_PROCESS.wait(timeout=3)
-        except:
-            try:
-                CURRENT_PROCESS.kill()
-            except:
-                pass
-        CURRENT_PROCESS = None
-
-    # Clean up temp files
-    for f in TEMP_FILES:
+        if rng is None:
+            return common.draw_from_deck(OVERLAY_DIR, common.VIDEO_EXTENSIONS)
+
+        overlays = sorted(f for f in os.listdir(OVERLAY_DIR)
+                          if f.lower().endswith(common.VIDEO_EXTENSIONS))
+
+        if not overlays:
+            return None
+
+        return os.path.join(OVERLAY_DIR, rng.choice(overlays))
+    except Exception:
+        return None
+
+
+def apply_layout_overrides(layout, overrides):
+    """Apply manifest-pinned preset and overlay on top of a layout"""
+    presets = {p["name"]: p for p in WAVEFORM_PRESETS}
+    if overrides.get("preset") in presets:
+        layout["preset"] = presets[overrides["preset"]]
+    if overrides.get("overlay"):
+        layout["overlay"] = overrides["overlay"]
+    return layout
+
+
+def choose_layout(audio_path, output_path, seed=None, overrides=None):
+    """Pick preset and overlay for a song, reusing a saved layout if present"""
+    overrides = overrides or {}
+    layout_path = common.get_layout_path(output_path)
+    if seed is None and os.path.exists(layout_path):
         try:
-            if os.path.exists(f):
-                os.remove(f)
-        except Exception as e:
-            pass  # File might be locked, will be overwritten next run
-
-
-def cleanup_startup_temp_files():
-    """Remove any leftover temp files from previous runs"""
-    temp_patterns = ['_tmp_audio.wav', '_tmp_*.wav', '_tmp_*.mp4']
-
-    cleaned = 0
-    for pattern in temp_patterns:
-        if '*' in pattern:
-            # Handle wildcards
-            import glob
-            for temp_file in glob.glob(os.path.join(OUTPUT_DIR, pattern)):
-                try:
-                    os.remove(temp_file)
-                    cleaned += 1
-                except:
-                    pass  # File might be locked, FFmpeg will overwrite
-        else:
-            temp_file = os.path.join(OUTPUT_DIR, pattern)
-            if os.path.exists(temp_file):
-                try:
-                    os.remove(temp_file)
-                    cleaned += 1
-                except:
-                    pass
-
-    if cleaned > 0:
-        print(f"[*] Cleaned up {cleaned} leftover temp file(s)")
-
-
-def signal_handler(signum, frame):
-    """Handle Ctrl+C gracefully"""
-    print("\n\n[!] Interrupted! Cleaning up...")
-    cleanup_all_temp_files()
-    sys.exit(0)
-
-
-# Register cleanup handlers
-atexit.register(cleanup_all_temp_files)
-signal.signal(signal.SIGINT, signal_handler)
-if hasattr(signal, 'SIGTERM'):
-    signal.signal(signal.SIGTERM, signal_handler)
-
-
-def run_with_progress(cmd, desc=None, duration=None):
-    """Execute FFmpeg command with progress tracking"""
-    global CURRENT_PROCESS
-
-    if IS_WINDOWS:
-        CURRENT_PROCESS = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            universal_newlines=True,
-            creationflags=subprocess.CREATE_NO_WINDOW if IS_WINDOWS else 0
-        )
+            with open(layout_path, "r", encoding="utf-8") as f:
+                layout = json.load(f)
+            presets = {p["name"]: p for p in WAVEFORM_PRESETS}
+            overlay_path = layout.get("overlay")
+            if layout.get("preset") in presets and (not overlay_path or os.path.exists(overlay_path)):
+                layout["preset"] = presets[layout["preset"]]
+                return apply_layout_overrides(layout, overrides)
+        except (OSError, ValueError):
+            pass
+
+    explicit_seed = seed is not None
+    if seed is None:
+        seed = common.get_song_seed(audio_path)
+    rng = random.Random(seed)
+
+    # An explicit --seed reproduces the overlay too; otherwise deal from the deck
+    deck_rng = None if common.DECK_ENABLED and not explicit_seed else rng
+    preset = rng.choice(WAVEFORM_PRESETS)
+
+    return apply_layout_overrides({
+        "seed": seed,
+        "preset": preset,
+        "overlay": overrides.get("overlay") or get_random_overlay(deck_rng),
+    }, overrides)
+
+
+def save_layout(layout, output_path):
+    """Persist the chosen layout so the final render reuses it"""
+    data = dict(layout, preset=layout["preset"]["name"])
+    try:
+        with open(common.get_layout_path(output_path), "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+    except OSError as e:
+        print(f"[!] Could not save layout: {e}")
+
+
+def get_wave_height(preset):
+    """Return waveform layer height for a preset at full resolution"""
+    if preset["type"] in ["radial", "circular"]:
+        return 1080
+    elif preset["type"] == "bars":
+        return 1000
+    elif preset["type"] == "vector":
+        return 300
     else:
-        import shlex
-        cmd_str = " ".join(shlex.quote(str(c)) for c in cmd)
-        CURRENT_PROCESS = subprocess.Popen(
-            cmd_str,
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            universal_newlines=True
-        )
+        return 300
 
-    # Create progress bar if we have duration info
-    pbar = None
-    if duration and desc:
-        pbar = tqdm(total=100, desc=desc, unit="%", leave=False,
-                    bar_format='{l_bar}{bar}| {n:.0f}% [{elapsed}<{remaining}]')
 
-    stderr_output = []
-    time_pattern = re.compile(r'time=(\d+):(\d+):(\d+\.\d+)')
+def build_background_graph(overlay_path, width, height, overlay_input_index=2, precomposed=False,
+                           out_label="[bg_layer]"):
+    """Build the background and overlay layers, ending in out_label"""
+    filter_parts = []
 
-    # Read stderr line by line
-    try:
-        while True:
-            line = CURRENT_PROCESS.stderr.readline()
-            if not line:
-                break
-            stderr_output.append(line)
-
-            # Parse progress from FFmpeg output
-            if pbar and duration:
-                match = time_pattern.search(line)
-                if match:
-                    hours = int(match.group(1))
-                    minutes = int(match.group(2))
-                    seconds = float(match.group(3))
-                    current_time = hours * 3600 + minutes * 60 + seconds
-                    progress = min((current_time / duration) * 100, 100)
-                    pbar.n = progress
-                    pbar.refresh()
-    except KeyboardInterrupt:
-        if pbar:
-            pbar.close()
-        raise
-
-    CURRENT_PROCESS.wait()
-    returncode = CURRENT_PROCESS.returncode
-    CURRENT_PROCESS = None
-
-    if pbar:
-        pbar.n = 100
-        pbar.refresh()
-        pbar.close()
-
-    if returncode != 0:
-        print(f"\n[!] {desc or 'Error'}")
-        error_text = ''.join(stderr_output[-20:])  # Last 20 lines
-        print(f"Error output:\n{error_text}")
-        return False
+    if precomposed:
+        # Cached loop already holds the scaled image with the overlay keyed in
+        filter_parts.append(f"[0:v]setsar=1{out_label}")
+        return filter_parts
 
-    return True
+    # The still image is decoded, scaled and converted once, then repeated by the loop filter
+    still_format = f"format={common.LAYER_PIXEL_FORMATS['background']}," if common.FORMAT_PLAN_ENABLED else ""
+    filter_parts.append(
+        f"[0:v]scale={width}:{height}:force_original_aspect_ratio=increase,"
+        f"crop={width}:{height},setsar=1,{still_format}loop=loop=-1:size=1:start=0[bg]"
+    )
 
+    if not overlay_path:
+        filter_parts.append(f"[bg]null{out_label}")
+        return filter_parts
 
-def run(cmd, desc=None):
-    """Execute command without progress (for quick operations)"""
-    global CURRENT_PROCESS
+    overlay_opacity = 0.7
 
-    if IS_WINDOWS:
-        CURRENT_PROCESS = subprocess.run(cmd, capture_output=True, text=True,
-                                         creationflags=subprocess.CREATE_NO_WINDOW if IS_WINDOWS else 0)
+    filter_parts.append(
+        f"[{overlay_input_index}:v]scale={width}:{height}:force_original_aspect_ratio=increase,"
+        f"crop={width}:{height},setsar=1,"
+        f"format={common.LAYER_PIXEL_FORMATS['overlay']}[overlay_scaled]"
+    )
+    filter_parts.append(f"[overlay_scaled]chromakey=black:0.01:0.05[overlay_keyed]")
+
+    # colorchannelmixer only takes RGB, which would round-trip every overlay
+    # frame through argb and blend the background in RGB; lut scales the
+    # alpha plane in place and the blend stays in yuv420
+    if overlay_opacity < 1.0 and common.FORMAT_PLAN_ENABLED:
+        filter_parts.append(f"[overlay_keyed]lut=a=val*{overlay_opacity}[overlay_loop]")
+    elif overlay_opacity < 1.0:
+        filter_parts.append(f"[overlay_keyed]colorchannelmixer=aa={overlay_opacity}[overlay_loop]")
     else:
-        import shlex
-        cmd_str = " ".join(shlex.quote(str(c)) for c in cmd)
-        CURRENT_PROCESS = subprocess.run(cmd_str, shell=True, capture_output=True, text=True)
+        filter_parts.append(f"[overlay_keyed]null[overlay_loop]")
 
-    returncode = CURRENT_PROCESS.returncode
-    stderr = CURRENT_PROCESS.stderr
-    CURRENT_PROCESS = None
+    blend_format = "yuv420" if common.FORMAT_PLAN_ENABLED else "auto"
+    filter_parts.append(f"[bg][overlay_loop]overlay=0:0:shortest=1:format={blend_format}{out_label}")
+    return filter_parts
 
-    if returncode != 0:
-        print(f"\n[!] {desc or 'Error'}")
-        print(f"Error output: {stderr[-800:]}")
-    return returncode == 0
 
+def build_compose_graph(preset, overlay_path, width, height, wave_width, wave_height,
+                        audio_input_index=1, audio_filter=None, beat_cmd_path=None,
+                        precomposed=False, fps=30, silent_ranges=None):
+    """Build the compose filter graph (background, overlay, waveform) ending in [v]"""
+    filter_parts = build_background_graph(overlay_path, width, height, precomposed=precomposed)
+    current_layer = "[bg_layer]"
 
-def get_duration(path):
-    """Return audio length in seconds"""
-    cmd = [
-        "ffprobe", "-v", "error",
-        "-show_entries", "format=duration",
-        "-of", "default=noprint_wrappers=1:nokey=1",
-        path
-    ]
-    try:
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        duration = float(result.stdout.strip())
-        return duration if duration > 0 else 30.0
-    except (subprocess.CalledProcessError, ValueError) as e:
-        print(f"[!] Could not get duration for {os.path.basename(path)}, using 30s default")
-        return 30.0
+    if beat_cmd_path:
+        filter_parts.append(
+            f"{current_layer}sendcmd=f={common.escape_filter_path(beat_cmd_path)},eq@beat[bg_pulse]"
+        )
+        current_layer = "[bg_pulse]"
+
+    audio_label = f"[{audio_input_index}:a]"
+    if audio_filter:
+        filter_parts.append(f"{audio_label}{audio_filter}[audio_norm]")
+        audio_label = "[audio_norm]"
 
+    filter_parts.extend(common.build_wave_layer(preset, wave_width, wave_height, audio_label, current_layer,
+                                         fps=fps, silent_ranges=silent_ranges))
+    return ";".join(filter_parts)
 
-def get_random_overlay():
-    """Get random overlay video from overlay folder"""
-    overlay_extensions = ('.mp4', '.mov', '.avi', '.mkv', '.webm')
+
+def build_compose_inputs(image_path, audio_input, overlay_path, overlay_offset=0.0, fps=30,
+                         precomposite_path=None):
+    """Build FFmpeg input arguments matching build_compose_graph's input indices"""
+    if precomposite_path:
+        # The precomposite spans one loop period, so the same offset applies
+        seek = ["-ss", f"{overlay_offset:.2f}"] if overlay_offset > 0 else []
+        return seek + ["-stream_loop", "-1", "-i", precomposite_path, "-i", audio_input]
+
+    cmd = ["-framerate", str(fps), "-i", image_path, "-i", audio_input]
+
+    if overlay_path:
+        if overlay_offset > 0:
+            cmd.extend(["-ss", f"{overlay_offset:.2f}"])
+        cmd.extend(["-stream_loop", "-1", "-i", overlay_path])
+
+    return cmd
+
+
+def get_precomposite(image_path, overlay_path, width, height, fps, duration,
+                     encode_args=common.PRECOMPOSITE_ENCODE_ARGS, always=False):
+    """Return a cached one-loop-period render of image plus overlay, or None to compose live"""
+    if not overlay_path and not always:
+        return None  # A bare still is already scaled once and looped in the graph
+
+    loop_period = common.get_duration(overlay_path) if overlay_path else LIVE_STILL_SECONDS
+    if not always and duration < common.PRECOMPOSITE_MIN_LOOPS * loop_period:
+        return None
 
     try:
-        if not os.path.exists(OVERLAY_DIR):
-            return None
+        key_parts = [common.get_file_key(image_path), common.get_file_key(overlay_path) if overlay_path else None,
+                     width, height, fps, encode_args, common.FORMAT_PLAN_ENABLED]
+    except OSError:
+        return None
+    key = hashlib.sha1(json.dumps(key_parts).encode("utf-8")).hexdigest()
+    precomposite_path = os.path.join(common.PRECOMPOSITE_DIR, f"{key}.mp4")
 
-        overlays = [f for f in os.listdir(OVERLAY_DIR)
-                    if f.lower().endswith(overlay_extensions)]
+    if os.path.exists(precomposite_path):
+        print("  ├─ Background: reusing cached loop precomposite")
+        return precomposite_path
 
-        if not overlays:
-            return None
+    os.makedirs(common.PRECOMPOSITE_DIR, exist_ok=True)
+    tmp_path = f"{precomposite_path}.{os.getpid()}.tmp.mp4"
+    common.TEMP_FILES.append(tmp_path)
 
-        return os.path.join(OVERLAY_DIR, random.choice(overlays))
-    except Exception:
+    filter_parts = build_background_graph(overlay_path, width, height, overlay_input_index=1,
+                                          out_label="[pre_layer]")
+    filter_parts.append("[pre_layer]format=yuv420p[pre]")
+    filter_graph = ";".join(filter_parts)
+
+    input_args = ["-framerate", str(fps), "-i", image_path]
+    if overlay_path:
+        input_args.extend(["-i", overlay_path])
+
+    threads = common.allocate_threads(common.get_job_concurrency())
+    cmd = [
+        "ffmpeg", "-y", "-filter_complex_threads", str(threads["filter"]),
+        *common.with_decoder_threads(input_args, threads),
+        "-filter_complex", filter_graph,
+        "-map", "[pre]",
+        "-t", f"{loop_period:.3f}",
+        "-r", str(fps),
+        *encode_args,
+        "-threads", str(threads["encoder"]),
+        "-an",
+        tmp_path
+    ]
+
+    if not common.run_with_progress(cmd, "  ├─ Precomposing background loop", loop_period):
         return None
 
+    os.replace(tmp_path, precomposite_path)
+    common.TEMP_FILES.remove(tmp_path)
+    return precomposite_path
 
-def build_waveform_filter(preset, wave_width, wave_height):
-    """Build FFmpeg filter string based on preset style"""
-    color = preset["color"]
-    mode = preset["mode"]
-    scale = preset["scale"]
-    split = preset["split_channels"]
-    wave_type = preset["type"]
 
-    if wave_type == "circular":
-        wave_filter = (
-            f"showfreqs=s={wave_width}x{wave_height}:mode=line:colors={color}:"
-            f"fscale=log:ascale=sqrt"
-        )
-        filter_chain = f"[AUDIO_INPUT]{wave_filter}[wave]"
-    elif wave_type == "bars":
-        win_size = preset.get("win_size", 2048)
-        wave_filter = (
-            f"showfreqs=s={wave_width}x{wave_height}:mode=bar:colors={color}:"
-            f"fscale=log:ascale={scale}:win_size={win_size}"
-        )
-        filter_chain = f"[AUDIO_INPUT]{wave_filter}[wave]"
-    elif wave_type == "vector":
-        wave_filter = (
-            f"avectorscope=s={wave_width}x{wave_height}:mode={mode}:draw=line:"
-            f"scale={scale}"
-        )
-        filter_chain = f"[AUDIO_INPUT]{wave_filter}[wave]"
-    elif wave_type == "spectrum":
-        wave_filter = (
-            f"showspectrum=s={wave_width}x{wave_height}:mode={mode}:color={color}:"
-            f"scale={scale}:slide=scroll"
-        )
-        filter_chain = f"[AUDIO_INPUT]{wave_filter}[wave]"
-    else:
-        wave_filter = (
-            f"showwaves=s={wave_width}x{wave_height}:mode={mode}:colors={color}:"
-            f"scale={scale}:draw=scale"
-        )
-        if split:
-            wave_filter += ":split_channels=1"
-        filter_chain = f"[AUDIO_INPUT]{wave_filter}[wave]"
+def make_contact_sheet(image_path, audio_path, layout, duration, sheet_path, audio_filter=None):
+    """Render a grid of frames sampled across the whole song at preview resolution"""
+    preset = layout["preset"]
+    width = common.scaled_size(1080, common.PREVIEW_SCALE)
+    height = common.scaled_size(1080, common.PREVIEW_SCALE)
+    frames = common.CONTACT_SHEET_COLS * common.CONTACT_SHEET_ROWS
+    interval = max(duration / frames, 0.1)
 
-    if preset.get("glow"):
-        filter_chain += ";[wave]split[wave1][wave2];[wave2]boxblur=3:1[glow];[wave1][glow]overlay[wave]"
+    filter_graph = build_compose_graph(
+        preset, layout["overlay"], width, height,
+        common.scaled_size(1080, common.PREVIEW_SCALE),
+        common.scaled_size(get_wave_height(preset), common.PREVIEW_SCALE),
+        audio_filter=audio_filter
+    )
+    filter_graph += (
+        f";[v]fps=1/{interval:.3f}:start_time={interval / 2:.3f},"
+        f"tile={common.CONTACT_SHEET_COLS}x{common.CONTACT_SHEET_ROWS}[sheet]"
+    )
 
-    if preset.get("mirror"):
-        filter_chain += ";[wave]split[w1][w2];[w2]vflip[w2flip];[w1][w2flip]vstack[wave]"
+    cmd = ["ffmpeg", "-y"]
+    cmd.extend(build_compose_inputs(image_path, audio_path, layout["overlay"]))
+    cmd.extend([
+        "-filter_complex", filter_graph,
+        "-map", "[sheet]",
+        "-t", f"{duration:.2f}",
+        "-frames:v", "1",
+        sheet_path
+    ])
 
-    if preset.get("shadow"):
-        filter_chain += ";[wave]split[wave1][wave2];[wave2]boxblur=5:1,colorchannelmixer=aa=0.3[shadow];[shadow][wave1]overlay[wave]"
+    # tile holds every sampled frame until the song ends, so ffmpeg reports
+    # no frame or time progress for the whole run: no stall watchdog here
+    return common.run_with_progress(cmd, "  └─ Building contact sheet", duration, stall_timeout=0)
 
-    return filter_chain
 
+def apply_stall_fallback(layout, step):
+    """Return a lighter copy of a layout for one STALL_FALLBACKS step, or None if it changes nothing"""
+    if step == "no_glow" and layout["preset"].get("glow"):
+        return dict(layout, preset=dict(layout["preset"], glow=False))
+    if step == "no_overlay" and layout["overlay"]:
+        return dict(layout, overlay=None)
+    if step == "fast_preset" and layout.get("encode_args") != common.STALL_FAST_ENCODE_ARGS:
+        return dict(layout, encode_args=common.STALL_FAST_ENCODE_ARGS)
+    return None
 
-def make_visualizer(image_path, audio_path, output_path):
-    """Generate audio visualizer video from image and audio"""
-    preset = random.choice(WAVEFORM_PRESETS)
-    overlay_path = get_random_overlay()
 
-    wave_width = 1080
-    if preset["type"] == "circular":
-        wave_height = 1080
-    elif preset["type"] == "bars":
-        wave_height = 1000
-    elif preset["type"] == "vector":
-        wave_height = 300
-    else:
-        wave_height = 300
+def make_visualizer(image_path, audio_path, output_path, preview=False, seed=None, segment=None,
+                    overrides=None, layout=None, teaser=False):
+    """Generate audio visualizer video from image and audio"""
+    common.CURRENT_USAGE = usage = common.new_usage()
+    job_started = time.time()
+    layout = layout or choose_layout(audio_path, output_path, seed, overrides)
+    preset_type = layout["preset"]["type"]
+    common.metric_inc("visualizer_jobs_started_total", preset_type=preset_type)
 
-    width = 1080
-    height = 1080
+    ok = False
+    try:
+        # Previews show the chosen layout, so they are not retried lighter. Joined
+        # segments are stream-copied behind the first one's SPS/PPS, so none may
+        # change encode settings: a stalled segment fails and is handed out again
+        steps = () if preview or segment else STALL_FALLBACKS
+        ok = common.render_with_stall_retry(
+            lambda attempt_layout: render_visualizer(attempt_layout, image_path, audio_path, output_path,
+                                                     preview, segment, overrides, teaser),
+            layout, output_path, steps, apply_stall_fallback
+        )
+    finally:
+        common.metric_inc("visualizer_jobs_succeeded_total" if ok else "visualizer_jobs_failed_total",
+                   preset_type=preset_type)
+        common.CURRENT_USAGE = None
+        common.finish_job_usage(usage, preset_type, ok, time.time() - job_started, output_path)
+        common.flush_metrics(force=True)
+    return ok
+
+
+def render_visualizer(layout, image_path, audio_path, output_path, preview=False, segment=None,
+                      overrides=None, teaser=False):
+    """Render a visualizer for an already chosen layout"""
+    preset = layout["preset"]
+    overlay_path = layout["overlay"]
+
+    scale = common.PREVIEW_SCALE if preview else 1.0
+    wave_width = common.scaled_size(1080, scale)
+    wave_height = common.scaled_size(get_wave_height(preset), scale)
+
+    width = common.scaled_size(1080, scale)
+    height = common.scaled_size(1080, scale)
     fps = 30
-    duration = get_duration(audio_path)
+    duration = common.get_duration(audio_path)
+
+    start = 0.0
+    render_duration = duration
+    if preview:
+        render_duration = min(common.PREVIEW_SECONDS, duration)
+        start = common.find_loudest_window(common.get_loudness_envelope(audio_path), render_duration, duration)
+    elif teaser:
+        render_duration = min(common.TEASER_SECONDS, duration)
+        start = common.find_teaser_window(audio_path, render_duration, duration)
+    elif segment:
+        start = segment["start"]
+        render_duration = segment["length"]
+
+    if not common.wait_for_scratch_space(common.estimate_scratch_bytes(render_duration)):
+        return False
 
-    tmp_audio = os.path.join(OUTPUT_DIR, "_tmp_audio.wav")
-    TEMP_FILES.append(tmp_audio)
+    tmp_audio = os.path.join(common.SCRATCH_DIR, f"_tmp_audio_{os.getpid()}.wav")
+    common.TEMP_FILES.append(tmp_audio)
 
-    print(f"\n📝 Processing: {os.path.basename(audio_path)} ({duration:.1f}s)")
+    title = (overrides or {}).get("title") or os.path.basename(audio_path)
+    print(f"\n📝 Processing: {title} ({duration:.1f}s)")
     print(f"   🎨 Style: {preset['name']} ({preset['type']})")
     if overlay_path:
         print(f"   🎬 Overlay: {os.path.basename(overlay_path)}")
+    if preview:
+        print(f"   🔍 Preview: {render_duration:.0f}s from {start:.1f}s (seed {layout['seed']})")
+    if teaser:
+        print(f"   ✂️  Teaser: {render_duration:.0f}s from {start:.1f}s")
+    if segment:
+        print(f"   🧩 Segment: {render_duration:.0f}s from {start:.1f}s")
+
+    audio_filter = None
+    if common.LOUDNORM_ENABLED:
+        audio_filter = common.get_loudnorm_filter(audio_path)
+
+    beat_cmd_path = None
+    if common.BEAT_PULSE_ENABLED:
+        beat_map = common.get_beat_map(audio_path)
+        if beat_map:
+            beat_cmd_path = os.path.join(common.SCRATCH_DIR, f"_tmp_beats_{os.getpid()}.txt")
+            common.TEMP_FILES.append(beat_cmd_path)
+            pulses = common.write_beat_commands(beat_map, beat_cmd_path, start, render_duration)
+            print(f"   🥁 Beat pulse: {float(beat_map['tempo']):.0f} BPM, {pulses} beats")
+
+    silent_ranges = common.get_silent_ranges(preset, audio_path, start, render_duration)
+    if silent_ranges:
+        silent_seconds = sum(end - begin for begin, end in silent_ranges)
+        print(f"   🔇 Silence: {silent_seconds:.0f}s in {len(silent_ranges)} stretch(es) skip the waveform blend")
 
     # Step 1: Normalize audio
-    if not run_with_progress([
-        "ffmpeg", "-y", "-i", audio_path,
+    audio_cmd = ["ffmpeg", "-y"]
+    if preview or segment or teaser:
+        audio_cmd.extend(["-ss", f"{start:.2f}", "-t", f"{render_duration:.2f}"])
+    audio_cmd.extend(["-i", audio_path])
+    if teaser:
+        # Faded here, so the waveform fades in and out with the sound
+        audio_fades = common.get_teaser_fades(render_duration, audio=True)
+        audio_cmd.extend(["-af", f"{audio_filter},{audio_fades}" if audio_filter else audio_fades])
+    elif audio_filter:
+        audio_cmd.extend(["-af", audio_filter])
+    audio_cmd.extend([
         "-ac", "2", "-ar", "44100", "-acodec", "pcm_s16le",
         tmp_audio
-    ], "  ├─ Converting audio", duration):
+    ])
+    if not common.run_with_progress(audio_cmd, "  ├─ Converting audio", render_duration):
         return False
 
+    # Preview windows are short enough to encode inline; full renders mux
+    # a passthrough or cached AAC track without re-encoding
+    audio_track = None
+    if not preview and not segment and not teaser:
+        audio_track = common.prepare_audio_track(audio_path, duration, audio_filter)
+        if not audio_track:
+            return False
+
     # Step 2: Build filter graph
-    input_count = 2
+    precomposite_path = None
+    if common.PRECOMPOSITE_ENABLED and not preview:
+        # A teaser only spans its own window, which may not cover enough loops to pay off
+        precomposite_path = get_precomposite(image_path, overlay_path, width, height, fps,
+                                             render_duration if teaser else duration)
+
     audio_input_index = 1
+    filter_graph = build_compose_graph(preset, overlay_path, width, height, wave_width, wave_height,
+                                       audio_input_index, beat_cmd_path=beat_cmd_path,
+                                       precomposed=bool(precomposite_path), fps=fps,
+                                       silent_ranges=silent_ranges)
+
+    overlay_offset = 0.0
+    if (preview or segment or teaser) and overlay_path and start > 0:
+        overlay_offset = start % common.get_duration(overlay_path)
+
+    threads = common.allocate_threads(common.get_job_concurrency())
+    cmd = ["ffmpeg", "-y", "-filter_complex_threads", str(threads["filter"])]
+    cmd.extend(common.with_decoder_threads(
+        build_compose_inputs(image_path, tmp_audio, overlay_path, overlay_offset, fps, precomposite_path),
+        threads
+    ))
+
+    if audio_track:
+        audio_args = ["-map", f"{cmd.count('-i')}:a", "-c:a", "copy"]
+        cmd.extend(["-i", audio_track])
+    elif segment:
+        # Segments are video-only; the full audio track is muxed in when they are joined
+        audio_args = ["-an"]
+    else:
+        audio_args = ["-map", f"{audio_input_index}:a", "-c:a", "aac", "-b:a", "192k"]
 
-    filter_parts = []
-    filter_parts.append(
-        f"[0:v]scale={width}:{height}:force_original_aspect_ratio=increase,"
-        f"crop={width}:{height},setsar=1[bg]"
-    )
+    if preview:
+        encode_args = ["-preset", "ultrafast", "-crf", "30"]
+    else:
+        encode_args = layout.get("encode_args", common.FINAL_ENCODE_ARGS)
+
+    render_path = output_path
+    if preview:
+        render_path = os.path.splitext(output_path)[0] + ".preview.mp4"
+    elif teaser:
+        render_path = os.path.splitext(output_path)[0] + ".teaser.mp4"
+    elif segment:
+        render_path = segment["path"]
+
+    # Render into scratch; the final name only appears once the file is complete
+    scratch_render = os.path.join(common.SCRATCH_DIR, f"_tmp_render_{os.getpid()}.mp4")
+    common.TEMP_FILES.append(scratch_render)
+
+    # Sidecars branch off the composed frames, so they cost no extra decode
+    video_label = "[v]"
+    if teaser:
+        filter_graph += f";[v]{common.get_teaser_fades(render_duration)}[v_teaser]"
+        video_label = "[v_teaser]"
+
+    sidecars = []
+    if common.SIDECARS_ENABLED and not preview and not segment and not teaser:
+        anim_start = common.find_loudest_window(common.get_loudness_envelope(audio_path), common.ANIMATION_SECONDS,
+                                                duration)
+        filter_graph += common.build_sidecar_graph(anim_start + common.ANIMATION_SECONDS / 2, anim_start)
+        video_label = "[v_main]"
+        sidecars = common.get_sidecar_outputs(output_path)
+        common.TEMP_FILES.extend(scratch_path for scratch_path, _, _ in sidecars)
 
-    current_layer = "[bg]"
+    cmd.extend([
+        "-filter_complex", filter_graph,
+        "-map", video_label,
+        "-t", f"{render_duration:.2f}",
+        "-c:v", "libx264",
+        *encode_args,
+        "-threads", str(threads["encoder"]),
+        "-pix_fmt", "yuv420p",
+        "-r", str(fps),
+        *audio_args,
+        *common.get_container_args(fps),
+        scratch_render
+    ])
+    for scratch_path, _, output_args in sidecars:
+        cmd.extend([*output_args, scratch_path])
+
+    compose_desc = "  ├─ Composing preview" if preview else "  └─ Composing final video"
+    if teaser:
+        compose_desc = "  └─ Composing teaser"
+    render_started = time.time()
+    if not common.run_with_progress(cmd, compose_desc, render_duration):
+        return False
 
-    if overlay_path:
-        input_count += 1
-        overlay_input_index = input_count - 1
-        overlay_opacity = 0.7
+    streams = ("video",) if segment else ("video", "audio")
+    if not common.publish_output(scratch_render, render_path, render_duration, streams):
+        return False
 
-        filter_parts.append(
-            f"[{overlay_input_index}:v]scale={width}:{height}:force_original_aspect_ratio=increase,"
-            f"crop={width}:{height},setsar=1,"
-            f"format=yuva420p[overlay_scaled]"
-        )
-        filter_parts.append(f"[overlay_scaled]chromakey=black:0.01:0.05[overlay_keyed]")
+    for scratch_path, final_path, _ in sidecars:
+        if not common.publish_output(scratch_path, final_path):
+            return False
 
-        if overlay_opacity < 1.0:
-            filter_parts.append(f"[overlay_keyed]colorchannelmixer=aa={overlay_opacity}[overlay_loop]")
-        else:
-            filter_parts.append(f"[overlay_keyed]null[overlay_loop]")
+    render_seconds = time.time() - render_started
+    render_bytes = os.path.getsize(render_path)
+    common.RENDER_STATS.append({"mode": common.OUTPUT_MODE, "seconds": render_seconds, "bytes": render_bytes})
+    common.metric_inc("visualizer_bytes_written_total", render_bytes, mode=common.OUTPUT_MODE)
+    print(f"   ⏱️  Render: {render_seconds:.1f}s, {common.format_size(render_bytes)} ({common.OUTPUT_MODE})")
 
-        filter_parts.append(f"{current_layer}[overlay_loop]overlay=0:0:shortest=1:format=auto[bg_with_overlay]")
-        current_layer = "[bg_with_overlay]"
+    # Clean up temp files immediately after successful completion
+    for tmp_file in [tmp_audio, beat_cmd_path]:
+        try:
+            if tmp_file and os.path.exists(tmp_file):
+                os.remove(tmp_file)
+                if tmp_file in common.TEMP_FILES:
+                    common.TEMP_FILES.remove(tmp_file)
+        except:
+            pass
+
+    if preview:
+        save_layout(layout, output_path)
+        sheet_path = os.path.splitext(output_path)[0] + ".contact.png"
+        scratch_sheet = os.path.join(common.SCRATCH_DIR, f"_tmp_sheet_{os.getpid()}.png")
+        common.TEMP_FILES.append(scratch_sheet)
+        if not make_contact_sheet(image_path, audio_path, layout, duration, scratch_sheet, audio_filter):
+            return False
+        if not common.publish_output(scratch_sheet, sheet_path):
+            return False
+        print(f"  ✅ Preview: {os.path.basename(render_path)} + {os.path.basename(sheet_path)}")
+        return True
+
+    if segment:
+        print(f"  ✅ Segment: {os.path.basename(render_path)}")
+        return True
+
+    if teaser:
+        print(f"  ✅ Teaser: {os.path.basename(render_path)}")
+        return True
 
-    if preset["type"] in ["circular", "bars", "vector"]:
-        waveform_height = wave_height
-    else:
-        waveform_height = wave_height // 2
+    print(f"  ✅ Complete: {os.path.basename(output_path)}")
+    return True
 
-    waveform_filter = build_waveform_filter(preset, wave_width, waveform_height)
-    waveform_filter = waveform_filter.replace("[AUDIO_INPUT]", f"[{audio_input_index}:a]")
-    filter_parts.append(waveform_filter)
 
-    if preset["position"] == "center":
-        overlay_pos = f"(W-w)/2:(H-h)/2"
-    else:
-        overlay_pos = "0:H-h"
+def tune_threads():
+    """Benchmark thread splits on a short slice of the first input and save the best for this host"""
+    if not os.path.isdir(common.INPUT_DIR):
+        print(f"[!] Input directory not found: {common.INPUT_DIR}")
+        return False
 
-    filter_parts.append(f"{current_layer}[wave]overlay={overlay_pos},format=yuv420p[v]")
+    audio_path = image_path = None
+    for folder, names in sorted(common.scan_input_tree(common.INPUT_DIR, [OVERLAY_DIR]).items()):
+        audio_path = audio_path or next((os.path.join(folder, f) for f in names
+                                         if f.lower().endswith(common.AUDIO_EXTENSIONS)), None)
+        image_path = image_path or next((os.path.join(folder, f) for f in names
+                                         if f.lower().endswith(IMAGE_EXTENSIONS)), None)
+    if not audio_path or not image_path:
+        print("[!] Tuning needs at least one audio file and one image in input/")
+        return False
 
-    filter_graph = ";".join(filter_parts)
+    # Heaviest chain: full-frame radial spectrum with glow over a keyed overlay
+    preset = next(p for p in WAVEFORM_PRESETS if p["type"] == "radial" and p.get("glow"))
+    overlay_path = get_random_overlay(random.Random(0))
+    fps = 30
 
-    cmd = ["ffmpeg", "-y", "-loop", "1", "-i", image_path, "-i", tmp_audio]
+    filter_graph = build_compose_graph(preset, overlay_path, 1080, 1080, 1080, get_wave_height(preset))
+    input_args = build_compose_inputs(image_path, audio_path, overlay_path, fps=fps)
 
-    if overlay_path:
-        cmd.extend(["-stream_loop", "-1", "-i", overlay_path])
+    return common.run_thread_search(input_args, filter_graph, fps)
 
-    cmd.extend([
-        "-filter_complex", filter_graph,
-        "-map", "[v]",
-        "-map", f"{audio_input_index}:a",
-        "-t", f"{duration:.2f}",
-        "-c:v", "libx264",
-        "-preset", "medium",
-        "-crf", "23",
-        "-pix_fmt", "yuv420p",
-        "-r", str(fps),
-        "-c:a", "aac",
-        "-b:a", "192k",
-        "-movflags", "+faststart",
-        output_path
-    ])
 
-    if not run_with_progress(cmd, "  └─ Composing final video", duration):
-        return False
+def prepare_profile_slice(job, seed=None):
+    """Prepare the loudest slice of a job and the arguments of the compose graph it would render"""
+    # A saved layout is what the render will use; otherwise take the song's
+    # seeded pick rather than dealing a background from the deck
+    if seed is None and not os.path.exists(common.get_layout_path(job["output"])):
+        seed = common.get_song_seed(job["audio"])
+    layout = choose_layout(job["audio"], job["output"], seed, job.get("overrides"))
+    preset = layout["preset"]
+    overlay_path = layout["overlay"]
 
-    # Clean up temp file immediately after successful completion
-    try:
-        if os.path.exists(tmp_audio):
-            os.remove(tmp_audio)
-            TEMP_FILES.remove(tmp_audio)
-    except:
-        pass
+    fps = 30
+    duration = common.get_duration(job["audio"])
+    seconds = min(common.PROFILE_SECONDS, duration)
+    start = common.find_loudest_window(common.get_loudness_envelope(job["audio"]), seconds, duration)
+
+    tmp_audio = os.path.join(common.SCRATCH_DIR, f"_tmp_audio_{os.getpid()}.wav")
+    common.TEMP_FILES.append(tmp_audio)
+    audio_cmd = [
+        "ffmpeg", "-y", "-ss", f"{start:.2f}", "-t", f"{seconds:.2f}", "-i", job["audio"],
+        "-ac", "2", "-ar", "44100", "-acodec", "pcm_s16le", tmp_audio
+    ]
+    if not common.run_with_progress(audio_cmd, "  ├─ Converting audio", seconds):
+        return None
 
-    print(f"  ✅ Complete: {os.path.basename(output_path)}")
-    return True
+    beat_cmd_path = None
+    if common.BEAT_PULSE_ENABLED:
+        beat_map = common.get_beat_map(job["audio"])
+        if beat_map:
+            beat_cmd_path = os.path.join(common.SCRATCH_DIR, f"_tmp_beats_{os.getpid()}.txt")
+            common.TEMP_FILES.append(beat_cmd_path)
+            common.write_beat_commands(beat_map, beat_cmd_path, start, seconds)
+
+    # Same graph as a full-resolution render, with the background composed
+    # live so its nodes are attributed too (a cached precomposite skips them)
+    graph_args = {
+        "preset": preset, "overlay_path": overlay_path, "width": 1080, "height": 1080, "wave_width": 1080,
+        "wave_height": get_wave_height(preset), "beat_cmd_path": beat_cmd_path, "fps": fps,
+        "silent_ranges": common.get_silent_ranges(preset, job["audio"], start, seconds)
+    }
+    overlay_offset = start % common.get_duration(overlay_path) if overlay_path and start > 0 else 0.0
+    input_args = build_compose_inputs(job["image"], tmp_audio, overlay_path, overlay_offset, fps)
+    return {"preset": preset, "seconds": seconds, "start": start, "fps": fps,
+            "input_args": input_args, "graph_args": graph_args}
 
 
-def batch_generate():
-    """Process all audio files in input directory"""
-    audio_extensions = ('.wav', '.mp3', '.m4a', '.flac', '.ogg', '.aac')
-    image_extensions = ('.png', '.jpg', '.jpeg', '.bmp', '.tiff', '.webp')
+def load_manifest_jobs(manifest_path):
+    """Build render jobs from a manifest with audio, image and optional overlay, title, preset and output"""
+    rows = common.read_manifest(manifest_path)
+    if rows is None:
+        return None
 
-    try:
-        files = [f for f in os.listdir(INPUT_DIR)
-                 if f.lower().endswith(audio_extensions)]
-    except FileNotFoundError:
-        print(f"[!] Input directory not found: {INPUT_DIR}")
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    presets = {p["name"] for p in WAVEFORM_PRESETS}
+    jobs = []
+    for idx, row in enumerate(rows, 1):
+        paths = {key: os.path.join(base_dir, row[key]) for key in ("audio", "image", "overlay") if key in row}
+        missing = [key for key in ("audio", "image") if not os.path.isfile(paths.get(key, ""))]
+        if "overlay" in paths and not os.path.isfile(paths["overlay"]):
+            missing.append("overlay")
+        if missing:
+            print(f"[!] Manifest row {idx}: missing {', '.join(missing)}, skipping")
+            continue
+
+        preset = row.get("preset")
+        if preset and preset not in presets:
+            print(f"[!] Manifest row {idx}: unknown preset '{preset}', using the song's default")
+            preset = None
+
+        overrides = {"preset": preset, "overlay": paths.get("overlay"), "title": row.get("title")}
+        name, output_path = common.get_output_for(paths["audio"], row.get("output"))
+        jobs.append({
+            "name": name,
+            "audio": paths["audio"],
+            "image": paths["image"],
+            "output": output_path,
+            "overrides": {key: value for key, value in overrides.items() if value},
+        })
+
+    if not jobs:
+        print(f"[!] No usable jobs in manifest {manifest_path}")
+        return None
+    return jobs
+
+
+def collect_jobs(manifest_path=None):
+    """Return render jobs from a manifest, or for every audio file in the input tree with a matching image"""
+    if manifest_path:
+        return load_manifest_jobs(manifest_path)
+
+    if not os.path.isdir(common.INPUT_DIR):
+        print(f"[!] Input directory not found: {common.INPUT_DIR}")
         print("[!] Please create an 'input' folder and add your files")
-        return
+        return None
 
-    if not files:
+    jobs = []
+    audio_count = 0
+    for folder, names in sorted(common.scan_input_tree(common.INPUT_DIR, [OVERLAY_DIR]).items()):
+        # Index the folder's images by name once, then pair each audio file
+        images = {}
+        for file_name in names:
+            stem, ext = os.path.splitext(file_name)
+            if ext.lower() in IMAGE_EXTENSIONS:
+                rank = IMAGE_EXTENSIONS.index(ext.lower())
+                if stem not in images or rank < images[stem][0]:
+                    images[stem] = (rank, file_name)
+
+        for file_name in names:
+            stem, ext = os.path.splitext(file_name)
+            if ext.lower() not in common.AUDIO_EXTENSIONS:
+                continue
+            audio_count += 1
+            audio_path = os.path.join(folder, file_name)
+            if stem not in images:
+                print(f"[!] Missing image for '{os.path.relpath(audio_path, common.INPUT_DIR)}', skipping")
+                continue
+
+            name, output_path = common.get_output_for(audio_path)
+            jobs.append({
+                "name": name,
+                "audio": audio_path,
+                "image": os.path.join(folder, images[stem][1]),
+                "output": output_path,
+            })
+
+    if not audio_count:
         print("[!] No audio files found in input/ directory")
-        print(f"[!] Supported formats: {', '.join(audio_extensions)}")
-        return
+        print(f"[!] Supported formats: {', '.join(common.AUDIO_EXTENSIONS)}")
+        return None
+
+    return jobs
+
 
-    print(f"[*] Found {len(files)} audio file(s) to process\n")
+def run_job(job, preview=False, seed=None, segment=None, teaser=False):
+    """Render one job from collect_jobs"""
+    return make_visualizer(job["image"], job["audio"], job["output"], preview, seed, segment,
+                           job.get("overrides"), job.get("layout"), teaser)
 
-    success_count = 0
-    for idx, audio_file in enumerate(files, 1):
-        print(f"{'=' * 60}")
-        print(f"File {idx}/{len(files)}")
 
-        name, _ = os.path.splitext(audio_file)
+def get_job_media(job):
+    """Return (label, path, stream type) for every input file a job reads"""
+    media = [("audio", job["audio"], "audio"), ("image", job["image"], "video")]
+    overlay = (job.get("overrides") or {}).get("overlay")
+    if overlay:
+        media.append(("overlay", overlay, "video"))
+    return media
 
-        img_path = None
-        for ext in image_extensions:
-            potential_path = os.path.join(INPUT_DIR, f"{name}{ext}")
-            if os.path.exists(potential_path):
-                img_path = potential_path
-                break
 
-        if not img_path:
-            print(f"[!] Missing image for '{audio_file}', skipping\n")
+def check_environment():
+    """Return problems that would fail every job"""
+    os.makedirs(common.OUTPUT_DIR, exist_ok=True)
+    if not os.access(common.OUTPUT_DIR, os.W_OK):
+        return [f"Output directory is not writable: {common.OUTPUT_DIR}"]
+    return []
+
+
+def plan_batches(jobs, seed=None):
+    """Split jobs into render units: batches of short songs sharing image and overlay, else single jobs"""
+    units = []
+    open_batches = {}
+    for job in jobs:
+        duration = common.get_duration(job["audio"])
+        if duration > common.BATCH_MAX_SECONDS:
+            units.append([job])
             continue
 
-        audio_path = os.path.join(INPUT_DIR, audio_file)
-        output_path = os.path.join(OUTPUT_DIR, f"{name}.mp4")
+        # The layout is fixed here, not at render time, so the deck deals each song's overlay once
+        layout = choose_layout(job["audio"], job["output"], seed, job.get("overrides"))
+        key = (os.path.abspath(job["image"]), layout["overlay"])
+        batch = open_batches.get(key)
+        if batch is None or len(batch) >= common.BATCH_MAX_JOBS:
+            batch = open_batches[key] = []
+            units.append(batch)
+        batch.append(dict(job, layout=layout, duration=duration))
+    return units
+
+
+def render_batch(batch):
+    """Compose a batch in one FFmpeg run; return per-job success, or None if the run itself failed"""
+    first = batch[0]
+    overlay_path = first["layout"]["overlay"]
+    width = height = wave_width = 1080
+    fps = 30
+    longest = max(job["duration"] for job in batch)
+
+    # No WAV intermediates: each song's audio is decoded straight into its branch
+    batch_seconds = sum(job["duration"] for job in batch)
+    if not common.wait_for_scratch_space(int(batch_seconds * common.SCRATCH_VIDEO_BYTES_PER_SECOND)):
+        return None
 
-        try:
-            if make_visualizer(img_path, audio_path, output_path):
-                success_count += 1
-        except KeyboardInterrupt:
-            print("\n[!] Interrupted by user")
-            raise
+    background = os.path.basename(first["image"])
+    if overlay_path:
+        background += f" + {os.path.basename(overlay_path)}"
+    print(f"\n📦 Batch: {len(batch)} songs sharing {background}")
+
+    precomposite_path = None
+    if common.PRECOMPOSITE_ENABLED:
+        precomposite_path = get_precomposite(first["image"], overlay_path, width, height, fps, longest)
+
+    # Input 1 is the first song, as build_background_graph expects; the others follow the background
+    input_args = build_compose_inputs(first["image"], first["audio"], overlay_path, fps=fps,
+                                      precomposite_path=precomposite_path)
+    audio_indices = [1]
+    for job in batch[1:]:
+        audio_indices.append(input_args.count("-i"))
+        input_args.extend(["-i", job["audio"]])
+
+    filter_parts = build_background_graph(overlay_path, width, height, precomposed=bool(precomposite_path))
+    filter_parts.append(f"[bg_layer]split={len(batch)}" + "".join(f"[bg_{k}]" for k in range(len(batch))))
+
+    threads = common.allocate_threads(common.get_job_concurrency())
+    encoder_threads = max(1, threads["encoder"] // len(batch))
+    output_args = []
+    scratch_renders = []
+    for k, (job, audio_index) in enumerate(zip(batch, audio_indices)):
+        preset = job["layout"]["preset"]
+        title = (job.get("overrides") or {}).get("title") or os.path.basename(job["audio"])
+        print(f"   📝 {title} ({job['duration']:.1f}s): {preset['name']} ({preset['type']})")
+
+        audio_filter = common.get_loudnorm_filter(job["audio"]) if common.LOUDNORM_ENABLED else None
+        # The same s16 stereo 44.1 kHz feed a single render gets from its WAV conversion
+        audio_chain = f"{audio_filter}," if audio_filter else ""
+        filter_parts.append(f"[{audio_index}:a]{audio_chain}aformat=sample_fmts=s16:sample_rates=44100:"
+                            f"channel_layouts=stereo[audio_{k}]")
+
+        wave_audio = f"[audio_{k}]"
+        if common.can_pass_through_audio(job["audio"], audio_filter):
+            audio_args = ["-map", f"{audio_index}:a", "-c:a", "copy"]
+        else:
+            filter_parts.append(f"[audio_{k}]asplit[wave_audio_{k}][aout_{k}]")
+            wave_audio = f"[wave_audio_{k}]"
+            audio_args = ["-map", f"[aout_{k}]", *common.AAC_ENCODE_ARGS]
+
+        silent_ranges = common.get_silent_ranges(preset, job["audio"], 0.0, job["duration"])
+        filter_parts.extend(common.build_wave_layer(preset, wave_width, get_wave_height(preset),
+                                             wave_audio, f"[bg_{k}]", f"[v_{k}]", fps, silent_ranges,
+                                             label_suffix=f"_{k}"))
+
+        scratch_render = os.path.join(common.SCRATCH_DIR, f"_tmp_render_{os.getpid()}_{k}.mp4")
+        common.TEMP_FILES.append(scratch_render)
+        scratch_renders.append(scratch_render)
+        output_args.extend([
+            "-map", f"[v_{k}]",
+            "-t", f"{job['duration']:.2f}",
+            "-c:v", "libx264",
+            *common.FINAL_ENCODE_ARGS,
+            "-threads", str(encoder_threads),
+            "-pix_fmt", "yuv420p",
+            "-r", str(fps),
+            *audio_args,
+            *common.get_container_args(fps),
+            scratch_render
+        ])
+
+    cmd = ["ffmpeg", "-y", "-filter_complex_threads", str(threads["filter"]),
+           *common.with_decoder_threads(input_args, threads),
+           "-filter_complex", ";".join(filter_parts),
+           *output_args]
+
+    render_started = time.time()
+    if not common.run_with_progress(cmd, f"  └─ Composing {len(batch)} videos", longest):
+        return None
+
+    render_seconds = time.time() - render_started
+    results = []
+    for job, scratch_render in zip(batch, scratch_renders):
+        ok = common.publish_output(scratch_render, job["output"], job["duration"])
+        results.append(ok)
+        if not ok:
+            continue
+        render_bytes = os.path.getsize(job["output"])
+        common.RENDER_STATS.append({"mode": common.OUTPUT_MODE, "seconds": render_seconds / len(batch),
+                                    "bytes": render_bytes})
+        common.metric_inc("visualizer_bytes_written_total", render_bytes, mode=common.OUTPUT_MODE)
+        print(f"  ✅ Complete: {os.path.basename(job['output'])} ({common.format_size(render_bytes)})")
+    print(f"   ⏱️  Render: {render_seconds:.1f}s for {len(batch)} videos ({common.OUTPUT_MODE})")
+    return results
+
+
+def prepare_live_track(job, seed=None):
+    """Prepare one playlist entry: common-format audio plus a cached background loop"""
+    layout = choose_layout(job["audio"], job["output"], seed, job.get("overrides"))
+    title = (job.get("overrides") or {}).get("title") or os.path.basename(job["audio"])
+    duration = common.get_duration(job["audio"])
+    print(f"\n📝 Preparing: {title} ({duration:.1f}s)")
+    if layout["overlay"]:
+        print(f"   🎬 Overlay: {os.path.basename(layout['overlay'])}")
+
+    audio_track = common.prepare_live_audio(job["audio"], duration)
+    if not audio_track:
+        return None
 
-    print(f"\n{'=' * 60}")
-    print(f"[*] Successfully processed {success_count}/{len(files)} file(s)")
+    background = get_precomposite(job["image"], layout["overlay"], 1080, 1080, common.LIVE_FPS, duration,
+                                  common.LIVE_BACKGROUND_ENCODE_ARGS, always=True)
+    if not background:
+        return None
 
+    return {"title": title, "layout": layout, "audio": audio_track, "duration": common.get_duration(audio_track),
+            "background": background, "loop_period": common.get_duration(background)}
 
-if __name__ == "__main__":
-    print("🎵 Music Visualizer Generator")
-    print("=" * 60)
 
-    # Clean up any leftover temp files from previous runs
-    cleanup_startup_temp_files()
+def build_live_graph(preset):
+    """Return the compose graph run_live streams every track through; backgrounds arrive precomposed"""
+    return build_compose_graph(preset, None, FRAME_WIDTH, FRAME_HEIGHT, FRAME_WIDTH, get_wave_height(preset),
+                               precomposed=True, fps=common.LIVE_FPS)
+
+
+def render_boundary_clip(prev, render, crossfade, clip_path):
+    """Re-encode the crossfade between the end of one render and the start of the next"""
+    tail_start = prev["tail"][0]
+    tail_length = prev["duration"] - tail_start
+    head_length = render["head"][0]
+    fps = f"{render['fps']:g}"
+    filter_graph = (
+        f"[0:v]setpts=PTS-STARTPTS,fps={fps}[tail];"
+        f"[1:v]trim=end={head_length:.6f},setpts=PTS-STARTPTS,fps={fps}[head];"
+        f"[tail][head]xfade=transition=fade:duration={crossfade:.6f}:"
+        f"offset={tail_length - crossfade:.6f}[v]"
+    )
+    cmd = [
+        "ffmpeg", "-y",
+        "-ss", f"{tail_start:.6f}", "-i", prev["path"],
+        "-i", render["path"],
+        "-filter_complex", filter_graph,
+        "-map", "[v]", "-an",
+        "-c:v", "libx264", *common.get_clip_encode_args(render),
+        "-pix_fmt", render["params"]["pix_fmt"],
+        "-r", fps,
+        clip_path
+    ]
+    length = tail_length + head_length - crossfade
+    if not common.run_with_progress(cmd, f"  ├─ Crossfading into {os.path.basename(render['path'])}", length):
+        return None
+    return length if common.check_boundary_clip(clip_path, render) else None
+
+
+def compile_renders(compilation_path, manifest_path=None, crossfade=common.COMPILE_CROSSFADE_SECONDS):
+    """Join finished per-track renders into one video, re-encoding only around the crossfades"""
+    common.claim_render_slot()
+    jobs = collect_jobs(manifest_path)
+    if not jobs:
+        return False
+
+    missing = [job for job in jobs if not os.path.exists(job["output"])]
+    if missing:
+        print(f"[!] {len(missing)} track(s) have not been rendered yet:")
+        for job in missing:
+            print(f"    {job['output']}")
+        return False
+
+    print(f"[*] Checking {len(jobs)} render(s) for stream-copy compatibility")
+    renders = []
+    for job in jobs:
+        render = common.probe_render(job["output"])
+        if not render or not common.get_audio_codec(job["output"]):
+            print(f"[!] Could not read video and audio streams of {os.path.basename(job['output'])}")
+            return False
+        render["path"] = job["output"]
+        renders.append(render)
+
+    reference = renders[0]
+    compatible = True
+    for render in renders[1:]:
+        differences = common.get_param_differences(render, reference)
+        if differences:
+            compatible = False
+            print(f"[!] {os.path.basename(render['path'])} does not match "
+                  f"{os.path.basename(reference['path'])}: {', '.join(differences)}")
+    if not compatible:
+        print("[!] Re-render the mismatched tracks with the same settings before compiling")
+        return False
+
+    too_short = common.plan_compile_cuts(renders, crossfade)
+    if too_short:
+        print(f"[!] No keyframes leave room for a {crossfade:g}s crossfade in: "
+              f"{', '.join(os.path.basename(path) for path in too_short)}")
+        return False
+
+    total = sum(render["duration"] for render in renders) - crossfade * (len(renders) - 1)
+    print(f"\n📝 Compiling {len(renders)} track(s) ({total / 60:.1f} min) → {os.path.basename(compilation_path)}")
+
+    clips = [None]
+    for i in range(1, len(renders)):
+        if not crossfade:
+            clips.append(None)
+            continue
+        clip_path = os.path.join(common.SCRATCH_DIR, f"_tmp_compile_{os.getpid()}_{i}.mp4")
+        common.TEMP_FILES.append(clip_path)
+        length = render_boundary_clip(renders[i - 1], renders[i], crossfade, clip_path)
+        if length is None:
+            return False
+        clips.append({"path": clip_path, "length": length})
+
+    list_path = os.path.join(common.SCRATCH_DIR, f"_tmp_compile_{os.getpid()}.txt")
+    scratch_render = os.path.join(common.SCRATCH_DIR, f"_tmp_compile_{os.getpid()}.mp4")
+    common.TEMP_FILES.extend([list_path, scratch_render])
+    common.write_compile_list(renders, clips, list_path)
+
+    cmd = ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", list_path]
+    for render in renders:
+        cmd.extend(["-i", render["path"]])
+    cmd.extend([
+        "-filter_complex", common.build_compile_audio_graph(renders, crossfade),
+        "-map", "0:v", "-map", "[a]",
+        "-c:v", "copy",
+        *common.AAC_ENCODE_ARGS,
+        *common.get_container_args(),
+        scratch_render
+    ])
+    if not common.run_with_progress(cmd, f"  └─ Joining {len(renders)} renders", total):
+        return False
+    if not common.publish_output(scratch_render, compilation_path, total):
+        return False
+
+    reencoded = sum(clip["length"] for clip in clips if clip)
+    print(f"  ✅ Complete: {os.path.basename(compilation_path)} "
+          f"(re-encoded {reencoded:.1f}s of {total:.1f}s video)")
+    return True
 
-    try:
-        batch_generate()
-    except KeyboardInterrupt:
-        print("\n[!] Process interrupted")
-    finally:
-        cleanup_all_temp_files()
 
-    print("=" * 60)
-    print("✅ Done — check your output/ folder")
\ No newline at end of file
+if __name__ == "__main__":
+    parser = common.build_parser("Music Visualizer Generator",
+                                 "audio, image, overlay, title, preset, output", ["duration"])
+    common.run_cli(sys.modules[__name__], parser, parser.parse_args())
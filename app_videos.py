@@ -1,27 +1,32 @@
 import os
 import subprocess
 import sys
-import re
+import json
 import random
-import atexit
-import signal
-from tqdm import tqdm
+import hashlib
+import time
 
-random.seed()  # Initialize with system time
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-INPUT_DIR = os.path.join(BASE_DIR, "input")
-VIDEOS_DIR = os.path.join(INPUT_DIR, "videos")
-OUTPUT_DIR = os.path.join(BASE_DIR, "output")
-os.makedirs(OUTPUT_DIR, exist_ok=True)
+import app_common as common
 
-IS_WINDOWS = sys.platform.startswith('win')
+common.APP_NAME = os.path.splitext(os.path.basename(__file__))[0]
+VIDEOS_DIR = os.path.join(common.INPUT_DIR, "videos")
 
-# Track temp files for cleanup
-TEMP_FILES = []
-CURRENT_PROCESS = None
-USED_VIDEOS = []
+# Deck weighting by brightness (--deck-weighting brightness)
+DECK_BRIGHTNESS_WEIGHTS = {"dark": 2, "medium": 1, "light": 1}  # dark clips keep the waveform readable
+
+# Compilation title cards (--title-cards)
+COMPILE_TITLE_CARDS = False
+COMPILE_TITLE_SECONDS = 4  # title card length
+COMPILE_TITLE_STYLE = "Pure White Glow"
+
+# Output frame size
+FRAME_WIDTH, FRAME_HEIGHT = 1920, 1080
+
+# Stall fallbacks (see common.STALL_TIMEOUT), applied one more per retry
+STALL_FALLBACKS = ("no_glow", "other_clip", "fast_preset")
 
 # Text style presets for ImageMagick
+TEXT_FONT = "Arial-Bold"
 TEXT_STYLE_PRESETS = [
     {
         "name": "Neon Cyan Glow",
@@ -340,160 +345,6 @@ WAVEFORM_PRESETS = [
 ]
 
 
-def cleanup_all_temp_files():
-    """Clean up all tracked temp files and kill running process"""
-    global CURRENT_PROCESS
-
-    # Kill running FFmpeg process
-    if CURRENT_PROCESS:
-        try:
-            CURRENT_PROCESS.terminate()
-            CURRENT_PROCESS.wait(timeout=3)
-        except:
-            try:
-                CURRENT_PROCESS.kill()
-            except:
-                pass
-        CURRENT_PROCESS = None
-
-    # Clean up temp files
-    for f in TEMP_FILES:
-        try:
-            if os.path.exists(f):
-                os.remove(f)
-        except Exception as e:
-            pass
-
-
-def cleanup_startup_temp_files():
-    """Remove any leftover temp files from previous runs"""
-    temp_patterns = ['_tmp_audio.wav', '_tmp_*.wav', '_tmp_*.mp4', '_tmp_*.png']
-
-    cleaned = 0
-    for pattern in temp_patterns:
-        if '*' in pattern:
-            import glob
-            for temp_file in glob.glob(os.path.join(OUTPUT_DIR, pattern)):
-                try:
-                    os.remove(temp_file)
-                    cleaned += 1
-                except:
-                    pass
-        else:
-            temp_file = os.path.join(OUTPUT_DIR, pattern)
-            if os.path.exists(temp_file):
-                try:
-                    os.remove(temp_file)
-                    cleaned += 1
-                except:
-                    pass
-
-    if cleaned > 0:
-        print(f"[*] Cleaned up {cleaned} leftover temp file(s)")
-
-
-def signal_handler(signum, frame):
-    """Handle Ctrl+C gracefully"""
-    print("\n\n[!] Interrupted! Cleaning up...")
-    cleanup_all_temp_files()
-    sys.exit(0)
-
-
-# Register cleanup handlers
-atexit.register(cleanup_all_temp_files)
-signal.signal(signal.SIGINT, signal_handler)
-if hasattr(signal, 'SIGTERM'):
-    signal.signal(signal.SIGTERM, signal_handler)
-
-
-def run_with_progress(cmd, desc=None, duration=None):
-    """Execute FFmpeg command with progress tracking"""
-    global CURRENT_PROCESS
-
-    if IS_WINDOWS:
-        CURRENT_PROCESS = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            universal_newlines=True,
-            creationflags=subprocess.CREATE_NO_WINDOW if IS_WINDOWS else 0
-        )
-    else:
-        import shlex
-        cmd_str = " ".join(shlex.quote(str(c)) for c in cmd)
-        CURRENT_PROCESS = subprocess.Popen(
-            cmd_str,
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            universal_newlines=True
-        )
-
-    pbar = None
-    if duration and desc:
-        pbar = tqdm(total=100, desc=desc, unit="%", leave=False,
-                    bar_format='{l_bar}{bar}| {n:.0f}% [{elapsed}<{remaining}]')
-
-    stderr_output = []
-    time_pattern = re.compile(r'time=(\d+):(\d+):(\d+\.\d+)')
-
-    try:
-        while True:
-            line = CURRENT_PROCESS.stderr.readline()
-            if not line:
-                break
-            stderr_output.append(line)
-
-            if pbar and duration:
-                match = time_pattern.search(line)
-                if match:
-                    hours = int(match.group(1))
-                    minutes = int(match.group(2))
-                    seconds = float(match.group(3))
-                    current_time = hours * 3600 + minutes * 60 + seconds
-                    progress = min((current_time / duration) * 100, 100)
-                    pbar.n = progress
-                    pbar.refresh()
-    except KeyboardInterrupt:
-        if pbar:
-            pbar.close()
-        raise
-
-    CURRENT_PROCESS.wait()
-    returncode = CURRENT_PROCESS.returncode
-    CURRENT_PROCESS = None
-
-    if pbar:
-        if returncode == 0:
-            pbar.n = 100
-            pbar.refresh()
-        pbar.close()
-
-    if returncode != 0:
-        print(f"\n[!] Command error (exit code {returncode}):")
-        print("".join(stderr_output[-20:]))
-        return False
-
-    return True
-
-
-def get_duration(path):
-    """Get duration of media file in seconds"""
-    try:
-        result = subprocess.run(
-            ["ffprobe", "-v", "error", "-show_entries", "format=duration",
-             "-of", "default=noprint_wrappers=1:nokey=1", path],
-            capture_output=True,
-            text=True,
-            timeout=10
-        )
-        duration = float(result.stdout.strip())
-        return duration if duration > 0 else 30.0
-    except (subprocess.CalledProcessError, ValueError) as e:
-        print(f"[!] Could not get duration for {os.path.basename(path)}, using 30s default")
-        return 30.0
-
-
 def get_video_brightness(video_path):
     """Analyze video to determine if it's predominantly dark or light"""
     try:
@@ -503,12 +354,7 @@ def get_video_brightness(video_path):
             "-f", "null", "-"
         ]
 
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            timeout=10
-        )
+        result = common.run_child(cmd, timeout=10)
 
         output = result.stderr
 
@@ -530,7 +376,7 @@ def get_video_brightness(video_path):
         return "medium"
 
 
-def pick_contrasting_text_style(video_path):
+def pick_contrasting_text_style(video_path, rng=random):
     """Pick a text style that contrasts with the video's brightness"""
     brightness = get_video_brightness(video_path)
 
@@ -543,41 +389,98 @@ def pick_contrasting_text_style(video_path):
     else:
         suitable_styles = TEXT_STYLE_PRESETS
 
-    return random.choice(suitable_styles)
+    return rng.choice(suitable_styles)
+
 
+def get_clip_weight(path):
+    """Return how many copies of a clip go into each deck cycle, adding brightness to the shared weightings"""
+    if common.DECK_WEIGHTING == "brightness":
+        return DECK_BRIGHTNESS_WEIGHTS.get(get_video_brightness(path), 1)
+    return common.get_clip_weight(path)
 
-def get_random_video():
-    """Get random video from videos folder, avoiding repeats"""
-    global USED_VIDEOS
-    video_extensions = ('.mp4', '.mov', '.avi', '.mkv', '.webm')
 
+def get_random_video(rng=None):
+    """Get a background video: dealt from the videos deck, or a seeded pick when rng is given"""
     try:
         if not os.path.exists(VIDEOS_DIR):
             print(f"[!] Videos directory not found: {VIDEOS_DIR}")
             print(f"[!] Please create '{VIDEOS_DIR}' and add video files")
             return None
 
-        videos = [f for f in os.listdir(VIDEOS_DIR)
-                  if f.lower().endswith(video_extensions)]
+        if rng is None:
+            chosen = common.draw_from_deck(VIDEOS_DIR, common.VIDEO_EXTENSIONS, get_clip_weight)
+        else:
+            videos = sorted(f for f in os.listdir(VIDEOS_DIR)
+                            if f.lower().endswith(common.VIDEO_EXTENSIONS))
+            chosen = os.path.join(VIDEOS_DIR, rng.choice(videos)) if videos else None
 
-        if not videos:
+        if not chosen:
             print(f"[!] No videos found in {VIDEOS_DIR}")
-            return None
+        return chosen
+    except Exception as e:
+        print(f"[!] Error accessing videos folder: {e}")
+        return None
 
-        available = [v for v in videos if v not in USED_VIDEOS]
 
-        if not available:
-            USED_VIDEOS.clear()
-            available = videos
+def apply_layout_overrides(layout, overrides):
+    """Apply manifest-pinned preset and background video on top of a layout"""
+    presets = {p["name"]: p for p in WAVEFORM_PRESETS}
+    if overrides.get("preset") in presets:
+        layout["preset"] = presets[overrides["preset"]]
+    video_path = overrides.get("video")
+    if video_path and video_path != layout["video"]:
+        layout["video"] = video_path
+        layout["text_style"] = pick_contrasting_text_style(video_path, random.Random(layout["seed"]))
+    return layout
 
-        chosen = random.choice(available)
-        USED_VIDEOS.append(chosen)
 
-        return os.path.join(VIDEOS_DIR, chosen)
-    except Exception as e:
-        print(f"[!] Error accessing videos folder: {e}")
+def choose_layout(audio_path, output_path, seed=None, overrides=None):
+    """Pick waveform preset, background video and text style, reusing a saved layout if present"""
+    overrides = overrides or {}
+    layout_path = common.get_layout_path(output_path)
+    if seed is None and os.path.exists(layout_path):
+        try:
+            with open(layout_path, "r", encoding="utf-8") as f:
+                layout = json.load(f)
+            presets = {p["name"]: p for p in WAVEFORM_PRESETS}
+            text_styles = {t["name"]: t for t in TEXT_STYLE_PRESETS}
+            if (layout.get("preset") in presets and layout.get("text_style") in text_styles
+                    and os.path.exists(layout.get("video") or "")):
+                layout["preset"] = presets[layout["preset"]]
+                layout["text_style"] = text_styles[layout["text_style"]]
+                return apply_layout_overrides(layout, overrides)
+        except (OSError, ValueError):
+            pass
+
+    explicit_seed = seed is not None
+    if seed is None:
+        seed = common.get_song_seed(audio_path)
+    rng = random.Random(seed)
+
+    # An explicit --seed reproduces the background too; otherwise deal from the deck
+    deck_rng = None if common.DECK_ENABLED and not explicit_seed else rng
+    preset = rng.choice(WAVEFORM_PRESETS)
+    video_path = overrides.get("video") or get_random_video(deck_rng)
+    if not video_path:
         return None
 
+    return apply_layout_overrides({
+        "seed": seed,
+        "preset": preset,
+        "video": video_path,
+        "text_style": pick_contrasting_text_style(video_path, rng),
+    }, overrides)
+
+
+def save_layout(layout, output_path):
+    """Persist the chosen layout so the final render reuses it"""
+    data = dict(layout, preset=layout["preset"]["name"], text_style=layout["text_style"]["name"])
+    try:
+        with open(common.get_layout_path(output_path), "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+    except OSError as e:
+        print(f"[!] Could not save layout: {e}")
+
 
 def find_imagemagick():
     """Find ImageMagick executable on the system"""
@@ -589,7 +492,7 @@ def find_imagemagick():
         if shutil.which(cmd):
             return cmd
 
-    if IS_WINDOWS:
+    if common.IS_WINDOWS:
         import glob
         possible_paths = [
             r"C:\Program Files\ImageMagick-*\magick.exe",
@@ -621,7 +524,7 @@ def create_text_overlay(text, style_preset, output_path, width=1920, height=1080
             magick_cmd,
             "-size", f"{width}x{height}",
             "xc:none",
-            "-font", "Arial-Bold",
+            "-font", TEXT_FONT,
             "-pointsize", "120",
             "-fill", style_preset["fill"],
             "-stroke", style_preset["stroke"],
@@ -640,7 +543,7 @@ def create_text_overlay(text, style_preset, output_path, width=1920, height=1080
             output_path
         ]
 
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+        result = common.run_child(cmd, timeout=30)
 
         if result.returncode != 0:
             print(f"[!] ImageMagick error: {result.stderr}")
@@ -656,246 +559,1007 @@ def create_text_overlay(text, style_preset, output_path, width=1920, height=1080
         return False
 
 
-def build_waveform_filter(preset, wave_width, wave_height):
-    """Build FFmpeg filter string based on preset style"""
-    color = preset["color"]
-    mode = preset["mode"]
-    scale = preset["scale"]
-    split = preset["split_channels"]
-    wave_type = preset["type"]
-
-    if wave_type == "circular":
-        wave_filter = (
-            f"showfreqs=s={wave_width}x{wave_height}:mode=line:colors={color}:"
-            f"fscale=log:ascale=sqrt"
-        )
-        filter_chain = f"[AUDIO_INPUT]{wave_filter}[wave]"
-    elif wave_type == "bars":
-        win_size = preset.get("win_size", 2048)
-        wave_filter = (
-            f"showfreqs=s={wave_width}x{wave_height}:mode=bar:colors={color}:"
-            f"fscale=log:ascale={scale}:win_size={win_size}"
-        )
-        filter_chain = f"[AUDIO_INPUT]{wave_filter}[wave]"
-    elif wave_type == "vector":
-        wave_filter = (
-            f"avectorscope=s={wave_width}x{wave_height}:mode={mode}:draw=line:"
-            f"scale={scale}"
-        )
-        filter_chain = f"[AUDIO_INPUT]{wave_filter}[wave]"
-    elif wave_type == "spectrum":
-        wave_filter = (
-            f"showspectrum=s={wave_width}x{wave_height}:mode={mode}:color={color}:"
-            f"scale={scale}:slide=scroll"
-        )
-        filter_chain = f"[AUDIO_INPUT]{wave_filter}[wave]"
+def get_wave_height(preset):
+    """Return waveform layer height for a preset at full resolution"""
+    if preset["type"] in ["radial", "circular"]:
+        return 1080
+    elif preset["type"] == "bars":
+        return 800
+    elif preset["type"] == "vector":
+        return 300
     else:
-        wave_filter = (
-            f"showwaves=s={wave_width}x{wave_height}:mode={mode}:colors={color}:"
-            f"scale={scale}:draw=scale"
+        return 300
+
+
+def build_title_layer(base_label, text_input_index, width, height, scale_text=False, out_label="[bg_layer]",
+                      label_suffix=""):
+    """Blend the title PNG at text_input_index over base_label, ending in out_label"""
+    # The title PNG is decoded and converted once, then repeated by the loop filter
+    text_scale = f"scale={width}:{height}," if scale_text else ""
+    title_format = f"format={common.LAYER_PIXEL_FORMATS['title']}," if common.FORMAT_PLAN_ENABLED else ""
+    return [
+        f"[{text_input_index}:v]{text_scale}format=rgba,colorchannelmixer=aa=0.9,{title_format}"
+        f"loop=loop=-1:size=1:start=0[text{label_suffix}]",
+        f"{base_label}[text{label_suffix}]overlay=(W-w)/2:(H-h)/2{out_label}"
+    ]
+
+
+def build_background_graph(width, height, has_text, text_input_index=2, scale_text=False,
+                           precomposed=False, out_label="[bg_layer]"):
+    """Build the background video and title layers, ending in out_label"""
+    filter_parts = []
+
+    if precomposed:
+        # Cached loop already holds the scaled video with the title blended in
+        filter_parts.append(f"[0:v]setsar=1{out_label}")
+        return filter_parts
+
+    filter_parts.append(
+        f"[0:v]scale={width}:{height}:force_original_aspect_ratio=increase,"
+        f"crop={width}:{height},setsar=1[bg]"
+    )
+
+    if not has_text:
+        filter_parts.append(f"[bg]null{out_label}")
+        return filter_parts
+
+    filter_parts.extend(build_title_layer("[bg]", text_input_index, width, height, scale_text, out_label))
+    return filter_parts
+
+
+def build_compose_graph(preset, width, height, wave_width, wave_height, has_text,
+                        scale_text=False, audio_filter=None, beat_cmd_path=None,
+                        precomposed=False, fps=30, silent_ranges=None):
+    """Build the compose filter graph (background, title, waveform) ending in [v]"""
+    filter_parts = build_background_graph(width, height, has_text, scale_text=scale_text,
+                                          precomposed=precomposed)
+    current_layer = "[bg_layer]"
+    audio_input_index = 1
+
+    if beat_cmd_path:
+        filter_parts.append(
+            f"{current_layer}sendcmd=f={common.escape_filter_path(beat_cmd_path)},eq@beat[bg_pulse]"
         )
-        if split:
-            wave_filter += ":split_channels=1"
-        filter_chain = f"[AUDIO_INPUT]{wave_filter}[wave]"
+        current_layer = "[bg_pulse]"
 
-    if preset.get("glow"):
-        filter_chain += ";[wave]split[wave1][wave2];[wave2]boxblur=3:1[glow];[wave1][glow]overlay[wave]"
+    audio_label = f"[{audio_input_index}:a]"
+    if audio_filter:
+        filter_parts.append(f"{audio_label}{audio_filter}[audio_norm]")
+        audio_label = "[audio_norm]"
 
-    if preset.get("mirror"):
-        filter_chain += ";[wave]split[w1][w2];[w2]vflip[w2flip];[w1][w2flip]vstack[wave]"
+    filter_parts.extend(common.build_wave_layer(preset, wave_width, wave_height, audio_label, current_layer,
+                                         fps=fps, silent_ranges=silent_ranges))
+    return ";".join(filter_parts)
 
-    if preset.get("shadow"):
-        filter_chain += ";[wave]split[wave1][wave2];[wave2]boxblur=5:1,colorchannelmixer=aa=0.3[shadow];[shadow][wave1]overlay[wave]"
 
-    return filter_chain
+def build_compose_inputs(video_path, audio_input, text_path, video_offset=0.0, fps=30,
+                         precomposite_path=None):
+    """Build FFmpeg input arguments matching build_compose_graph's input indices"""
+    if precomposite_path:
+        # The precomposite spans one loop period, so the same offset applies
+        seek = ["-ss", f"{video_offset:.2f}"] if video_offset > 0 else []
+        return seek + ["-stream_loop", "-1", "-i", precomposite_path, "-i", audio_input]
 
+    cmd = []
+    if video_offset > 0:
+        cmd.extend(["-ss", f"{video_offset:.2f}"])
+    cmd.extend([
+        "-stream_loop", "-1",
+        "-i", video_path,
+        "-i", audio_input,
+    ])
 
-def make_visualizer(audio_path, output_path):
-    """Generate audio visualizer video from random video and audio with stylized text"""
-    preset = random.choice(WAVEFORM_PRESETS)
-    video_path = get_random_video()
+    if text_path:
+        cmd.extend(["-framerate", str(fps), "-i", text_path])
 
-    if not video_path:
-        print("[!] No video available, skipping")
-        return False
+    return cmd
 
-    text_style = pick_contrasting_text_style(video_path)
 
-    song_name = os.path.splitext(os.path.basename(audio_path))[0]
+def get_precomposite_path(video_path, song_name, text_style, width, height, fps,
+                          encode_args=common.PRECOMPOSITE_ENCODE_ARGS):
+    """Return the cache path of the background-plus-title loop for a song"""
+    key_parts = [common.get_file_key(video_path), song_name, text_style,
+                 width, height, fps, encode_args, common.FORMAT_PLAN_ENABLED]
+    key = hashlib.sha1(json.dumps(key_parts, sort_keys=True).encode("utf-8")).hexdigest()
+    return os.path.join(common.PRECOMPOSITE_DIR, f"{key}.mp4")
 
-    wave_width = 1920
-    if preset["type"] == "circular":
-        wave_height = 1080
-    elif preset["type"] == "bars":
-        wave_height = 800
-    elif preset["type"] == "vector":
-        wave_height = 300
-    else:
-        wave_height = 300
 
-    width = 1920
-    height = 1080
-    fps = 30
-    duration = get_duration(audio_path)
+def render_precomposite(video_path, text_path, precomposite_path, width, height, fps, loop_period,
+                        encode_args=common.PRECOMPOSITE_ENCODE_ARGS):
+    """Render one loop period of the scaled background video with the title blended in"""
+    os.makedirs(common.PRECOMPOSITE_DIR, exist_ok=True)
+    tmp_path = f"{precomposite_path}.{os.getpid()}.tmp.mp4"
+    common.TEMP_FILES.append(tmp_path)
 
-    tmp_audio = os.path.join(OUTPUT_DIR, "_tmp_audio.wav")
-    tmp_text_overlay = os.path.join(OUTPUT_DIR, f"_tmp_text_{os.getpid()}.png")
-    TEMP_FILES.extend([tmp_audio, tmp_text_overlay])
+    filter_parts = build_background_graph(width, height, bool(text_path), text_input_index=1,
+                                          out_label="[pre_layer]")
+    filter_parts.append("[pre_layer]format=yuv420p[pre]")
 
-    print(f"\n📝 Processing: {song_name} ({duration:.1f}s)")
-    print(f"   🎨 Waveform: {preset['name']} ({preset['type']})")
-    print(f"   ✨ Text Style: {text_style['name']}")
-    print(f"   🎬 Video: {os.path.basename(video_path)}")
+    input_args = ["-i", video_path]
+    if text_path:
+        input_args.extend(["-framerate", str(fps), "-i", text_path])
 
-    print("  ├─ Creating text overlay")
-    if not create_text_overlay(song_name, text_style, tmp_text_overlay, width, height):
-        print("[!] Failed to create text overlay, continuing without text...")
-        tmp_text_overlay = None
+    threads = common.allocate_threads(common.get_job_concurrency())
+    cmd = [
+        "ffmpeg", "-y", "-filter_complex_threads", str(threads["filter"]),
+        *common.with_decoder_threads(input_args, threads),
+        "-filter_complex", ";".join(filter_parts),
+        "-map", "[pre]",
+        "-t", f"{loop_period:.3f}",
+        "-r", str(fps),
+        *encode_args,
+        "-threads", str(threads["encoder"]),
+        "-an",
+        tmp_path
+    ]
 
-    if not run_with_progress([
-        "ffmpeg", "-y", "-i", audio_path,
-        "-ac", "2", "-ar", "44100", "-acodec", "pcm_s16le",
-        tmp_audio
-    ], "  ├─ Converting audio", duration):
+    if not common.run_with_progress(cmd, "  ├─ Precomposing background loop", loop_period):
         return False
 
-    filter_parts = []
-    input_index = 0
+    os.replace(tmp_path, precomposite_path)
+    common.TEMP_FILES.remove(tmp_path)
+    return True
 
-    filter_parts.append(
-        f"[{input_index}:v]scale={width}:{height}:force_original_aspect_ratio=increase,"
-        f"crop={width}:{height},setsar=1[bg]"
+
+def make_contact_sheet(audio_path, layout, text_path, duration, sheet_path, audio_filter=None):
+    """Render a grid of frames sampled across the whole song at preview resolution"""
+    preset = layout["preset"]
+    width = common.scaled_size(1920, common.PREVIEW_SCALE)
+    height = common.scaled_size(1080, common.PREVIEW_SCALE)
+    frames = common.CONTACT_SHEET_COLS * common.CONTACT_SHEET_ROWS
+    interval = max(duration / frames, 0.1)
+
+    filter_graph = build_compose_graph(
+        preset, width, height,
+        common.scaled_size(1920, common.PREVIEW_SCALE),
+        common.scaled_size(get_wave_height(preset), common.PREVIEW_SCALE),
+        bool(text_path), scale_text=True, audio_filter=audio_filter
+    )
+    filter_graph += (
+        f";[v]fps=1/{interval:.3f}:start_time={interval / 2:.3f},"
+        f"tile={common.CONTACT_SHEET_COLS}x{common.CONTACT_SHEET_ROWS}[sheet]"
     )
-    input_index += 1
 
-    current_layer = "[bg]"
+    cmd = ["ffmpeg", "-y"]
+    cmd.extend(build_compose_inputs(layout["video"], audio_path, text_path))
+    cmd.extend([
+        "-filter_complex", filter_graph,
+        "-map", "[sheet]",
+        "-t", f"{duration:.2f}",
+        "-frames:v", "1",
+        sheet_path
+    ])
 
-    if preset["type"] in ["circular", "bars", "vector"]:
-        waveform_height = wave_height
-    else:
-        waveform_height = wave_height // 2
+    # tile holds every sampled frame until the song ends, so ffmpeg reports
+    # no frame or time progress for the whole run: no stall watchdog here
+    return common.run_with_progress(cmd, "  └─ Building contact sheet", duration, stall_timeout=0)
+
+
+def apply_stall_fallback(layout, step):
+    """Return a lighter copy of a layout for one STALL_FALLBACKS step, or None if it changes nothing"""
+    if step == "no_glow" and layout["preset"].get("glow"):
+        return dict(layout, preset=dict(layout["preset"], glow=False))
+    if step == "other_clip":
+        rng = random.Random(layout["seed"])
+        for _ in range(8):
+            video_path = get_random_video(rng)
+            if video_path and video_path != layout["video"]:
+                return dict(layout, video=video_path)
+    if step == "fast_preset" and layout.get("encode_args") != common.STALL_FAST_ENCODE_ARGS:
+        return dict(layout, encode_args=common.STALL_FAST_ENCODE_ARGS)
+    return None
 
-    waveform_filter = build_waveform_filter(preset, wave_width, waveform_height)
-    waveform_filter = waveform_filter.replace("[AUDIO_INPUT]", f"[{input_index}:a]")
-    filter_parts.append(waveform_filter)
 
-    if preset["position"] == "center":
-        overlay_pos = f"(W-w)/2:(H-h)/2"
-    else:
-        overlay_pos = "0:H-h"
+def make_visualizer(audio_path, output_path, preview=False, seed=None, segment=None, overrides=None,
+                    layout=None, teaser=False):
+    """Generate audio visualizer video from random video and audio with stylized text"""
+    common.CURRENT_USAGE = usage = common.new_usage()
+    job_started = time.time()
+    layout = layout or choose_layout(audio_path, output_path, seed, overrides)
+    preset_type = layout["preset"]["type"] if layout else "none"
+    common.metric_inc("visualizer_jobs_started_total", preset_type=preset_type)
 
-    filter_parts.append(f"{current_layer}[wave]overlay={overlay_pos}[v_with_wave]")
-    current_layer = "[v_with_wave]"
+    ok = False
+    try:
+        if not layout:
+            print("[!] No video available, skipping")
+        else:
+            # Previews show the chosen layout, so they are not retried lighter. Joined
+            # segments are stream-copied behind the first one's SPS/PPS, so none may
+            # change encode settings: a stalled segment fails and is handed out again
+            steps = () if preview or segment else STALL_FALLBACKS
+            ok = common.render_with_stall_retry(
+                lambda attempt_layout: render_visualizer(attempt_layout, audio_path, output_path, preview,
+                                                         segment, overrides, teaser),
+                layout, output_path, steps, apply_stall_fallback
+            )
+    finally:
+        common.metric_inc("visualizer_jobs_succeeded_total" if ok else "visualizer_jobs_failed_total",
+                   preset_type=preset_type)
+        common.CURRENT_USAGE = None
+        common.finish_job_usage(usage, preset_type, ok, time.time() - job_started, output_path)
+        common.flush_metrics(force=True)
+    return ok
 
-    if tmp_text_overlay and os.path.exists(tmp_text_overlay):
-        input_index += 1
-        filter_parts.append(
-            f"[{input_index}:v]format=rgba,colorchannelmixer=aa=0.9[text]"
-        )
-        filter_parts.append(f"{current_layer}[text]overlay=(W-w)/2:(H-h)/2,format=yuv420p[v]")
+
+def render_visualizer(layout, audio_path, output_path, preview=False, segment=None, overrides=None,
+                      teaser=False):
+    """Render a visualizer for an already chosen layout"""
+    preset = layout["preset"]
+    video_path = layout["video"]
+    text_style = layout["text_style"]
+
+    song_name = (overrides or {}).get("title") or os.path.splitext(os.path.basename(audio_path))[0]
+
+    scale = common.PREVIEW_SCALE if preview else 1.0
+    wave_width = common.scaled_size(1920, scale)
+    wave_height = common.scaled_size(get_wave_height(preset), scale)
+
+    width = common.scaled_size(1920, scale)
+    height = common.scaled_size(1080, scale)
+    fps = 30
+    duration = common.get_duration(audio_path)
+
+    start = 0.0
+    render_duration = duration
+    if preview:
+        render_duration = min(common.PREVIEW_SECONDS, duration)
+        start = common.find_loudest_window(common.get_loudness_envelope(audio_path), render_duration, duration)
+    elif teaser:
+        render_duration = min(common.TEASER_SECONDS, duration)
+        start = common.find_teaser_window(audio_path, render_duration, duration)
+    elif segment:
+        start = segment["start"]
+        render_duration = segment["length"]
+
+    if not common.wait_for_scratch_space(common.estimate_scratch_bytes(render_duration)):
+        return False
+
+    tmp_audio = os.path.join(common.SCRATCH_DIR, f"_tmp_audio_{os.getpid()}.wav")
+    tmp_text_overlay = os.path.join(common.SCRATCH_DIR, f"_tmp_text_{os.getpid()}.png")
+    common.TEMP_FILES.extend([tmp_audio, tmp_text_overlay])
+
+    print(f"\n📝 Processing: {song_name} ({duration:.1f}s)")
+    print(f"   🎨 Waveform: {preset['name']} ({preset['type']})")
+    print(f"   ✨ Text Style: {text_style['name']}")
+    print(f"   🎬 Video: {os.path.basename(video_path)}")
+    if preview:
+        print(f"   🔍 Preview: {render_duration:.0f}s from {start:.1f}s (seed {layout['seed']})")
+    if teaser:
+        print(f"   ✂️  Teaser: {render_duration:.0f}s from {start:.1f}s")
+    if segment:
+        print(f"   🧩 Segment: {render_duration:.0f}s from {start:.1f}s")
+
+    audio_filter = None
+    if common.LOUDNORM_ENABLED:
+        audio_filter = common.get_loudnorm_filter(audio_path)
+
+    beat_cmd_path = None
+    if common.BEAT_PULSE_ENABLED:
+        beat_map = common.get_beat_map(audio_path)
+        if beat_map:
+            beat_cmd_path = os.path.join(common.SCRATCH_DIR, f"_tmp_beats_{os.getpid()}.txt")
+            common.TEMP_FILES.append(beat_cmd_path)
+            pulses = common.write_beat_commands(beat_map, beat_cmd_path, start, render_duration)
+            print(f"   🥁 Beat pulse: {float(beat_map['tempo']):.0f} BPM, {pulses} beats")
+
+    silent_ranges = common.get_silent_ranges(preset, audio_path, start, render_duration)
+    if silent_ranges:
+        silent_seconds = sum(end - begin for begin, end in silent_ranges)
+        print(f"   🔇 Silence: {silent_seconds:.0f}s in {len(silent_ranges)} stretch(es) skip the waveform blend")
+
+    # Background and title repeat every loop of the clip: render that period
+    # once into a cached intermediate when the song spans several loops
+    precomposite_path = None
+    if common.PRECOMPOSITE_ENABLED and not preview:
+        loop_period = common.get_duration(video_path)
+        # A teaser only spans its own window, which may not cover enough loops to pay off
+        if (render_duration if teaser else duration) >= common.PRECOMPOSITE_MIN_LOOPS * loop_period:
+            precomposite_path = get_precomposite_path(video_path, song_name, text_style,
+                                                      width, height, fps)
+
+    if precomposite_path and os.path.exists(precomposite_path):
+        print("  ├─ Background: reusing cached loop precomposite")
+        tmp_text_overlay = None
     else:
-        filter_parts.append(f"{current_layer}format=yuv420p[v]")
+        print("  ├─ Creating text overlay")
+        if not create_text_overlay(song_name, text_style, tmp_text_overlay, 1920, 1080):
+            print("[!] Failed to create text overlay, continuing without text...")
+            tmp_text_overlay = None
+
+        if precomposite_path and not (tmp_text_overlay and render_precomposite(
+                video_path, tmp_text_overlay, precomposite_path, width, height, fps, loop_period)):
+            precomposite_path = None
+
+    audio_cmd = ["ffmpeg", "-y"]
+    if preview or segment or teaser:
+        audio_cmd.extend(["-ss", f"{start:.2f}", "-t", f"{render_duration:.2f}"])
+    audio_cmd.extend(["-i", audio_path])
+    if teaser:
+        # Faded here, so the waveform fades in and out with the sound
+        audio_fades = common.get_teaser_fades(render_duration, audio=True)
+        audio_cmd.extend(["-af", f"{audio_filter},{audio_fades}" if audio_filter else audio_fades])
+    elif audio_filter:
+        audio_cmd.extend(["-af", audio_filter])
+    audio_cmd.extend([
+        "-ac", "2", "-ar", "44100", "-acodec", "pcm_s16le",
+        tmp_audio
+    ])
+    if not common.run_with_progress(audio_cmd, "  ├─ Converting audio", render_duration):
+        return False
 
-    filter_graph = ";".join(filter_parts)
+    # Preview windows are short enough to encode inline; full renders mux
+    # a passthrough or cached AAC track without re-encoding
+    audio_track = None
+    if not preview and not segment and not teaser:
+        audio_track = common.prepare_audio_track(audio_path, duration, audio_filter)
+        if not audio_track:
+            return False
 
-    cmd = [
-        "ffmpeg", "-y",
-        "-stream_loop", "-1",
-        "-i", video_path,
-        "-i", tmp_audio,
-    ]
+    if tmp_text_overlay and not os.path.exists(tmp_text_overlay):
+        tmp_text_overlay = None
+
+    text_input = None if precomposite_path else tmp_text_overlay
+
+    filter_graph = build_compose_graph(preset, width, height, wave_width, wave_height,
+                                       bool(text_input), scale_text=preview,
+                                       beat_cmd_path=beat_cmd_path,
+                                       precomposed=bool(precomposite_path), fps=fps,
+                                       silent_ranges=silent_ranges)
+
+    video_offset = 0.0
+    if (preview or segment or teaser) and start > 0:
+        video_offset = start % common.get_duration(video_path)
+
+    threads = common.allocate_threads(common.get_job_concurrency())
+    cmd = ["ffmpeg", "-y", "-filter_complex_threads", str(threads["filter"])]
+    cmd.extend(common.with_decoder_threads(
+        build_compose_inputs(video_path, tmp_audio, text_input, video_offset, fps, precomposite_path),
+        threads
+    ))
+
+    if audio_track:
+        audio_args = ["-map", f"{cmd.count('-i')}:a", "-c:a", "copy"]
+        cmd.extend(["-i", audio_track])
+    elif segment:
+        # Segments are video-only; the full audio track is muxed in when they are joined
+        audio_args = ["-an"]
+    else:
+        audio_args = ["-map", "1:a", "-c:a", "aac", "-b:a", "192k"]
 
-    if tmp_text_overlay and os.path.exists(tmp_text_overlay):
-        cmd.extend(["-loop", "1", "-i", tmp_text_overlay])
+    if preview:
+        encode_args = ["-preset", "ultrafast", "-crf", "30"]
+    else:
+        encode_args = layout.get("encode_args", common.FINAL_ENCODE_ARGS)
+
+    render_path = output_path
+    if preview:
+        render_path = os.path.splitext(output_path)[0] + ".preview.mp4"
+    elif teaser:
+        render_path = os.path.splitext(output_path)[0] + ".teaser.mp4"
+    elif segment:
+        render_path = segment["path"]
+
+    # Render into scratch; the final name only appears once the file is complete
+    scratch_render = os.path.join(common.SCRATCH_DIR, f"_tmp_render_{os.getpid()}.mp4")
+    common.TEMP_FILES.append(scratch_render)
+
+    # Sidecars branch off the composed frames, so they cost no extra decode
+    video_label = "[v]"
+    if teaser:
+        filter_graph += f";[v]{common.get_teaser_fades(render_duration)}[v_teaser]"
+        video_label = "[v_teaser]"
+
+    sidecars = []
+    if common.SIDECARS_ENABLED and not preview and not segment and not teaser:
+        anim_start = common.find_loudest_window(common.get_loudness_envelope(audio_path), common.ANIMATION_SECONDS,
+                                                duration)
+        filter_graph += common.build_sidecar_graph(anim_start + common.ANIMATION_SECONDS / 2, anim_start)
+        video_label = "[v_main]"
+        sidecars = common.get_sidecar_outputs(output_path)
+        common.TEMP_FILES.extend(scratch_path for scratch_path, _, _ in sidecars)
 
     cmd.extend([
         "-filter_complex", filter_graph,
-        "-map", "[v]",
-        "-map", "1:a",
-        "-t", f"{duration:.2f}",
+        "-map", video_label,
+        "-t", f"{render_duration:.2f}",
         "-c:v", "libx264",
-        "-preset", "medium",
-        "-crf", "23",
+        *encode_args,
+        "-threads", str(threads["encoder"]),
         "-pix_fmt", "yuv420p",
         "-r", str(fps),
-        "-c:a", "aac",
-        "-b:a", "192k",
-        "-movflags", "+faststart",
-        output_path
+        *audio_args,
+        *common.get_container_args(fps),
+        scratch_render
     ])
+    for scratch_path, _, output_args in sidecars:
+        cmd.extend([*output_args, scratch_path])
+
+    compose_desc = "  ├─ Composing preview" if preview else "  └─ Composing final video"
+    if teaser:
+        compose_desc = "  └─ Composing teaser"
+    render_started = time.time()
+    if not common.run_with_progress(cmd, compose_desc, render_duration):
+        return False
 
-    if not run_with_progress(cmd, "  └─ Composing final video", duration):
+    streams = ("video",) if segment else ("video", "audio")
+    if not common.publish_output(scratch_render, render_path, render_duration, streams):
         return False
 
-    for tmp_file in [tmp_audio, tmp_text_overlay]:
+    for scratch_path, final_path, _ in sidecars:
+        if not common.publish_output(scratch_path, final_path):
+            return False
+
+    render_seconds = time.time() - render_started
+    render_bytes = os.path.getsize(render_path)
+    common.RENDER_STATS.append({"mode": common.OUTPUT_MODE, "seconds": render_seconds, "bytes": render_bytes})
+    common.metric_inc("visualizer_bytes_written_total", render_bytes, mode=common.OUTPUT_MODE)
+    print(f"   ⏱️  Render: {render_seconds:.1f}s, {common.format_size(render_bytes)} ({common.OUTPUT_MODE})")
+
+    if preview:
+        save_layout(layout, output_path)
+        sheet_path = os.path.splitext(output_path)[0] + ".contact.png"
+        scratch_sheet = os.path.join(common.SCRATCH_DIR, f"_tmp_sheet_{os.getpid()}.png")
+        common.TEMP_FILES.append(scratch_sheet)
+        if not make_contact_sheet(audio_path, layout, tmp_text_overlay, duration, scratch_sheet,
+                                  audio_filter):
+            return False
+        if not common.publish_output(scratch_sheet, sheet_path):
+            return False
+
+    for tmp_file in [tmp_audio, tmp_text_overlay, beat_cmd_path]:
         try:
             if tmp_file and os.path.exists(tmp_file):
                 os.remove(tmp_file)
-                if tmp_file in TEMP_FILES:
-                    TEMP_FILES.remove(tmp_file)
+                if tmp_file in common.TEMP_FILES:
+                    common.TEMP_FILES.remove(tmp_file)
         except:
             pass
 
+    if preview:
+        print(f"  ✅ Preview: {os.path.basename(render_path)} + {os.path.basename(sheet_path)}")
+        return True
+
+    if segment:
+        print(f"  ✅ Segment: {os.path.basename(render_path)}")
+        return True
+
+    if teaser:
+        print(f"  ✅ Teaser: {os.path.basename(render_path)}")
+        return True
+
     print(f"  ✅ Complete: {os.path.basename(output_path)}")
     return True
 
 
-def batch_generate():
-    """Process all audio files in input directory"""
-    audio_extensions = ('.wav', '.mp3', '.m4a', '.flac', '.ogg', '.aac')
-
+def tune_threads():
+    """Benchmark thread splits on a short slice of the first input and save the best for this host"""
+    audio_path = video_path = None
+    if os.path.isdir(common.INPUT_DIR):
+        for folder, names in sorted(common.scan_input_tree(common.INPUT_DIR, [VIDEOS_DIR]).items()):
+            audio_path = audio_path or next((os.path.join(folder, f) for f in names
+                                             if f.lower().endswith(common.AUDIO_EXTENSIONS)), None)
     try:
-        files = [f for f in os.listdir(INPUT_DIR)
-                 if f.lower().endswith(audio_extensions)]
-    except FileNotFoundError:
-        print(f"[!] Input directory not found: {INPUT_DIR}")
-        print("[!] Please create an 'input' folder and add your files")
-        return
+        with os.scandir(VIDEOS_DIR) as entries:
+            video_path = min((entry.path for entry in entries
+                              if entry.is_file() and entry.name.lower().endswith(common.VIDEO_EXTENSIONS)),
+                             default=None)
+    except OSError:
+        pass
+
+    if not audio_path or not video_path:
+        print("[!] Tuning needs at least one audio file in input/ and one video in input/videos/")
+        return False
 
-    if not files:
-        print("[!] No audio files found in input/ directory")
-        print(f"[!] Supported formats: {', '.join(audio_extensions)}")
-        return
+    preset = WAVEFORM_PRESETS[0]
+    fps = 30
+
+    filter_graph = build_compose_graph(preset, 1920, 1080, 1920, get_wave_height(preset), False)
+    input_args = build_compose_inputs(video_path, audio_path, None, fps=fps)
+
+    return common.run_thread_search(input_args, filter_graph, fps)
+
+
+def prepare_profile_slice(job, seed=None):
+    """Prepare the loudest slice of a job and the arguments of the compose graph it would render"""
+    # A saved layout is what the render will use; otherwise take the song's
+    # seeded pick rather than dealing a background from the deck
+    if seed is None and not os.path.exists(common.get_layout_path(job["output"])):
+        seed = common.get_song_seed(job["audio"])
+    layout = choose_layout(job["audio"], job["output"], seed, job.get("overrides"))
+    if not layout:
+        print("[!] No video available, skipping")
+        return None
+    preset = layout["preset"]
+    video_path = layout["video"]
+    song_name = (job.get("overrides") or {}).get("title") or os.path.splitext(os.path.basename(job["audio"]))[0]
+
+    fps = 30
+    duration = common.get_duration(job["audio"])
+    seconds = min(common.PROFILE_SECONDS, duration)
+    start = common.find_loudest_window(common.get_loudness_envelope(job["audio"]), seconds, duration)
+
+    tmp_audio = os.path.join(common.SCRATCH_DIR, f"_tmp_audio_{os.getpid()}.wav")
+    common.TEMP_FILES.append(tmp_audio)
+    audio_cmd = [
+        "ffmpeg", "-y", "-ss", f"{start:.2f}", "-t", f"{seconds:.2f}", "-i", job["audio"],
+        "-ac", "2", "-ar", "44100", "-acodec", "pcm_s16le", tmp_audio
+    ]
+    if not common.run_with_progress(audio_cmd, "  ├─ Converting audio", seconds):
+        return None
+
+    beat_cmd_path = None
+    if common.BEAT_PULSE_ENABLED:
+        beat_map = common.get_beat_map(job["audio"])
+        if beat_map:
+            beat_cmd_path = os.path.join(common.SCRATCH_DIR, f"_tmp_beats_{os.getpid()}.txt")
+            common.TEMP_FILES.append(beat_cmd_path)
+            common.write_beat_commands(beat_map, beat_cmd_path, start, seconds)
+
+    tmp_text_overlay = os.path.join(common.SCRATCH_DIR, f"_tmp_text_{os.getpid()}.png")
+    common.TEMP_FILES.append(tmp_text_overlay)
+    if not create_text_overlay(song_name, layout["text_style"], tmp_text_overlay, 1920, 1080):
+        print("[!] Failed to create text overlay, profiling without text...")
+        tmp_text_overlay = None
+
+    # Same graph as a full-resolution render, with the background composed
+    # live so its nodes are attributed too (a cached precomposite skips them)
+    graph_args = {
+        "preset": preset, "width": 1920, "height": 1080, "wave_width": 1920,
+        "wave_height": get_wave_height(preset), "has_text": bool(tmp_text_overlay),
+        "beat_cmd_path": beat_cmd_path, "fps": fps,
+        "silent_ranges": common.get_silent_ranges(preset, job["audio"], start, seconds)
+    }
+    video_offset = start % common.get_duration(video_path) if start > 0 else 0.0
+    input_args = build_compose_inputs(video_path, tmp_audio, tmp_text_overlay, video_offset, fps)
+    return {"preset": preset, "seconds": seconds, "start": start, "fps": fps,
+            "input_args": input_args, "graph_args": graph_args}
+
+
+def load_manifest_jobs(manifest_path):
+    """Build render jobs from a manifest with audio and optional video, title, preset and output"""
+    rows = common.read_manifest(manifest_path)
+    if rows is None:
+        return None
+
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    presets = {p["name"] for p in WAVEFORM_PRESETS}
+    jobs = []
+    for idx, row in enumerate(rows, 1):
+        paths = {key: os.path.join(base_dir, row[key]) for key in ("audio", "video") if key in row}
+        missing = [key for key in ("audio", "video") if key in paths and not os.path.isfile(paths[key])]
+        if "audio" not in paths or missing:
+            print(f"[!] Manifest row {idx}: missing {', '.join(missing or ['audio'])}, skipping")
+            continue
+
+        preset = row.get("preset")
+        if preset and preset not in presets:
+            print(f"[!] Manifest row {idx}: unknown preset '{preset}', using the song's default")
+            preset = None
+
+        overrides = {"preset": preset, "video": paths.get("video"), "title": row.get("title")}
+        name, output_path = common.get_output_for(paths["audio"], row.get("output"))
+        jobs.append({
+            "name": name,
+            "audio": paths["audio"],
+            "output": output_path,
+            "overrides": {key: value for key, value in overrides.items() if value},
+        })
+
+    if not jobs:
+        print(f"[!] No usable jobs in manifest {manifest_path}")
+        return None
+    return jobs
+
+
+def collect_jobs(manifest_path=None):
+    """Return render jobs from a manifest, or one for every audio file in the input tree"""
+    if manifest_path:
+        return load_manifest_jobs(manifest_path)
+
+    if not os.path.isdir(common.INPUT_DIR):
+        print(f"[!] Input directory not found: {common.INPUT_DIR}")
+        print("[!] Please create an 'input' folder and add your files")
+        return None
 
     if not os.path.exists(VIDEOS_DIR):
         print(f"[!] Videos directory not found: {VIDEOS_DIR}")
         print(f"[!] Please create 'input/videos' folder and add video files")
-        return
+        return None
 
-    print(f"[*] Found {len(files)} audio file(s) to process\n")
+    jobs = []
+    for folder, names in sorted(common.scan_input_tree(common.INPUT_DIR, [VIDEOS_DIR]).items()):
+        for file_name in names:
+            if not file_name.lower().endswith(common.AUDIO_EXTENSIONS):
+                continue
+            audio_path = os.path.join(folder, file_name)
+            name, output_path = common.get_output_for(audio_path)
+            jobs.append({"name": name, "audio": audio_path, "output": output_path})
 
-    success_count = 0
-    for idx, audio_file in enumerate(files, 1):
-        print(f"{'=' * 60}")
-        print(f"File {idx}/{len(files)}")
+    if not jobs:
+        print("[!] No audio files found in input/ directory")
+        print(f"[!] Supported formats: {', '.join(common.AUDIO_EXTENSIONS)}")
+        return None
 
-        name, _ = os.path.splitext(audio_file)
-        audio_path = os.path.join(INPUT_DIR, audio_file)
-        output_path = os.path.join(OUTPUT_DIR, f"{name}.mp4")
+    return jobs
 
-        try:
-            if make_visualizer(audio_path, output_path):
-                success_count += 1
-        except KeyboardInterrupt:
-            print("\n[!] Interrupted by user")
-            raise
 
-    print(f"\n{'=' * 60}")
-    print(f"[*] Successfully processed {success_count}/{len(files)} file(s)")
+def run_job(job, preview=False, seed=None, segment=None, teaser=False):
+    """Render one job from collect_jobs"""
+    return make_visualizer(job["audio"], job["output"], preview, seed, segment, job.get("overrides"),
+                           job.get("layout"), teaser)
 
 
-if __name__ == "__main__":
-    print("🎵 Music Visualizer Generator with Stylized Text")
-    print("=" * 60)
+def get_job_media(job):
+    """Return (label, path, stream type) for every input file a job reads"""
+    media = [("audio", job["audio"], "audio")]
+    video = (job.get("overrides") or {}).get("video")
+    if video:
+        media.append(("video", video, "video"))
+    return media
 
-    cleanup_startup_temp_files()
 
+def check_text_font():
+    """Return a problem description if the title font cannot be rendered"""
+    magick_cmd = find_imagemagick()
+    if not magick_cmd:
+        return "ImageMagick not found (titles would be skipped)"
     try:
-        batch_generate()
-    except KeyboardInterrupt:
-        print("\n[!] Process interrupted")
-    finally:
-        cleanup_all_temp_files()
+        result = common.run_child([magick_cmd, "-list", "font"], timeout=common.PREFLIGHT_TIMEOUT)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        return f"ImageMagick font list failed: {e}"
+    if f"Font: {TEXT_FONT}" not in result.stdout:
+        return f"ImageMagick font '{TEXT_FONT}' is not installed (titles would be skipped)"
+    return None
+
+
+def check_environment():
+    """Return problems that would fail every job"""
+    problems = []
+    os.makedirs(common.OUTPUT_DIR, exist_ok=True)
+    if not os.access(common.OUTPUT_DIR, os.W_OK):
+        problems.append(f"Output directory is not writable: {common.OUTPUT_DIR}")
+    if not any(entry.name.lower().endswith(common.VIDEO_EXTENSIONS) for entry in os.scandir(VIDEOS_DIR)):
+        problems.append(f"No videos found in {VIDEOS_DIR}")
+    problems.append(check_text_font())
+    return problems
+
+
+def plan_batches(jobs, seed=None):
+    """Split jobs into render units: batches of short songs sharing a background clip, else single jobs"""
+    units = []
+    open_batches = {}
+    for job in jobs:
+        duration = common.get_duration(job["audio"])
+        if duration > common.BATCH_MAX_SECONDS:
+            units.append([job])
+            continue
+
+        # The layout is fixed here, not at render time, so the deck deals each song's clip once
+        layout = choose_layout(job["audio"], job["output"], seed, job.get("overrides"))
+        if not layout:
+            units.append([job])
+            continue
+        batch = open_batches.get(layout["video"])
+        if batch is None or len(batch) >= common.BATCH_MAX_JOBS:
+            batch = open_batches[layout["video"]] = []
+            units.append(batch)
+        batch.append(dict(job, layout=layout, duration=duration))
+    return units
+
+
+def render_batch(batch):
+    """Compose a batch in one FFmpeg run; return per-job success, or None if the run itself failed"""
+    first = batch[0]
+    video_path = first["layout"]["video"]
+    width = wave_width = 1920
+    height = 1080
+    fps = 30
+    longest = max(job["duration"] for job in batch)
+
+    # No WAV intermediates: each song's audio is decoded straight into its branch
+    batch_seconds = sum(job["duration"] for job in batch)
+    if not common.wait_for_scratch_space(int(batch_seconds * common.SCRATCH_VIDEO_BYTES_PER_SECOND)):
+        return None
+
+    print(f"\n📦 Batch: {len(batch)} songs sharing {os.path.basename(video_path)}")
+
+    # Each branch blends its own title, so the clip is composed live rather
+    # than from a precomposite, which holds a single song's title
+    input_args = build_compose_inputs(video_path, first["audio"], None, fps=fps)
+    audio_indices = [1]
+    for job in batch[1:]:
+        audio_indices.append(input_args.count("-i"))
+        input_args.extend(["-i", job["audio"]])
+
+    filter_parts = build_background_graph(width, height, False)
+    filter_parts.append(f"[bg_layer]split={len(batch)}" + "".join(f"[bg_{k}]" for k in range(len(batch))))
+
+    threads = common.allocate_threads(common.get_job_concurrency())
+    encoder_threads = max(1, threads["encoder"] // len(batch))
+    output_args = []
+    scratch_renders = []
+    text_paths = []
+    for k, (job, audio_index) in enumerate(zip(batch, audio_indices)):
+        preset = job["layout"]["preset"]
+        text_style = job["layout"]["text_style"]
+        song_name = (job.get("overrides") or {}).get("title") or os.path.splitext(os.path.basename(job["audio"]))[0]
+        print(f"   📝 {song_name} ({job['duration']:.1f}s): {preset['name']} ({preset['type']}), "
+              f"{text_style['name']}")
+
+        base_label = f"[bg_{k}]"
+        text_path = os.path.join(common.SCRATCH_DIR, f"_tmp_text_{os.getpid()}_{k}.png")
+        common.TEMP_FILES.append(text_path)
+        text_paths.append(text_path)
+        if create_text_overlay(song_name, text_style, text_path, 1920, 1080) and os.path.exists(text_path):
+            filter_parts.extend(build_title_layer(base_label, input_args.count("-i"), width, height,
+                                                  out_label=f"[titled_{k}]", label_suffix=f"_{k}"))
+            input_args.extend(["-framerate", str(fps), "-i", text_path])
+            base_label = f"[titled_{k}]"
+        else:
+            print("[!] Failed to create text overlay, continuing without text...")
+
+        audio_filter = common.get_loudnorm_filter(job["audio"]) if common.LOUDNORM_ENABLED else None
+        # The same s16 stereo 44.1 kHz feed a single render gets from its WAV conversion
+        audio_chain = f"{audio_filter}," if audio_filter else ""
+        filter_parts.append(f"[{audio_index}:a]{audio_chain}aformat=sample_fmts=s16:sample_rates=44100:"
+                            f"channel_layouts=stereo[audio_{k}]")
+
+        wave_audio = f"[audio_{k}]"
+        if common.can_pass_through_audio(job["audio"], audio_filter):
+            audio_args = ["-map", f"{audio_index}:a", "-c:a", "copy"]
+        else:
+            filter_parts.append(f"[audio_{k}]asplit[wave_audio_{k}][aout_{k}]")
+            wave_audio = f"[wave_audio_{k}]"
+            audio_args = ["-map", f"[aout_{k}]", *common.AAC_ENCODE_ARGS]
+
+        silent_ranges = common.get_silent_ranges(preset, job["audio"], 0.0, job["duration"])
+        filter_parts.extend(common.build_wave_layer(preset, wave_width, get_wave_height(preset), wave_audio,
+                                             base_label, f"[v_{k}]", fps, silent_ranges,
+                                             label_suffix=f"_{k}"))
+
+        scratch_render = os.path.join(common.SCRATCH_DIR, f"_tmp_render_{os.getpid()}_{k}.mp4")
+        common.TEMP_FILES.append(scratch_render)
+        scratch_renders.append(scratch_render)
+        output_args.extend([
+            "-map", f"[v_{k}]",
+            "-t", f"{job['duration']:.2f}",
+            "-c:v", "libx264",
+            *common.FINAL_ENCODE_ARGS,
+            "-threads", str(encoder_threads),
+            "-pix_fmt", "yuv420p",
+            "-r", str(fps),
+            *audio_args,
+            *common.get_container_args(fps),
+            scratch_render
+        ])
+
+    cmd = ["ffmpeg", "-y", "-filter_complex_threads", str(threads["filter"]),
+           *common.with_decoder_threads(input_args, threads),
+           "-filter_complex", ";".join(filter_parts),
+           *output_args]
+
+    render_started = time.time()
+    if not common.run_with_progress(cmd, f"  └─ Composing {len(batch)} videos", longest):
+        return None
+
+    render_seconds = time.time() - render_started
+    results = []
+    for job, scratch_render in zip(batch, scratch_renders):
+        ok = common.publish_output(scratch_render, job["output"], job["duration"])
+        results.append(ok)
+        if not ok:
+            continue
+        render_bytes = os.path.getsize(job["output"])
+        common.RENDER_STATS.append({"mode": common.OUTPUT_MODE, "seconds": render_seconds / len(batch),
+                                    "bytes": render_bytes})
+        common.metric_inc("visualizer_bytes_written_total", render_bytes, mode=common.OUTPUT_MODE)
+        print(f"  ✅ Complete: {os.path.basename(job['output'])} ({common.format_size(render_bytes)})")
+    print(f"   ⏱️  Render: {render_seconds:.1f}s for {len(batch)} videos ({common.OUTPUT_MODE})")
+
+    for text_path in text_paths:
+        try:
+            if os.path.exists(text_path):
+                os.remove(text_path)
+            common.TEMP_FILES.remove(text_path)
+        except (OSError, ValueError):
+            pass
+    return results
+
+
+def prepare_live_track(job, seed=None):
+    """Prepare one playlist entry: common-format audio plus a cached background-and-title loop"""
+    layout = choose_layout(job["audio"], job["output"], seed, job.get("overrides"))
+    if not layout:
+        print("[!] No video available, skipping")
+        return None
+
+    video_path = layout["video"]
+    song_name = (job.get("overrides") or {}).get("title") or os.path.splitext(os.path.basename(job["audio"]))[0]
+    duration = common.get_duration(job["audio"])
+    print(f"\n📝 Preparing: {song_name} ({duration:.1f}s)")
+    print(f"   ✨ Text Style: {layout['text_style']['name']}")
+    print(f"   🎬 Video: {os.path.basename(video_path)}")
+
+    audio_track = common.prepare_live_audio(job["audio"], duration)
+    if not audio_track:
+        return None
+
+    width, height = 1920, 1080
+    background = get_precomposite_path(video_path, song_name, layout["text_style"], width, height,
+                                       common.LIVE_FPS, common.LIVE_BACKGROUND_ENCODE_ARGS)
+    if os.path.exists(background):
+        print("  ├─ Background: reusing cached loop precomposite")
+    else:
+        text_path = os.path.join(common.SCRATCH_DIR, f"_tmp_text_{os.getpid()}.png")
+        common.TEMP_FILES.append(text_path)
+        print("  ├─ Creating text overlay")
+        if not create_text_overlay(song_name, layout["text_style"], text_path, width, height):
+            print("[!] Failed to create text overlay, continuing without text...")
+            text_path = None
+            background = get_precomposite_path(video_path, None, None, width, height,
+                                               common.LIVE_FPS, common.LIVE_BACKGROUND_ENCODE_ARGS)
+
+        if not os.path.exists(background) and not render_precomposite(
+                video_path, text_path, background, width, height, common.LIVE_FPS,
+                common.get_duration(video_path), common.LIVE_BACKGROUND_ENCODE_ARGS):
+            return None
+
+    return {"title": song_name, "layout": layout, "audio": audio_track, "duration": common.get_duration(audio_track),
+            "background": background, "loop_period": common.get_duration(background)}
+
+
+def build_live_graph(preset):
+    """Return the compose graph run_live streams every track through; backgrounds arrive precomposed"""
+    return build_compose_graph(preset, FRAME_WIDTH, FRAME_HEIGHT, FRAME_WIDTH, get_wave_height(preset), False,
+                               precomposed=True, fps=common.LIVE_FPS)
+
+
+def render_boundary_clip(prev, render, crossfade, card_path, clip_path):
+    """Re-encode the start of a render with its title card and the crossfade from the previous one"""
+    fps = f"{render['fps']:g}"
+    head_length = render["head"][0]
+    tail_length = prev["duration"] - prev["tail"][0] if prev else 0.0
+    input_args = ["-ss", f"{prev['tail'][0]:.6f}", "-i", prev["path"]] if prev else []
+    head_index = 1 if prev else 0
+    input_args.extend(["-i", render["path"]])
+    parts = [f"[{head_index}:v]trim=end={head_length:.6f},setpts=PTS-STARTPTS,fps={fps}[head]"]
+    label = "head"
+
+    if card_path:
+        # Half-size card in the lower left, faded in and out over the song's opening
+        input_args.extend(["-loop", "1", "-framerate", fps, "-t", str(COMPILE_TITLE_SECONDS), "-i", card_path])
+        parts.append(f"[{head_index + 1}:v]scale=iw/2:-1,format=rgba,fade=t=in:d=0.5:alpha=1,"
+                     f"fade=t=out:st={COMPILE_TITLE_SECONDS - 0.5}:d=0.5:alpha=1[card]")
+        parts.append("[head][card]overlay=x=60:y=H-h-60:eof_action=pass[titled]")
+        label = "titled"
+
+    if prev:
+        parts.insert(0, f"[0:v]setpts=PTS-STARTPTS,fps={fps}[tail]")
+        parts.append(f"[tail][{label}]xfade=transition=fade:duration={crossfade:.6f}:"
+                     f"offset={tail_length - crossfade:.6f}[v]")
+    else:
+        parts.append(f"[{label}]null[v]")
+    cmd = [
+        "ffmpeg", "-y",
+        *input_args,
+        "-filter_complex", ";".join(parts),
+        "-map", "[v]", "-an",
+        "-c:v", "libx264", *common.get_clip_encode_args(render),
+        "-pix_fmt", render["params"]["pix_fmt"],
+        "-r", fps,
+        clip_path
+    ]
+    length = tail_length + head_length - crossfade
+    desc = "Crossfading into" if prev else "Title card for"
+    if not common.run_with_progress(cmd, f"  ├─ {desc} {os.path.basename(render['path'])}", length):
+        return None
+    return length if common.check_boundary_clip(clip_path, render) else None
+
+
+def compile_renders(compilation_path, manifest_path=None, crossfade=common.COMPILE_CROSSFADE_SECONDS):
+    """Join finished per-track renders into one video, re-encoding only around crossfades and title cards"""
+    common.claim_render_slot()
+    jobs = collect_jobs(manifest_path)
+    if not jobs:
+        return False
+
+    missing = [job for job in jobs if not os.path.exists(job["output"])]
+    if missing:
+        print(f"[!] {len(missing)} track(s) have not been rendered yet:")
+        for job in missing:
+            print(f"    {job['output']}")
+        return False
+
+    print(f"[*] Checking {len(jobs)} render(s) for stream-copy compatibility")
+    renders = []
+    for job in jobs:
+        render = common.probe_render(job["output"])
+        if not render or not common.get_audio_codec(job["output"]):
+            print(f"[!] Could not read video and audio streams of {os.path.basename(job['output'])}")
+            return False
+        render["path"] = job["output"]
+        render["title"] = (job.get("overrides") or {}).get("title") or os.path.splitext(os.path.basename(job["audio"]))[0]
+        renders.append(render)
+
+    reference = renders[0]
+    compatible = True
+    for render in renders[1:]:
+        differences = common.get_param_differences(render, reference)
+        if differences:
+            compatible = False
+            print(f"[!] {os.path.basename(render['path'])} does not match "
+                  f"{os.path.basename(reference['path'])}: {', '.join(differences)}")
+    if not compatible:
+        print("[!] Re-render the mismatched tracks with the same settings before compiling")
+        return False
+
+    title_seconds = COMPILE_TITLE_SECONDS if COMPILE_TITLE_CARDS else 0.0
+    too_short = common.plan_compile_cuts(renders, crossfade, title_seconds)
+    if too_short:
+        print(f"[!] No keyframes leave room for a {crossfade:g}s crossfade"
+              f"{' or title card' if COMPILE_TITLE_CARDS else ''} in: "
+              f"{', '.join(os.path.basename(path) for path in too_short)}")
+        return False
+
+    total = sum(render["duration"] for render in renders) - crossfade * (len(renders) - 1)
+    print(f"\n📝 Compiling {len(renders)} track(s) ({total / 60:.1f} min) → {os.path.basename(compilation_path)}")
+
+    card_style = next(style for style in TEXT_STYLE_PRESETS if style["name"] == COMPILE_TITLE_STYLE)
+    clips = []
+    for i, render in enumerate(renders):
+        if not render["head"]:
+            clips.append(None)
+            continue
+
+        card_path = None
+        if COMPILE_TITLE_CARDS:
+            card_path = os.path.join(common.SCRATCH_DIR, f"_tmp_compile_{os.getpid()}_{i}.png")
+            common.TEMP_FILES.append(card_path)
+            if not create_text_overlay(render["title"], card_style, card_path, 1920, 1080):
+                print("[!] Failed to create title card, continuing without it...")
+                card_path = None
+
+        clip_path = os.path.join(common.SCRATCH_DIR, f"_tmp_compile_{os.getpid()}_{i}.mp4")
+        common.TEMP_FILES.append(clip_path)
+        prev = renders[i - 1] if i > 0 and crossfade else None
+        length = render_boundary_clip(prev, render, crossfade if prev else 0.0, card_path, clip_path)
+        if length is None:
+            return False
+        clips.append({"path": clip_path, "length": length})
+
+    list_path = os.path.join(common.SCRATCH_DIR, f"_tmp_compile_{os.getpid()}.txt")
+    scratch_render = os.path.join(common.SCRATCH_DIR, f"_tmp_compile_{os.getpid()}.mp4")
+    common.TEMP_FILES.extend([list_path, scratch_render])
+    common.write_compile_list(renders, clips, list_path)
 
-    print("=" * 60)
-    print("✅ Done — check your output/ folder")
\ No newline at end of file
+    cmd = ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", list_path]
+    for render in renders:
+        cmd.extend(["-i", render["path"]])
+    cmd.extend([
+        "-filter_complex", common.build_compile_audio_graph(renders, crossfade),
+        "-map", "0:v", "-map", "[a]",
+        "-c:v", "copy",
+        *common.AAC_ENCODE_ARGS,
+        *common.get_container_args(),
+        scratch_render
+    ])
+    if not common.run_with_progress(cmd, f"  └─ Joining {len(renders)} renders", total):
+        return False
+    if not common.publish_output(scratch_render, compilation_path, total):
+        return False
+
+    reencoded = sum(clip["length"] for clip in clips if clip)
+    print(f"  ✅ Complete: {os.path.basename(compilation_path)} "
+          f"(re-encoded {reencoded:.1f}s of {total:.1f}s video)")
+    return True
+
+
+if __name__ == "__main__":
+    parser = common.build_parser("Music Visualizer Generator with Stylized Text",
+                                 "audio, video, title, preset, output", ["duration", "brightness"])
+    parser.add_argument("--title-cards", action="store_true",
+                        help=f"overlay each song's title over its first {COMPILE_TITLE_SECONDS}s in --compile mode")
+    args = parser.parse_args()
+    COMPILE_TITLE_CARDS = args.title_cards
+    common.run_cli(sys.modules[__name__], parser, args)
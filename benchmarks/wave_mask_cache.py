@@ -0,0 +1,154 @@
+"""Compare drawing a bar preset inline with tinting a cached greyscale alpha mask
+
+Runs the real app_videos compose graph over one slice of a song and times:
+  spectrum   showfreqs alone, the most a mask cache could ever save
+  baseline   background only, no waveform layer
+  inline     the bar layer drawn by showfreqs in the graph (what renders use)
+  mask       one-off render of the colour-agnostic mask to lossless FFV1
+  cached     the bar layer rebuilt from that mask with color + alphamerge
+  masks      one-off render of one mask per channel
+  cached2    the layer rebuilt from both: the preset colour for the first
+             channel and white for the second, as showfreqs draws it inline
+
+Every compose pass encodes with FINAL_ENCODE_ARGS into the null muxer. The
+single mask tints both channels in the preset colour, so "cached" is a lower
+bound; "cached2" is the variant that reproduces the inline layer.
+
+    python benchmarks/wave_mask_cache.py [--audio FILE] [--video FILE] [--seconds N] [--preset NAME]
+
+Without --audio/--video, synthetic stereo noise and a test pattern are used.
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app_common as common  # noqa: E402
+import app_videos  # noqa: E402
+
+WIDTH, HEIGHT, FPS = 1920, 1080, 30
+
+
+def make_inputs(workdir, seconds):
+    """Synthesise an audio slice and a background clip"""
+    audio_path = os.path.join(workdir, "audio.wav")
+    video_path = os.path.join(workdir, "background.mp4")
+    subprocess.run([
+        "ffmpeg", "-v", "error", "-y",
+        "-f", "lavfi", "-i", f"anoisesrc=c=pink:a=0.3:d={seconds}",
+        "-f", "lavfi", "-i", f"sine=f=110:d={seconds}",
+        "-filter_complex", "amix=inputs=2,aformat=channel_layouts=stereo",
+        audio_path
+    ], check=True)
+    subprocess.run([
+        "ffmpeg", "-v", "error", "-y",
+        "-f", "lavfi", "-i", f"testsrc2=s={WIDTH}x{HEIGHT}:r={FPS}:d=10",
+        "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p", video_path
+    ], check=True)
+    return audio_path, video_path
+
+
+def timed(cmd):
+    """Run an ffmpeg command; return (wall, cpu) seconds"""
+    cpu_before = common.get_child_cpu_seconds()
+    started = time.perf_counter()
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    wall = time.perf_counter() - started
+    if result.returncode != 0:
+        sys.exit(f"ffmpeg failed:\n{' '.join(cmd)}\n{result.stderr[-2000:]}")
+    cpu = None if cpu_before is None else common.get_child_cpu_seconds() - cpu_before
+    return wall, cpu
+
+
+def compose(input_args, filter_graph, seconds):
+    """Return the command for one compose pass encoded into the null muxer"""
+    return ["ffmpeg", "-y", *input_args, "-filter_complex", filter_graph, "-map", "[v]",
+            "-t", f"{seconds:.2f}", "-c:v", "libx264", *common.FINAL_ENCODE_ARGS,
+            "-pix_fmt", "yuv420p", "-f", "null", "-"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--audio")
+    parser.add_argument("--video")
+    parser.add_argument("--seconds", type=float, default=20.0)
+    parser.add_argument("--preset", default=None, help="bar preset name (default: the first one)")
+    args = parser.parse_args()
+
+    bars = [p for p in app_videos.WAVEFORM_PRESETS if p["type"] == "bars"]
+    preset = next((p for p in bars if p["name"] == args.preset), None) if args.preset else bars[0]
+    if not preset:
+        sys.exit(f"No bar preset named {args.preset!r}")
+    wave_height = app_videos.get_wave_height(preset)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        audio_path, video_path = args.audio, args.video
+        if not audio_path or not video_path:
+            synth_audio, synth_video = make_inputs(workdir, args.seconds)
+            audio_path, video_path = audio_path or synth_audio, video_path or synth_video
+
+        input_args = app_videos.build_compose_inputs(video_path, audio_path, None, fps=FPS)
+        inline_graph = app_videos.build_compose_graph(preset, WIDTH, HEIGHT, WIDTH, wave_height, False, fps=FPS)
+        background = app_videos.build_background_graph(WIDTH, HEIGHT, False)
+        baseline_graph = ";".join(background + ["[bg_layer]format=yuv420p[v]"])
+
+        # The inline graph's showfreqs node, redrawn in white, is the mask
+        match = re.search(r"\[1:a\](showfreqs=[^\[;]*?)(,format=\w+)?\[wave\]", inline_graph)
+        showfreqs = re.sub(r"colors=[^:]+", "colors=white", match.group(1))
+        rate = re.search(r":r=(\d+)", showfreqs)
+        mask_rate = rate.group(1) if rate else str(FPS)
+        mask_path = os.path.join(workdir, "mask.mkv")
+        mask_cmd = ["ffmpeg", "-y", "-i", audio_path, "-t", f"{args.seconds:.2f}",
+                    "-filter_complex", f"[0:a]{showfreqs},format=gray[m]", "-map", "[m]",
+                    "-c:v", "ffv1", mask_path]
+
+        channel_paths = [os.path.join(workdir, f"mask{c}.mkv") for c in (0, 1)]
+        channel_cmd = ["ffmpeg", "-y", "-i", audio_path, "-t", f"{args.seconds:.2f}", "-filter_complex",
+                       "[0:a]asplit[a0][a1];" + ";".join(
+                           f"[a{c}]pan=mono|c0=c{c},{showfreqs},format=gray[m{c}]" for c in (0, 1))]
+        for c, path in enumerate(channel_paths):
+            channel_cmd.extend(["-map", f"[m{c}]", "-c:v", "ffv1", path])
+
+        color = preset["color"].split("|")[0]
+        wave_width, wave_height = re.search(r"s=(\d+)x(\d+)", showfreqs).groups()
+        layer_format = match.group(2) or ""
+
+        def tint(mask_input, tint_color, label):
+            return (f"[{mask_input}:v]format=gray[{label}_mask];"
+                    f"color=c={tint_color}:s={wave_width}x{wave_height}:r={mask_rate}[{label}_tint];"
+                    f"[{label}_tint][{label}_mask]alphamerge")
+
+        cached_graph = inline_graph.replace(match.group(0), f"{tint(2, color, 'm')}{layer_format}[wave]")
+        cached2_graph = inline_graph.replace(match.group(0), (
+            f"{tint(2, color, 'm0')}[w0];{tint(3, 'white', 'm1')}[w1];"
+            f"[w0][w1]overlay{layer_format}[wave]"
+        ))
+
+        print(f"Preset {preset['name']} ({wave_width}x{wave_height} @ {mask_rate} fps), "
+              f"{args.seconds:g}s slice, {os.cpu_count()} CPU(s)")
+        results = {}
+        results["spectrum"] = timed(["ffmpeg", "-y", "-i", audio_path, "-t", f"{args.seconds:.2f}",
+                                     "-filter_complex", f"[0:a]{showfreqs}[m]", "-map", "[m]", "-f", "null", "-"])
+        results["baseline"] = timed(compose(input_args, baseline_graph, args.seconds))
+        results["inline"] = timed(compose(input_args, inline_graph, args.seconds))
+        results["mask"] = timed(mask_cmd)
+        results["cached"] = timed(compose(input_args + ["-i", mask_path], cached_graph, args.seconds))
+        results["masks"] = timed(channel_cmd)
+        channel_inputs = [arg for path in channel_paths for arg in ("-i", path)]
+        results["cached2"] = timed(compose(input_args + channel_inputs, cached2_graph, args.seconds))
+
+    for name, (wall, cpu) in results.items():
+        print(f"  {name:<9}{common.format_cost(wall, cpu)}")
+    baseline = results["baseline"][0]
+    print(f"Waveform layer on top of the baseline: inline {results['inline'][0] - baseline:.1f}s, "
+          f"one mask {results['cached'][0] - baseline:.1f}s (+{results['mask'][0]:.1f}s once per song), "
+          f"per-channel masks {results['cached2'][0] - baseline:.1f}s (+{results['masks'][0]:.1f}s once per song); "
+          f"spectrum alone {results['spectrum'][0]:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+import pytest
+
+import app_common as common
+
+
+@pytest.fixture(autouse=True)
+def audio_cache(monkeypatch, tmp_path):
+    monkeypatch.setattr(common, "AUDIO_CACHE_DIR", str(tmp_path / "audio"))
+
+
+def fake_encoder(calls):
+    """run_with_progress stand-in that writes the output file"""
+    def run(cmd, *args, **kwargs):
+        calls.append(cmd)
+        open(cmd[-1], "wb").close()
+        return True
+    return run
+
+
+def test_source_aac_is_passed_through(monkeypatch, tmp_path):
+    song = tmp_path / "song.m4a"
+    song.write_bytes(b"aac")
+    calls = []
+    monkeypatch.setattr(common, "get_audio_codec", lambda path: "aac")
+    monkeypatch.setattr(common, "run_with_progress", fake_encoder(calls))
+    assert common.prepare_audio_track(str(song), 30.0) == str(song)
+    assert calls == []
+
+
+@pytest.mark.parametrize("name, codec", [("song.mp3", "mp3"), ("song.m4a", "alac")])
+def test_other_audio_is_encoded_once(monkeypatch, tmp_path, name, codec):
+    song = tmp_path / name
+    song.write_bytes(b"audio")
+    calls = []
+    monkeypatch.setattr(common, "get_audio_codec", lambda path: codec)
+    monkeypatch.setattr(common, "run_with_progress", fake_encoder(calls))
+
+    track = common.prepare_audio_track(str(song), 30.0)
+    assert track.startswith(common.AUDIO_CACHE_DIR) and track.endswith(".m4a")
+    assert common.prepare_audio_track(str(song), 30.0) == track
+    assert len(calls) == 1
+    assert calls[0][calls[0].index("-i") + 1] == str(song)
@@ -0,0 +1,53 @@
+import re
+
+import pytest
+
+import app_common as common
+import app_main
+import app_videos
+
+
+@pytest.fixture(params=[app_main, app_videos], ids=["main", "videos"])
+def app(request, monkeypatch):
+    monkeypatch.setattr(common, "BATCH_MAX_JOBS", 2)
+    return request.param
+
+
+def plan(app, monkeypatch, songs):
+    """Plan batches for (name, seconds, background clip) songs"""
+    durations = {f"{name}.mp3": seconds for name, seconds, _ in songs}
+    clips = {f"{name}.mp3": clip for name, _, clip in songs}
+    monkeypatch.setattr(common, "get_duration", lambda path: durations[path])
+    monkeypatch.setattr(app, "choose_layout", lambda audio, output, seed=None, overrides=None: {
+        "overlay": clips[audio], "video": clips[audio]})
+    jobs = [{"name": name, "audio": f"{name}.mp3", "image": "cover.png", "output": f"{name}.mp4"}
+            for name, _, _ in songs]
+    return app.plan_batches(jobs)
+
+
+def test_short_songs_group_by_background_up_to_the_limit(app, monkeypatch):
+    units = plan(app, monkeypatch, [
+        ("a", 20, "loop1.mp4"), ("long", common.BATCH_MAX_SECONDS + 1, "loop1.mp4"), ("b", 25, "loop2.mp4"),
+        ("c", 10, "loop1.mp4"), ("d", 30, "loop1.mp4"),
+    ])
+    assert [[job["name"] for job in unit] for unit in units] == [["a", "c"], ["long"], ["b"], ["d"]]
+    # Long songs render alone and pick their layout at render time as before
+    assert "layout" not in units[1][0]
+    assert units[0][1]["layout"]["video"] == "loop1.mp4" and units[0][1]["duration"] == 10
+
+
+def test_waveform_labels_get_the_batch_suffix(app, monkeypatch, tmp_path):
+    monkeypatch.setattr(common, "RADIAL_LUT_DIR", str(tmp_path / "radial"))
+    outer = {"1:a", "3:a", "bg", "v", "v_1"}
+    for preset in app.WAVEFORM_PRESETS:
+        height = app.get_wave_height(preset)
+        plain = common.build_wave_layer(preset, 1080, height, "[1:a]", "[bg]", "[v]")
+        first = common.build_wave_layer(preset, 1080, height, "[1:a]", "[bg]", "[v_1]", label_suffix="_1")
+        second = common.build_wave_layer(preset, 1080, height, "[3:a]", "[v_1]", "[v]", label_suffix="_2")
+
+        def labels(parts):
+            return set(re.findall(r"\[([^\]]+)\]", ";".join(parts))) - outer
+
+        assert labels(first) == {f"{label}_1" for label in labels(plain)}, preset["name"]
+        assert not labels(first) & labels(second), preset["name"]
+        assert "[wave_1]" in first[-1] and first[-1].endswith("[v_1]")
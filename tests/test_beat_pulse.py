@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+import app_common as common
+
+
+def click_track(sample_rate, bpm, seconds):
+    """Low thumps on every beat over faint noise"""
+    samples = np.random.default_rng(0).normal(0, 0.01, int(sample_rate * seconds)).astype(np.float32)
+    thump = np.arange(int(0.05 * sample_rate)) / sample_rate
+    thump = (np.sin(2 * np.pi * 80 * thump) * np.exp(-60 * thump)).astype(np.float32)
+    for beat in np.arange(0.25, seconds - 0.1, 60.0 / bpm):
+        start = int(beat * sample_rate)
+        samples[start:start + len(thump)] += thump
+    return samples
+
+
+def test_tempo_and_beats_follow_the_clicks():
+    beat_map = common.compute_beat_map(click_track(common.BEAT_SAMPLE_RATE, 120, 12), common.BEAT_SAMPLE_RATE)
+    assert abs(beat_map["tempo"] - 120) < 5
+    assert np.median(np.diff(beat_map["beat_times"])) == pytest.approx(0.5, abs=0.03)
+    assert len(beat_map["beat_strength"]) == len(beat_map["beat_times"])
+    assert beat_map["beat_strength"].max() <= 1.0
+
+
+def test_too_short_for_analysis():
+    assert common.compute_beat_map(np.zeros(common.BEAT_FFT_SIZE - 1, dtype=np.float32), common.BEAT_SAMPLE_RATE) is None
+
+
+def test_commands_cover_only_the_window(tmp_path):
+    beat_map = {"beat_times": np.array([0.5, 1.0, 1.1, 3.0], dtype=np.float32),
+                "beat_strength": np.array([1.0, 0.0, 0.5, 1.0], dtype=np.float32)}
+    cmd_path = tmp_path / "beats.txt"
+    assert common.write_beat_commands(beat_map, str(cmd_path), start=0.8, duration=2.0) == 2
+
+    lines = cmd_path.read_text().splitlines()
+    # The pulse after 1.0s is cut short by the next beat 0.1s later
+    assert lines[0].startswith("0.200-0.300 [enter] eq@beat brightness ")
+    assert lines[1].startswith(f"0.300-{0.3 + common.BEAT_PULSE_LENGTH:.3f} [enter] eq@beat brightness ")
+    assert all(line.endswith("[leave] eq@beat saturation 1;") for line in lines)
@@ -0,0 +1,45 @@
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+import app_common as common
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    recorded = []
+
+    def fake_run_child(cmd, **kwargs):
+        recorded.append((cmd, kwargs))
+        return subprocess.CompletedProcess(cmd, 0, "codec_type=audio\nduration=12.5\n", "")
+    monkeypatch.setattr(common, "run_child", fake_run_child)
+    return recorded
+
+
+def test_probe_media_uses_run_child(calls, tmp_path):
+    path = tmp_path / "song.wav"
+    path.write_bytes(b"RIFF")
+    assert common.probe_media(str(path), "audio") is None
+    assert calls[0][0][0] == "ffprobe"
+    assert calls[0][1]["timeout"] == common.PREFLIGHT_TIMEOUT
+
+
+def test_dry_run_filter_uses_run_child(calls):
+    assert common.dry_run_filter("[AUDIO_INPUT]showfreqs=s=64x64[wave]") is None
+    assert "[0:a]showfreqs=s=64x64[wave]" in calls[0][0]
+
+
+def test_time_graph_slice_uses_run_child(calls):
+    assert common.time_graph_slice(["-i", "bg.mp4"], "[0:v]null[v]", 1.0) is not None
+    assert calls[0][0][0] == "ffmpeg"
+
+
+@pytest.mark.skipif(sys.platform.startswith("win") or not shutil.which("ffmpeg"), reason="needs ffmpeg and wait4")
+def test_dry_run_is_charged_to_the_current_job(monkeypatch):
+    usage = common.new_usage()
+    monkeypatch.setattr(common, "CURRENT_USAGE", usage)
+    assert common.dry_run_filter("[AUDIO_INPUT]showfreqs=s=64x64[wave]") is None
+    assert common.dry_run_filter("[AUDIO_INPUT]showfreqs=s=64x64:nosuchoption=1[wave]")
+    assert usage["children"] == 2
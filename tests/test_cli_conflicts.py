@@ -0,0 +1,54 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import app_common as common
+import app_main
+import app_videos
+
+
+@pytest.mark.parametrize("options, expected", [
+    ({"preview", "teaser"}, "--preview and --teaser cannot be combined"),
+    ({"teaser", "batch_short"}, "--teaser and --batch-short cannot be combined"),
+    ({"compile", "batch_short"}, "--batch-short has no effect with --compile"),
+    ({"live", "preview"}, "--preview has no effect with --live"),
+    ({"coordinator", "teaser"}, "--teaser has no effect with --coordinator"),
+    ({"compile", "live"}, "--live, --compile are separate modes; pick one"),
+    ({"teaser_beats"}, "--teaser-beats needs --teaser"),
+    ({"crossfade"}, "--crossfade needs --compile"),
+    ({"deck_weighting"}, "--deck-weighting needs --deck"),
+])
+def test_conflicting_options_are_reported(options, expected):
+    assert expected in common.find_option_conflicts(options)
+
+
+@pytest.mark.parametrize("options", [
+    set(),
+    {"preview", "seed"},
+    {"teaser", "teaser_beats", "normalize"},
+    {"batch_short", "sidecars"},
+    {"check", "preview"},
+    {"compile", "crossfade"},
+    {"live", "live_loop", "manifest"},
+    {"worker", "concurrency"},
+    {"deck", "deck_weighting"},
+])
+def test_compatible_options_pass(options):
+    assert common.find_option_conflicts(options) == []
+
+
+def test_title_cards_need_compile():
+    assert "--title-cards needs --compile" in common.find_option_conflicts({"title_cards"})
+    assert common.find_option_conflicts({"compile", "title_cards"}) == []
+
+
+@pytest.mark.parametrize("app", [app_main, app_videos], ids=["main", "videos"])
+def test_command_line_exits_before_rendering(app, tmp_path):
+    script = os.path.abspath(app.__file__)
+    result = subprocess.run([sys.executable, script, "--compile", "out.mp4", "--batch-short"],
+                            capture_output=True, text=True, cwd=tmp_path, timeout=60)
+    assert result.returncode == 2
+    assert "--batch-short has no effect with --compile" in result.stderr
+    assert "Music Visualizer Generator" not in result.stdout
@@ -0,0 +1,62 @@
+import pytest
+
+import app_common as common
+
+SEI = (b"\x05\xff\xffx264 - core 164 r3108 31e19f9 - H.264/MPEG-4 AVC codec - Copyleft 2003-2023 - "
+       b"http://www.videolan.org/x264.html - options: cabac=1 ref=1 deblock=1:0:0 me=hex subme=2 "
+       b"psy=1 psy_rd=1.00:0.00 8x8dct=1 bframes=3 b_pyramid=2 weightb=1 weightp=1 keyint=60 "
+       b"keyint_min=6 scenecut=40 rc_lookahead=10 rc=crf crf=23.0\x00\x80")
+
+
+def probed(**overrides):
+    params = {"codec_name": "h264", "profile": "High", "level": 40, "width": 1920, "height": 1080,
+              "pix_fmt": "yuv420p", "r_frame_rate": "30/1", "sample_aspect_ratio": "1:1",
+              "extradata_hash": "sha256:aaaa"}
+    params.update(overrides)
+    assert set(params) == set(common.COMPILE_VIDEO_FIELDS)
+    return {"params": params, "path": "song.mp4"}
+
+
+def test_level_and_extradata_are_compared():
+    reference = probed()
+    assert common.get_param_differences(probed(), reference) == []
+    assert common.get_param_differences(probed(level=41), reference) == ["level 41 vs 40"]
+    assert common.get_param_differences(probed(extradata_hash="sha256:bbbb"), reference) == [
+        "extradata_hash sha256:bbbb vs sha256:aaaa"]
+
+
+@pytest.mark.parametrize("offset", [0, 1024 * 1024 - 200, 3 * 1024 * 1024])
+def test_x264_options_read_from_sei(tmp_path, offset):
+    path = tmp_path / "render.mp4"
+    path.write_bytes(b"\x00" * offset + SEI + b"\x00" * 4096)
+    options = common.read_x264_options(str(path))
+    assert options["keyint"] == "60"
+    assert options["subme"] == "2"
+    assert options["psy_rd"] == "1.00:0.00"
+    assert options["crf"] == "23.0"
+
+
+def test_x264_options_missing(tmp_path):
+    path = tmp_path / "render.mp4"
+    path.write_bytes(b"\x00" * 4096)
+    assert common.read_x264_options(str(path)) == {}
+    assert common.get_clip_encode_args({"x264": {}}) == common.FINAL_ENCODE_ARGS
+
+
+def test_clip_args_reuse_render_settings(tmp_path):
+    path = tmp_path / "render.mp4"
+    path.write_bytes(SEI)
+    args = common.get_clip_encode_args({"x264": common.read_x264_options(str(path))})
+    params = dict(item.split("=", 1) for item in args[args.index("-x264-params") + 1].split(":"))
+    assert params["keyint"] == "60"
+    assert params["ref"] == "1"
+    assert params["psy_rd"] == "1.00,0.00"
+    assert "deblock" not in params and "rc" not in params
+
+
+def test_mismatched_boundary_clip_is_rejected(monkeypatch):
+    render = probed()
+    monkeypatch.setattr(common, "probe_render", lambda path: probed())
+    assert common.check_boundary_clip("clip.mp4", render)
+    monkeypatch.setattr(common, "probe_render", lambda path: probed(extradata_hash="sha256:cccc"))
+    assert not common.check_boundary_clip("clip.mp4", render)
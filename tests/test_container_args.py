@@ -0,0 +1,13 @@
+import app_common as common
+
+
+def test_faststart_by_default():
+    assert common.OUTPUT_MODE == "faststart"
+    assert common.get_container_args(30) == ["-movflags", "+faststart"]
+
+
+def test_fragments_start_on_every_keyframe(monkeypatch):
+    monkeypatch.setattr(common, "OUTPUT_MODE", "fragmented")
+    args = common.get_container_args(30)
+    assert args[:2] == ["-g", str(30 * common.FRAGMENT_SECONDS)]
+    assert args[args.index("-movflags") + 1] == "+frag_keyframe+empty_moov+default_base_moof"
@@ -0,0 +1,96 @@
+import app_common as common
+
+
+def make_coordinator(unit_count=2):
+    units = [{"id": f"song#{i}", "track": "song"} for i in range(unit_count)]
+    tracks = {"song": {"name": "song", "remaining": unit_count}}
+    return common.RenderCoordinator(units, tracks, {"VISUAL_FPS": 15})
+
+
+def request(coordinator, worker):
+    return coordinator.handle({"type": "request", "worker": worker})
+
+
+def result(coordinator, worker, unit_id, ok=True):
+    return coordinator.handle({"type": "result", "worker": worker, "unit": unit_id, "ok": ok})
+
+
+def go_silent(coordinator, worker):
+    coordinator.workers[worker]["seen"] -= common.HEARTBEAT_TIMEOUT + 1
+
+
+def test_units_are_handed_out_with_settings():
+    coordinator = make_coordinator()
+    reply = request(coordinator, "a")
+    assert reply["type"] == "unit" and reply["unit"]["id"] == "song#0"
+    assert reply["settings"] == {"VISUAL_FPS": 15}
+    assert request(coordinator, "b")["unit"]["id"] == "song#1"
+    assert request(coordinator, "c")["type"] == "wait"
+
+
+def test_silent_worker_loses_its_unit():
+    coordinator = make_coordinator(1)
+    request(coordinator, "a")
+    coordinator.handle({"type": "heartbeat", "worker": "b"})
+    go_silent(coordinator, "a")
+    coordinator.reap()
+    assert "a" not in coordinator.workers
+    assert request(coordinator, "b")["unit"]["id"] == "song#0"
+
+    # The silent worker's failure is stale; its late success still counts once
+    result(coordinator, "a", "song#0", ok=False)
+    assert coordinator.active == {"song#0": "b"}
+    result(coordinator, "a", "song#0", ok=True)
+    result(coordinator, "b", "song#0", ok=True)
+    assert coordinator.done == {"song#0"}
+    assert [track["name"] for track in coordinator.take_ready()] == ["song"]
+    assert coordinator.finished()
+
+
+def test_heartbeats_keep_the_unit():
+    coordinator = make_coordinator(1)
+    request(coordinator, "a")
+    coordinator.handle({"type": "heartbeat", "worker": "a", "progress": 0.5})
+    coordinator.reap()
+    assert coordinator.active == {"song#0": "a"}
+    assert coordinator.workers["a"]["progress"] == 0.5
+
+
+def test_failures_retry_then_give_up():
+    coordinator = make_coordinator(1)
+    for attempt in range(common.UNIT_MAX_ATTEMPTS):
+        assert request(coordinator, "a")["unit"]["id"] == "song#0"
+        result(coordinator, "a", "song#0", ok=False)
+    assert coordinator.failed == {"song#0"}
+    assert request(coordinator, "a")["type"] == "done"
+    assert coordinator.finished()
+
+
+def test_track_ready_only_after_every_segment():
+    coordinator = make_coordinator(2)
+    request(coordinator, "a")
+    request(coordinator, "b")
+    result(coordinator, "a", "song#0")
+    assert coordinator.take_ready() == []
+    result(coordinator, "b", "song#1")
+    assert [track["name"] for track in coordinator.take_ready()] == ["song"]
+
+
+def test_segments_are_joined_with_one_audio_track(monkeypatch, tmp_path):
+    monkeypatch.setattr(common, "SCRATCH_DIR", str(tmp_path))
+    monkeypatch.setattr(common, "TEMP_FILES", [])
+    monkeypatch.setattr(common, "LOUDNORM_ENABLED", False)
+    monkeypatch.setattr(common, "prepare_audio_track", lambda audio, duration, audio_filter: "track.m4a")
+    monkeypatch.setattr(common, "publish_output", lambda *args: True)
+    calls = []
+    monkeypatch.setattr(common, "run_with_progress", lambda cmd, *args: calls.append(cmd) or True)
+    segments = tmp_path / "segments"
+    segments.mkdir()
+    track = {"job": {"audio": "song.mp3", "output": "song.mp4"}, "duration": 60.0,
+             "segments": [str(segments / f"{i}.mp4") for i in range(3)]}
+    assert common.join_segments(track)
+
+    [cmd] = calls
+    assert [cmd[i + 1] for i, arg in enumerate(cmd) if arg == "-i"][1:] == ["track.m4a"]
+    assert cmd[cmd.index("-map", cmd.index("0:v")) + 1] == "1:a"
+    assert cmd[cmd.index("-c") + 1] == "copy"
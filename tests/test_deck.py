@@ -0,0 +1,101 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import app_common as common
+import app_main
+import app_videos
+
+EXTENSIONS = (".mp4",)
+
+
+@pytest.fixture(autouse=True)
+def deck_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(common, "DECK_DIR", str(tmp_path / "decks"))
+    monkeypatch.setattr(common, "DECKS", {})
+    monkeypatch.setattr(common, "DECK_WEIGHTING", None)
+
+
+def make_library(path, count):
+    path.mkdir(exist_ok=True)
+    for i in range(count):
+        (path / f"clip{i:02d}.mp4").write_bytes(b"x")
+    return str(path)
+
+
+def draw(library, count):
+    return [os.path.basename(common.draw_from_deck(library, EXTENSIONS)) for _ in range(count)]
+
+
+def test_every_clip_dealt_once_per_cycle(tmp_path):
+    library = make_library(tmp_path / "clips", 6)
+    first = draw(library, 6)
+    second = draw(library, 6)
+    assert sorted(first) == sorted(second) == [f"clip{i:02d}.mp4" for i in range(6)]
+    assert second[0] != first[-1]
+
+
+def test_position_persists_across_processes(tmp_path, monkeypatch):
+    library = make_library(tmp_path / "clips", 6)
+    dealt = draw(library, 3)
+    monkeypatch.setattr(common, "DECKS", {})  # A new process starts with no in-memory copy
+    dealt += draw(library, 3)
+    assert sorted(dealt) == [f"clip{i:02d}.mp4" for i in range(6)]
+
+
+def test_clip_added_mid_cycle_joins_the_cycle(tmp_path):
+    clips = tmp_path / "clips"
+    library = make_library(clips, 4)
+    dealt = draw(library, 2)
+    (clips / "new.mp4").write_bytes(b"x")
+    os.utime(clips, ns=(0, os.stat(clips).st_mtime_ns + 10 ** 9))
+    dealt += draw(library, 3)
+    assert sorted(dealt) == ["clip00.mp4", "clip01.mp4", "clip02.mp4", "clip03.mp4", "new.mp4"]
+
+
+def test_empty_library(tmp_path):
+    (tmp_path / "clips").mkdir()
+    assert common.draw_from_deck(str(tmp_path / "clips"), EXTENSIONS) is None
+
+
+@pytest.mark.skipif(sys.platform.startswith("win"), reason="forks several interpreters")
+def test_concurrent_processes_share_one_deck(tmp_path):
+    library = make_library(tmp_path / "clips", 20)
+    script = (
+        "import json, os, sys\n"
+        f"sys.path.insert(0, {os.path.dirname(os.path.dirname(os.path.abspath(__file__)))!r})\n"
+        "import app_common as common\n"
+        f"common.DECK_DIR = {common.DECK_DIR!r}\n"
+        "common.DECK_WEIGHTING = None\n"
+        f"print(json.dumps([os.path.basename(common.draw_from_deck({library!r}, ('.mp4',))) for _ in range(5)]))\n"
+    )
+    processes = [subprocess.Popen([sys.executable, "-c", script], stdout=subprocess.PIPE, text=True)
+                 for _ in range(4)]
+    dealt = []
+    for process in processes:
+        out, _ = process.communicate(timeout=60)
+        assert process.returncode == 0
+        dealt += json.loads(out.strip().splitlines()[-1])
+    assert sorted(dealt) == [f"clip{i:02d}.mp4" for i in range(20)]
+
+
+@pytest.mark.parametrize("app", [app_main, app_videos], ids=["main", "videos"])
+def test_layouts_follow_the_seed_unless_dealt(app, tmp_path, monkeypatch):
+    library = make_library(tmp_path / "clips", 6)
+    monkeypatch.setattr(app, "OVERLAY_DIR" if app is app_main else "VIDEOS_DIR", library)
+    if app is app_videos:
+        monkeypatch.setattr(app, "pick_contrasting_text_style", lambda path, rng: app.TEXT_STYLE_PRESETS[0])
+
+    def background():
+        layout = app.choose_layout(str(tmp_path / "song.mp3"), str(tmp_path / "song.mp4"))
+        return layout["overlay" if app is app_main else "video"]
+
+    assert not common.DECK_ENABLED
+    assert len({background() for _ in range(4)}) == 1
+    assert not os.path.exists(common.DECK_DIR)
+
+    monkeypatch.setattr(common, "DECK_ENABLED", True)
+    assert len({background() for _ in range(6)}) == 6
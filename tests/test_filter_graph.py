@@ -0,0 +1,24 @@
+import app_common as common
+
+
+def test_quoted_and_escaped_separators_stay_in_place():
+    text = r"drawtext=text='a,b;c':x=1,scale=w=2\,3"
+    assert common.split_filter_text(text, ",") == [r"drawtext=text='a,b;c':x=1", r"scale=w=2\,3"]
+
+
+def test_chains_are_flattened_with_labelled_links():
+    nodes = common.parse_filter_graph("[0:v]scale=100:100,format=yuv420p[bg];[1:a]showfreqs=s=100x50[wave];"
+                                   "[bg][wave]overlay=0:0[v]")
+    assert [node["name"] for node in nodes] == ["scale", "format", "showfreqs", "overlay"]
+    assert nodes[0]["inputs"] == ["0:v"] and nodes[0]["outputs"] == nodes[1]["inputs"] == ["pf1"]
+    assert nodes[3]["inputs"] == ["bg", "wave"] and nodes[3]["outputs"] == ["v"]
+    assert common.join_filter_graph(nodes) == ("[0:v]scale=100:100[pf1];[pf1]format=yuv420p[bg];"
+                                            "[1:a]showfreqs=s=100x50[wave];[bg][wave]overlay=0:0[v]")
+
+
+def test_link_types_follow_the_sources():
+    nodes = common.parse_filter_graph("[1:a]asplit[a1][a2];[a1]showfreqs[w];[a2]volume=2[quiet];"
+                                   "[0:v][w]overlay[v]")
+    types = common.get_link_types(nodes)
+    assert types["a1"] == types["quiet"] == "audio"
+    assert types["w"] == types["v"] == "video"
@@ -0,0 +1,76 @@
+import os
+
+import pytest
+
+import app_common as common
+import app_main
+import app_videos
+
+
+@pytest.fixture(autouse=True)
+def isolated_dirs(monkeypatch, tmp_path):
+    monkeypatch.setattr(common, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(common, "INPUT_INDEX_PATH", str(tmp_path / "cache" / "input_index.json"))
+    monkeypatch.setattr(common, "INPUT_DIR", str(tmp_path / "input"))
+    monkeypatch.setattr(common, "OUTPUT_DIR", str(tmp_path / "output"))
+
+
+@pytest.fixture
+def tree(tmp_path):
+    root = tmp_path / "input"
+    (root / "album" / "disc2").mkdir(parents=True)
+    (root / "media").mkdir()
+    (root / "single.mp3").write_bytes(b"x")
+    (root / "album" / "one.mp3").write_bytes(b"x")
+    (root / "album" / "disc2" / "two.mp3").write_bytes(b"x")
+    (root / "album" / ".hidden.mp3").write_bytes(b"x")
+    (root / "media" / "clip.mp4").write_bytes(b"x")
+    return root
+
+
+def test_tree_is_listed_without_skipped_folders(tree):
+    listing = common.scan_input_tree(str(tree), skip_dirs=[str(tree / "media")])
+    assert listing == {
+        str(tree): ["single.mp3"],
+        str(tree / "album"): ["one.mp3"],
+        str(tree / "album" / "disc2"): ["two.mp3"],
+    }
+
+
+def test_only_changed_folders_are_rescanned(tree, capsys):
+    common.scan_input_tree(str(tree))
+    assert "4 rescanned" in capsys.readouterr().out
+    assert "0 rescanned" in (common.scan_input_tree(str(tree)) and capsys.readouterr().out)
+
+    (tree / "album" / "three.mp3").write_bytes(b"x")
+    os.utime(tree / "album", ns=(0, os.stat(tree / "album").st_mtime_ns + 10 ** 9))
+    listing = common.scan_input_tree(str(tree))
+    assert "1 rescanned" in capsys.readouterr().out
+    assert listing[str(tree / "album")] == ["one.mp3", "three.mp3"]
+
+
+def test_outputs_mirror_the_input_folders(tree):
+    name, output_path = common.get_output_for(str(tree / "album" / "disc2" / "two.mp3"))
+    assert name == os.path.join("album", "disc2", "two")
+    assert output_path == os.path.join(common.OUTPUT_DIR, "album", "disc2", "two.mp4")
+    assert common.get_output_for("/elsewhere/song.mp3", "mix/final.mp4")[0] == os.path.join("mix", "final")
+
+
+@pytest.mark.parametrize("app", [app_main, app_videos], ids=["main", "videos"])
+def test_manifest_rows_become_jobs(app, tmp_path, capsys):
+    (tmp_path / "song.mp3").write_bytes(b"x")
+    (tmp_path / "cover.png").write_bytes(b"x")
+    manifest = tmp_path / "jobs.csv"
+    manifest.write_text(
+        "Audio,Image,Title,Preset,Output\n"
+        "song.mp3,cover.png,My Song,no-such-preset,mix/song.mp4\n"
+        "missing.mp3,cover.png,,,\n"
+    )
+    jobs = app.load_manifest_jobs(str(manifest))
+    assert len(jobs) == 1
+    assert jobs[0]["audio"] == str(tmp_path / "song.mp3")
+    assert jobs[0]["output"] == os.path.join(common.OUTPUT_DIR, "mix", "song.mp4")
+    assert jobs[0]["overrides"] == {"title": "My Song"}
+    out = capsys.readouterr().out
+    assert "unknown preset 'no-such-preset'" in out
+    assert "Manifest row 2: missing audio" in out
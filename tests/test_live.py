@@ -0,0 +1,34 @@
+import os
+
+import app_common as common
+
+
+def test_stream_urls_pick_their_muxer():
+    assert common.get_live_output_args("rtmp://host/live/key") == ["-f", "flv", "rtmp://host/live/key"]
+    assert common.get_live_output_args("SRT://host:9000") == ["-f", "mpegts", "SRT://host:9000"]
+    assert common.get_live_output_args("ftp://host/stream") is None
+
+
+def test_local_target_is_an_hls_folder(tmp_path):
+    target = str(tmp_path / "hls")
+    args = common.get_live_output_args(target)
+    assert os.path.isdir(target)
+    assert args[:2] == ["-f", "hls"] and args[-1] == os.path.join(target, "stream.m3u8")
+
+
+def test_backgrounds_repeat_to_cover_each_track(tmp_path):
+    tracks = [
+        {"audio": "/a/one's.flac", "background": "/b/one.mp4", "duration": 25.0, "loop_period": 10.0},
+        {"audio": "/a/two.flac", "background": "/b/two.mp4", "duration": 8.0, "loop_period": 10.0},
+    ]
+    video_list, audio_list = tmp_path / "video.txt", tmp_path / "audio.txt"
+    common.write_live_lists(tracks, str(video_list), str(audio_list))
+    assert audio_list.read_text().splitlines() == [
+        "ffconcat version 1.0", "file '/a/one'\\''s.flac'", "file '/a/two.flac'"]
+    assert video_list.read_text().splitlines() == [
+        "ffconcat version 1.0",
+        "file '/b/one.mp4'", "duration 10.000000",
+        "file '/b/one.mp4'", "duration 10.000000",
+        "file '/b/one.mp4'", "outpoint 5.000000", "duration 5.000000",
+        "file '/b/two.mp4'", "outpoint 8.000000", "duration 8.000000",
+    ]
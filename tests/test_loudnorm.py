@@ -0,0 +1,54 @@
+import pytest
+
+import app_common as common
+
+STATS = {"input_i": "-20.51", "input_tp": "-3.02", "input_lra": "6.40",
+         "input_thresh": "-30.70", "target_offset": "0.28"}
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(common, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(common, "ANALYSIS_INDEX_PATH", str(tmp_path / "cache" / "analysis_index.json"))
+
+
+@pytest.fixture
+def song(tmp_path):
+    path = tmp_path / "song.wav"
+    path.write_bytes(b"RIFF")
+    return str(path)
+
+
+def fake_measure(calls, stats=STATS):
+    def measure(audio_path, target):
+        calls.append(target)
+        return dict(stats)
+    return measure
+
+
+def test_second_pass_uses_measured_values(monkeypatch, song):
+    calls = []
+    monkeypatch.setattr(common, "measure_loudness", fake_measure(calls))
+    assert common.get_loudnorm_filter(song) == (
+        "loudnorm=I=-14.0:TP=-1.5:LRA=11.0:"
+        "measured_I=-20.51:measured_TP=-3.02:measured_LRA=6.40:measured_thresh=-30.70:"
+        "offset=0.28:linear=true"
+    )
+    assert calls == ["I=-14.0:TP=-1.5:LRA=11.0"]
+
+
+def test_measurement_is_cached_per_target(monkeypatch, song):
+    calls = []
+    monkeypatch.setattr(common, "measure_loudness", fake_measure(calls))
+    first = common.get_loudnorm_filter(song)
+    assert common.get_loudnorm_filter(song) == first
+    assert len(calls) == 1
+
+    monkeypatch.setattr(common, "LOUDNORM_TARGET", {"I": -16.0, "TP": -1.0, "LRA": 11.0})
+    assert common.get_loudnorm_filter(song).startswith("loudnorm=I=-16.0:TP=-1.0:LRA=11.0:")
+    assert len(calls) == 2
+
+
+def test_silent_track_is_left_alone(monkeypatch, song):
+    monkeypatch.setattr(common, "measure_loudness", fake_measure([], dict(STATS, input_i="-inf")))
+    assert common.get_loudnorm_filter(song) is None
@@ -0,0 +1,39 @@
+import pytest
+
+import app_common as common
+
+
+@pytest.fixture(autouse=True)
+def fresh_metrics(monkeypatch):
+    monkeypatch.setattr(common, "METRICS", {})
+
+
+def test_counters_and_gauges():
+    common.metric_inc("visualizer_jobs_started_total", preset_type="bars")
+    common.metric_inc("visualizer_jobs_started_total", preset_type="bars")
+    common.metric_inc("visualizer_bytes_written_total", 1024)
+    common.metric_set("visualizer_queue_depth", 0.5)
+    text = common.render_metrics()
+    assert "# TYPE visualizer_jobs_started_total counter\n" in text
+    assert 'visualizer_jobs_started_total{preset_type="bars"} 2\n' in text
+    assert "visualizer_bytes_written_total 1024\n" in text
+    assert "visualizer_queue_depth 0.5\n" in text
+    assert "visualizer_jobs_failed_total" not in text
+
+
+def test_histogram_buckets_are_cumulative():
+    for seconds in (3, 20, 7200):
+        common.metric_observe("visualizer_stage_seconds", seconds, stage="compose")
+    lines = common.render_metrics().splitlines()
+    assert 'visualizer_stage_seconds_bucket{stage="compose",le="1"} 0' in lines
+    assert 'visualizer_stage_seconds_bucket{stage="compose",le="5"} 1' in lines
+    assert 'visualizer_stage_seconds_bucket{stage="compose",le="30"} 2' in lines
+    assert 'visualizer_stage_seconds_bucket{stage="compose",le="3600"} 2' in lines
+    assert 'visualizer_stage_seconds_bucket{stage="compose",le="+Inf"} 3' in lines
+    assert 'visualizer_stage_seconds_sum{stage="compose"} 7223' in lines
+    assert 'visualizer_stage_seconds_count{stage="compose"} 3' in lines
+
+
+def test_label_values_are_escaped():
+    common.metric_inc("visualizer_jobs_failed_total", preset_type='say "hi"\\')
+    assert 'visualizer_jobs_failed_total{preset_type="say \\"hi\\"\\\\"} 1' in common.render_metrics()
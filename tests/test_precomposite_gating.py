@@ -0,0 +1,80 @@
+import os
+
+import numpy as np
+import pytest
+
+import app_common as common
+import app_main
+import app_videos
+
+DURATIONS = {"song.mp3": 120.0, "loop.mp4": 10.0}
+
+
+@pytest.fixture(params=[app_main, app_videos], ids=["main", "videos"])
+def app(request, monkeypatch, tmp_path):
+    module = request.param
+    for name in ("SCRATCH_DIR", "PRECOMPOSITE_DIR", "CACHE_DIR"):
+        monkeypatch.setattr(common, name, str(tmp_path / name.lower()))
+        os.makedirs(getattr(common, name))
+    monkeypatch.setattr(common, "TEMP_FILES", [])
+    monkeypatch.setattr(common, "RENDER_STATS", [])
+    monkeypatch.setattr(common, "get_duration", lambda path: DURATIONS[os.path.basename(path)])
+    monkeypatch.setattr(common, "wait_for_scratch_space", lambda required: True)
+    monkeypatch.setattr(common, "get_silent_ranges", lambda *args: [])
+    monkeypatch.setattr(common, "get_loudness_envelope", lambda path: np.zeros(0, dtype=np.float32))
+    monkeypatch.setattr(common, "prepare_audio_track", lambda *args: "track.m4a")
+    monkeypatch.setattr(module, "make_contact_sheet", lambda *args: True)
+    monkeypatch.setattr(module, "save_layout", lambda *args: None)
+    monkeypatch.setattr(common, "publish_output",
+                        lambda scratch, final, *args: open(final, "wb").close() or True)
+    if module is app_videos:
+        monkeypatch.setattr(module, "create_text_overlay",
+                            lambda text, style, path, *args: open(path, "wb").close() or True)
+    return module
+
+
+def render(app, monkeypatch, tmp_path, preview=False):
+    """Render a 120s song over a 10s loop; return the compose command"""
+    calls = []
+    monkeypatch.setattr(common, "run_with_progress",
+                        lambda cmd, *args, **kwargs: calls.append(cmd) or open(cmd[-1], "wb").close() or True)
+    for name in ("cover.png", "loop.mp4", "song.mp3"):
+        (tmp_path / name).write_bytes(b"x")
+    loop, audio, output = (str(tmp_path / name) for name in ("loop.mp4", "song.mp3", "song.mp4"))
+    layout = {"preset": app.WAVEFORM_PRESETS[0], "overlay": loop, "video": loop, "seed": 1,
+              "text_style": {"name": "plain"}}
+    if app is app_main:
+        assert app.render_visualizer(layout, str(tmp_path / "cover.png"), audio, output, preview)
+    else:
+        assert app.render_visualizer(layout, audio, output, preview)
+    return next(cmd for cmd in reversed(calls) if "-filter_complex" in cmd and "[v]" in " ".join(cmd))
+
+
+def precomposites(cmd):
+    return [cmd[i + 1] for i, arg in enumerate(cmd) if arg == "-i" and cmd[i + 1].startswith(common.PRECOMPOSITE_DIR)]
+
+
+def test_background_is_composed_live_by_default(app, monkeypatch, tmp_path):
+    assert not common.PRECOMPOSITE_ENABLED
+    cmd = render(app, monkeypatch, tmp_path)
+    assert precomposites(cmd) == []
+
+
+def test_opt_in_loops_the_precomposite(app, monkeypatch, tmp_path):
+    monkeypatch.setattr(common, "PRECOMPOSITE_ENABLED", True)
+    cmd = render(app, monkeypatch, tmp_path)
+    [path] = precomposites(cmd)
+    assert "-stream_loop" in cmd[:cmd.index(path)]
+
+
+def test_song_shorter_than_the_loops_is_composed_live(app, monkeypatch, tmp_path):
+    monkeypatch.setattr(common, "PRECOMPOSITE_ENABLED", True)
+    monkeypatch.setitem(DURATIONS, "song.mp3", common.PRECOMPOSITE_MIN_LOOPS * 10.0 - 1)
+    cmd = render(app, monkeypatch, tmp_path)
+    assert precomposites(cmd) == []
+
+
+def test_preview_never_precomposes(app, monkeypatch, tmp_path):
+    monkeypatch.setattr(common, "PRECOMPOSITE_ENABLED", True)
+    cmd = render(app, monkeypatch, tmp_path, preview=True)
+    assert precomposites(cmd) == []
@@ -0,0 +1,54 @@
+import os
+
+import app_common as common
+import app_main
+import app_videos
+
+
+def fake_render(calls):
+    """run_with_progress stand-in that writes the output file"""
+    def run(cmd, desc=None, duration=None, stall_timeout=None):
+        calls.append(cmd)
+        open(cmd[-1], "wb").close()
+        return True
+    return run
+
+
+def test_main_key_follows_format_plan(monkeypatch, tmp_path):
+    image_path = tmp_path / "cover.png"
+    image_path.write_bytes(b"png")
+    calls = []
+    monkeypatch.setattr(common, "PRECOMPOSITE_DIR", str(tmp_path / "precomposite"))
+    monkeypatch.setattr(common, "run_with_progress", fake_render(calls))
+
+    def precomposite():
+        return app_main.get_precomposite(str(image_path), None, 1080, 1080, 30, 60.0, always=True)
+
+    monkeypatch.setattr(common, "FORMAT_PLAN_ENABLED", True)
+    planned = precomposite()
+    assert precomposite() == planned
+    assert len(calls) == 1
+
+    monkeypatch.setattr(common, "FORMAT_PLAN_ENABLED", False)
+    unplanned = precomposite()
+    assert unplanned != planned
+    assert len(calls) == 2
+    assert os.path.exists(planned) and os.path.exists(unplanned)
+
+
+def test_videos_key_follows_format_plan(monkeypatch, tmp_path):
+    video_path = tmp_path / "clip.mp4"
+    video_path.write_bytes(b"mp4")
+
+    def path():
+        return app_videos.get_precomposite_path(str(video_path), "Song", {"font": "x"}, 1920, 1080, 30)
+
+    monkeypatch.setattr(common, "FORMAT_PLAN_ENABLED", True)
+    planned = path()
+    assert path() == planned
+    monkeypatch.setattr(common, "FORMAT_PLAN_ENABLED", False)
+    assert path() != planned
+
+
+def test_format_plan_is_sent_to_workers():
+    assert "FORMAT_PLAN_ENABLED" in common.DISTRIBUTED_SETTINGS
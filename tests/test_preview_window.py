@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+
+import app_common as common
+
+
+def envelope(stretches):
+    """Build an RMS envelope from (seconds, level) stretches"""
+    return np.concatenate([np.full(int(round(seconds / common.ENVELOPE_HOP)), level, dtype=np.float32)
+                           for seconds, level in stretches])
+
+
+def test_loudest_window_is_found():
+    levels = envelope([(20, 0.1), (10, 0.8), (30, 0.2)])
+    assert common.find_loudest_window(levels, 10, 60) == pytest.approx(20)
+
+
+def test_window_stays_inside_the_song():
+    levels = envelope([(50, 0.1), (10, 0.9)])
+    assert common.find_loudest_window(levels, 10, 55) == pytest.approx(45)
+
+
+def test_short_or_empty_audio_starts_at_zero():
+    assert common.find_loudest_window(envelope([(5, 0.5)]), 30, 5) == 0.0
+    assert common.find_loudest_window(np.zeros(0, dtype=np.float32), 30, 60) == 0.0
@@ -0,0 +1,57 @@
+import errno
+import os
+
+import pytest
+
+import app_common as common
+
+
+@pytest.fixture(autouse=True)
+def temp_files(monkeypatch):
+    monkeypatch.setattr(common, "TEMP_FILES", [])
+
+
+@pytest.fixture
+def scratch(tmp_path):
+    path = tmp_path / "scratch" / "_tmp_render.mp4"
+    path.parent.mkdir()
+    path.write_bytes(b"render")
+    common.TEMP_FILES.append(str(path))
+    return str(path)
+
+
+def test_valid_render_is_moved_into_place(monkeypatch, scratch, tmp_path):
+    monkeypatch.setattr(common, "validate_output", lambda *args: True)
+    final = tmp_path / "output" / "album" / "song.mp4"
+    assert common.publish_output(scratch, str(final), 30.0)
+    assert final.read_bytes() == b"render"
+    assert not os.path.exists(scratch)
+    assert common.TEMP_FILES == []
+
+
+def test_invalid_render_is_not_published(monkeypatch, scratch, tmp_path):
+    monkeypatch.setattr(common, "validate_output", lambda *args: False)
+    final = tmp_path / "song.mp4"
+    final.write_bytes(b"previous")
+    assert not common.publish_output(scratch, str(final), 30.0)
+    assert final.read_bytes() == b"previous"
+    assert os.path.exists(scratch)
+
+
+def test_other_filesystem_is_copied_then_renamed(monkeypatch, scratch, tmp_path):
+    real_replace = os.replace
+    renamed = []
+
+    def replace(src, dst):
+        if src == scratch:
+            raise OSError(errno.EXDEV, "Invalid cross-device link")
+        renamed.append(os.path.basename(src))
+        real_replace(src, dst)
+
+    monkeypatch.setattr(os, "replace", replace)
+    final = tmp_path / "output" / "song.mp4"
+    assert common.publish_output(scratch, str(final))
+    assert final.read_bytes() == b"render"
+    assert renamed == [f".song.mp4.{os.getpid()}.partial"]
+    assert not os.path.exists(scratch)
+    assert common.TEMP_FILES == []
@@ -0,0 +1,55 @@
+import os
+
+import numpy as np
+import pytest
+
+import app_common as common
+
+
+@pytest.fixture(autouse=True)
+def radial_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(common, "RADIAL_LUT_DIR", str(tmp_path / "radial"))
+
+
+def read_pgm(path):
+    with open(path, "rb") as f:
+        magic, dims, maxval = (f.readline().split() for _ in range(3))
+        assert magic == [b"P5"] and maxval == [b"65535"]
+        width, height = map(int, dims)
+        return np.frombuffer(f.read(), dtype=">u2").reshape(height, width)
+
+
+def test_maps_cover_the_ring():
+    size = 200
+    xmap_path, ymap_path, src_width, src_height = common.get_radial_maps(size, 0.35, 0.95)
+    xmap, ymap = read_pgm(xmap_path), read_pgm(ymap_path)
+    assert xmap.shape == ymap.shape == (size, size)
+
+    center = size // 2
+    # Inside the inner radius and in the corners: out of range, filled by remap
+    assert xmap[center, center] == src_width and ymap[center, center] == src_height
+    assert xmap[0, 0] == src_width
+
+    ring_row = center - int(size / 2 * 0.65)
+    # 12 o'clock is the lowest frequency, 6 o'clock the highest
+    assert xmap[ring_row, center] <= 1
+    assert xmap[size - 1 - ring_row, center] >= src_width - 2
+    # Bars grow outwards: the inner edge is the spectrum's baseline row, the outer edge its top
+    inner_row = center - int(size / 2 * 0.35) - 1
+    outer_row = center - int(size / 2 * 0.95) + 1
+    assert ymap[inner_row, center] >= src_height - 2
+    assert ymap[outer_row, center] <= 1
+    # Both halves mirror each other
+    inside = xmap < src_width
+    assert np.array_equal(xmap, xmap[:, ::-1])
+    # Mapped values stay inside the source spectrum frame
+    assert xmap[inside].max() <= src_width - 1
+    assert ymap[ymap < src_height].max() <= src_height - 1
+
+
+def test_maps_are_cached(monkeypatch):
+    first = common.get_radial_maps(120, 0.35, 0.95)
+    mtimes = [os.stat(path).st_mtime_ns for path in first[:2]]
+    monkeypatch.setattr(common.np, "mgrid", None)  # Would fail if the tables were rebuilt
+    assert common.get_radial_maps(120, 0.35, 0.95) == first
+    assert [os.stat(path).st_mtime_ns for path in first[:2]] == mtimes
@@ -0,0 +1,27 @@
+import os
+
+import pytest
+
+import app_common as common
+
+
+@pytest.fixture(autouse=True)
+def scratch_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(common, "SCRATCH_DIR", str(tmp_path / "scratch"))
+
+
+def test_branches_split_off_the_composed_video():
+    graph = common.build_sidecar_graph(10.0, 8.5)
+    assert graph.startswith(";[v]split=3[v_main][still_src][anim_src]")
+    assert "select='gte(t,10.000)'" in graph
+    assert f"trim=start=8.500:end={8.5 + common.ANIMATION_SECONDS:.3f}" in graph
+    assert f"scale={common.THUMBNAIL_WIDTH}:-2[thumb]" in graph
+    assert graph.endswith(f"fps={common.ANIMATION_FPS},scale={common.ANIMATION_WIDTH}:-2[anim]")
+
+
+def test_sidecars_sit_next_to_the_video(tmp_path):
+    outputs = common.get_sidecar_outputs(str(tmp_path / "out" / "song.mp4"))
+    assert [final for _, final, _ in outputs] == [
+        str(tmp_path / "out" / name) for name in ("song.thumb.jpg", "song.poster.jpg", "song.anim.webp")]
+    assert all(os.path.dirname(scratch) == common.SCRATCH_DIR for scratch, _, _ in outputs)
+    assert [args[args.index("-map") + 1] for _, _, args in outputs] == ["[thumb]", "[poster]", "[anim]"]
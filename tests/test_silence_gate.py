@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+import app_common as common
+
+QUIET_DBFS = -60
+
+
+@pytest.fixture(autouse=True)
+def no_loudnorm(monkeypatch):
+    monkeypatch.setattr(common, "LOUDNORM_ENABLED", False)
+
+
+def envelope_with_gap(level, seconds=3.0):
+    """Loud second, `seconds` at `level` RMS, loud second"""
+    loud = np.full(int(1.0 / common.ENVELOPE_HOP), 0.3, dtype=np.float32)
+    gap = np.full(int(seconds / common.ENVELOPE_HOP), level, dtype=np.float32)
+    return np.concatenate((loud, gap, loud))
+
+
+def preset_with_scale(ascale):
+    return {"type": "bars", "scale": ascale}
+
+
+def bar_pixels(rms, ascale):
+    """Tallest bar a sine of this RMS draws on the tallest layer"""
+    amplitude = rms * np.sqrt(2)
+    exponent = common.SILENCE_SCALE_EXPONENTS[ascale]
+    return amplitude ** (1.0 / exponent) * common.SILENCE_BAR_PIXELS
+
+
+@pytest.mark.parametrize("ascale", ["lin", "sqrt", "cbrt"])
+def test_threshold_never_hides_a_visible_bar(ascale):
+    threshold = common.get_silence_threshold(ascale)
+    assert bar_pixels(threshold, ascale) < 1.0
+
+
+@pytest.mark.parametrize("ascale", ["sqrt", "cbrt"])
+def test_quiet_passage_still_drawn_under_root_scales(monkeypatch, ascale):
+    level = 10 ** (QUIET_DBFS / 20)
+    assert bar_pixels(level, ascale) >= 1.0
+
+    envelope = envelope_with_gap(level)
+    monkeypatch.setattr(common, "get_loudness_envelope", lambda path: envelope)
+    assert common.get_silent_ranges(preset_with_scale(ascale), "song.wav") == []
+
+
+@pytest.mark.parametrize("ascale", ["lin", "sqrt", "cbrt", "log"])
+def test_digital_silence_is_gated_for_every_scale(monkeypatch, ascale):
+    envelope = envelope_with_gap(0.0)
+    monkeypatch.setattr(common, "get_loudness_envelope", lambda path: envelope)
+    ranges = common.get_silent_ranges(preset_with_scale(ascale), "song.wav")
+    assert len(ranges) == 1
+    start, end = ranges[0]
+    assert start == pytest.approx(1.0, abs=2 * common.ENVELOPE_HOP)
+    assert end == pytest.approx(4.0, abs=2 * common.ENVELOPE_HOP)
+
+
+def test_loudnorm_gates_only_true_silence(monkeypatch):
+    monkeypatch.setattr(common, "LOUDNORM_ENABLED", True)
+    for ascale in ("lin", "sqrt", "cbrt", "log"):
+        assert common.get_silence_threshold(ascale) <= common.SILENCE_THRESHOLD_DIGITAL
+
+
+def test_envelope_is_decoded_once_per_song(monkeypatch, tmp_path):
+    monkeypatch.setattr(common, "ANALYSIS_CACHE_DIR", str(tmp_path / "analysis"))
+    monkeypatch.setattr(common, "ANALYSIS_INDEX_PATH", str(tmp_path / "analysis.json"))
+    monkeypatch.setattr(common, "CACHE_DIR", str(tmp_path))
+    song = tmp_path / "song.wav"
+    song.write_bytes(b"x")
+    decodes = []
+    samples = np.full(common.ENVELOPE_SAMPLE_RATE * 2, 0.5, dtype=np.float32)
+    monkeypatch.setattr(common, "decode_mono", lambda path, rate: decodes.append(path) or samples)
+
+    first = common.get_loudness_envelope(str(song))
+    assert len(first) == int(2 / common.ENVELOPE_HOP)
+    assert np.array_equal(common.get_loudness_envelope(str(song)), first)
+    assert len(decodes) == 1
+    assert "envelope" in next(iter(common.load_analysis_index().values()))
+
+    # A different hop is a different envelope
+    monkeypatch.setattr(common, "ENVELOPE_HOP", 0.05)
+    assert len(common.get_loudness_envelope(str(song))) == int(2 / 0.05)
+    assert len(decodes) == 2
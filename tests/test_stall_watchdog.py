@@ -0,0 +1,101 @@
+import sys
+
+import pytest
+
+import app_common as common
+import app_main
+import app_videos
+
+
+def emit(lines, interval, tail_sleep=0.0):
+    """Command printing ffmpeg-style stats lines to stderr"""
+    script = (
+        "import sys, time\n"
+        f"for line in {lines!r}:\n"
+        "    sys.stderr.write(line + '\\r'); sys.stderr.flush()\n"
+        f"    time.sleep({interval})\n"
+        f"time.sleep({tail_sleep})\n"
+    )
+    return [sys.executable, "-c", script]
+
+
+@pytest.fixture(autouse=True)
+def short_timeout(monkeypatch):
+    monkeypatch.setattr(common, "STALL_TIMEOUT", 1)
+    monkeypatch.setattr(common, "STALL_EVENTS", [])
+
+
+def test_silent_process_is_killed_and_recorded():
+    assert not common.run_with_progress(emit([], 0, tail_sleep=30), "  ├─ Hanging", 10)
+    assert len(common.STALL_EVENTS) == 1
+    assert common.STALL_EVENTS[0]["reason"] == "no progress for 1s"
+    assert common.STALL_EVENTS[0]["wall_seconds"] < 10
+
+
+def test_advancing_time_keeps_stage_alive():
+    lines = [f"frame=0 fps=0.0 time=00:00:0{i}.00 speed=1.0x" for i in range(6)]
+    assert common.run_with_progress(emit(lines, 0.4), "  ├─ Encoding", 5)
+    assert common.STALL_EVENTS == []
+
+
+def test_advancing_frames_without_time_keep_stage_alive():
+    lines = [f"frame={i} fps=1.0 size=N/A time=N/A bitrate=N/A speed=N/A" for i in range(1, 7)]
+    assert common.run_with_progress(emit(lines, 0.4), "  ├─ Encoding", 5)
+    assert common.STALL_EVENTS == []
+
+
+def test_single_frame_stage_can_opt_out():
+    # A contact sheet reports nothing until its only frame is written at the end
+    assert common.run_with_progress(emit(["frame=0 time=N/A"], 0, tail_sleep=2.5), "  └─ Sheet", 5,
+                                 stall_timeout=0)
+    assert common.STALL_EVENTS == []
+
+
+def test_trailer_after_the_last_frame_is_not_a_stall():
+    lines = ["frame=1 time=00:00:01.00 speed=1.0x", "frame=2 time=00:00:02.00 speed=1.0x"]
+    assert common.run_with_progress(emit(lines, 0.1, tail_sleep=2.5), "  └─ Composing", 2)
+    assert common.STALL_EVENTS == []
+
+
+def test_slow_speed_is_killed(monkeypatch):
+    monkeypatch.setattr(common, "STALL_TIMEOUT", 30)
+    monkeypatch.setattr(common, "STALL_SLOW_SECONDS", 1)
+    lines = [f"frame={i} time=00:00:0{i}.00 speed=0.001x" for i in range(1, 10)]
+    assert not common.run_with_progress(emit(lines, 0.4), "  ├─ Crawling", 60)
+    assert common.STALL_EVENTS[0]["reason"].startswith("below")
+
+
+@pytest.mark.parametrize("app", [app_main, app_videos], ids=["main", "videos"])
+def test_contact_sheet_disables_watchdog(app, monkeypatch):
+    calls = []
+    monkeypatch.setattr(common, "run_with_progress", lambda *args, **kwargs: calls.append(kwargs) or True)
+    layout = {"preset": app.WAVEFORM_PRESETS[0], "overlay": None, "video": "clip.mp4"}
+    if app is app_main:
+        app.make_contact_sheet("image.jpg", "song.mp3", layout, 600.0, "sheet.png")
+    else:
+        app.make_contact_sheet("song.mp3", layout, None, 600.0, "sheet.png")
+    assert calls == [{"stall_timeout": 0}]
+
+
+@pytest.mark.parametrize("app", [app_main, app_videos], ids=["main", "videos"])
+@pytest.mark.parametrize("segment, expected", [(None, 2), ({"start": 0.0, "length": 10.0, "path": "s.mp4"}, 1)])
+def test_segments_are_not_retried_lighter(app, monkeypatch, tmp_path, segment, expected):
+    attempts = []
+
+    def stalling_render(layout, *args):
+        attempts.append(layout)
+        common.STALL_EVENTS.append({"stage": "compose", "reason": "no progress for 1s"})
+        return False
+
+    monkeypatch.setattr(app, "render_visualizer", stalling_render)
+    monkeypatch.setattr(common, "STALL_LOG_PATH", str(tmp_path / "stalls.jsonl"))
+    monkeypatch.setattr(common, "USAGE_LOG_PATH", None)
+    monkeypatch.setattr(app, "STALL_FALLBACKS", ("fast_preset",))
+    layout = {"preset": app.WAVEFORM_PRESETS[0], "overlay": None, "video": "clip.mp4", "seed": 1}
+    if app is app_main:
+        app.make_visualizer("image.jpg", "song.mp3", "out.mp4", segment=segment, layout=layout)
+    else:
+        app.make_visualizer("song.mp3", "out.mp4", segment=segment, layout=layout)
+    # A segment keeps the encode settings the other segments of its track use
+    assert len(attempts) == expected
+    assert attempts[-1].get("encode_args") == (None if segment else common.STALL_FAST_ENCODE_ARGS)
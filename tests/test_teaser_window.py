@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+import app_common as common
+
+
+@pytest.fixture(autouse=True)
+def busy_song(monkeypatch):
+    # 5s quiet, 30s evenly loud, 10s quiet, then 30s of loud hits over a quieter bed
+    hops = int(round(1 / common.ENVELOPE_HOP))
+    envelope = np.concatenate([
+        np.full(5 * hops, 0.05), np.full(30 * hops, 0.6), np.full(10 * hops, 0.05),
+        np.tile([0.2, 0.6], 15 * hops), np.full(5 * hops, 0.05),
+    ]).astype(np.float32)
+    monkeypatch.setattr(common, "get_loudness_envelope", lambda audio_path: envelope)
+    monkeypatch.setattr(common, "TEASER_SNAP_BEATS", False)
+
+
+def test_onsets_favour_the_busy_section():
+    assert common.find_teaser_window("song.mp3", 30, 80) == pytest.approx(45, abs=0.5)
+
+
+def test_loudness_alone_favours_the_even_section(monkeypatch):
+    monkeypatch.setattr(common, "TEASER_ONSET_WEIGHT", 0.0)
+    assert common.find_teaser_window("song.mp3", 30, 80) == pytest.approx(5, abs=0.5)
+
+
+def test_start_snaps_to_the_nearest_usable_beat(monkeypatch):
+    monkeypatch.setattr(common, "TEASER_SNAP_BEATS", True)
+    beats = np.array([10.0, 44.2, 46.0, 60.0], dtype=np.float32)
+    monkeypatch.setattr(common, "get_beat_map", lambda audio_path: {"beat_times": beats})
+    assert common.find_teaser_window("song.mp3", 30, 80) == pytest.approx(44.2)
+    # Beats too late to fit a whole window are never picked
+    assert common.find_teaser_window("song.mp3", 30, 72) == pytest.approx(10.0)
+
+
+def test_song_shorter_than_the_teaser():
+    assert common.find_teaser_window("song.mp3", 30, 20) == 0.0
+
+
+def test_fades_shrink_for_short_teasers():
+    assert common.get_teaser_fades(30) == (f"fade=t=in:d={common.TEASER_FADE_SECONDS:.2f},"
+                                        f"fade=t=out:st={30 - common.TEASER_FADE_SECONDS:.2f}:"
+                                        f"d={common.TEASER_FADE_SECONDS:.2f}")
+    assert common.get_teaser_fades(1, audio=True) == "afade=t=in:d=0.25,afade=t=out:st=0.75:d=0.25"
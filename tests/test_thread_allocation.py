@@ -0,0 +1,63 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import app_common as common
+
+
+@pytest.fixture(autouse=True)
+def one_host(monkeypatch, tmp_path):
+    monkeypatch.setattr(common, "JOB_CONCURRENCY", None)
+    monkeypatch.setattr(common, "RENDER_SLOTS_DIR", str(tmp_path / "render_slots"))
+    monkeypatch.setattr(common, "get_cpu_budget", lambda: 16)
+    monkeypatch.setattr(common, "load_thread_profile", lambda: None)
+
+
+def add_slot(pid):
+    os.makedirs(common.RENDER_SLOTS_DIR, exist_ok=True)
+    open(os.path.join(common.RENDER_SLOTS_DIR, f"{common.platform.node()}_{pid}"), "w").close()
+
+
+def test_share_shrinks_with_concurrency():
+    alone = common.allocate_threads(1)
+    shared = common.allocate_threads(4)
+    assert sum(alone.values()) > sum(shared.values())
+    assert shared["filter"] + shared["encoder"] <= 16 // 4
+    assert all(count >= 1 for count in common.allocate_threads(64).values())
+
+
+def test_flag_overrides_slot_count(monkeypatch):
+    monkeypatch.setattr(common, "JOB_CONCURRENCY", 3)
+    add_slot(os.getpid())
+    assert common.get_job_concurrency() == 3
+
+
+def test_counts_live_slots_on_this_host():
+    assert common.get_job_concurrency() == 1
+    sleeper = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+    try:
+        add_slot(os.getpid())
+        add_slot(sleeper.pid)
+        open(os.path.join(common.RENDER_SLOTS_DIR, "otherhost_1"), "w").close()
+        assert common.get_job_concurrency() == 2
+        assert common.allocate_threads() == common.allocate_threads(2)
+    finally:
+        sleeper.kill()
+        sleeper.wait()
+
+
+def test_stale_slot_is_removed():
+    dead = subprocess.Popen([sys.executable, "-c", "pass"])
+    dead.wait()
+    add_slot(dead.pid)
+    add_slot(os.getpid())
+    assert common.get_job_concurrency() == 1
+    assert os.listdir(common.RENDER_SLOTS_DIR) == [f"{common.platform.node()}_{os.getpid()}"]
+
+
+def test_claim_render_slot_registers_this_process():
+    common.claim_render_slot()
+    assert os.path.exists(os.path.join(common.RENDER_SLOTS_DIR, f"{common.platform.node()}_{os.getpid()}"))
+    assert common.get_job_concurrency() == 1